@@ -1,5 +1,6 @@
 
 #include <stdio.h>
+#include <stdlib.h>
 #include <time.h>
 #include <math.h>
 #include <string.h>
@@ -14,6 +15,7 @@ int main (int argc, char **argv)
   int  ntimes = 2;
   int  core = 0;
   int  i=0;
+  int  failed = 0;
 
 #ifdef RUNTIME
   //clock_t begin, end;
@@ -34,6 +36,8 @@ int main (int argc, char **argv)
   strcat(path,language);
   //Test name
   strcpy(test,argv[3]);
+  //Number of trials, 2 when not given
+  if (argc > 4) ntimes = atoi(argv[4]);
  
 
   fp = fopen(path,"a");
@@ -55,7 +59,8 @@ int main (int argc, char **argv)
 	
 	rapl_before(fp,core);
 	
-        system(command);
+        //a command that fails is reported through the exit code, after its trial is written
+        if (system(command) != 0) failed = 1;
 
 	rapl_after(fp,core);
 
@@ -77,5 +82,5 @@ int main (int argc, char **argv)
   fclose(fp);
   fflush(stdout);
 
-  return 0;
+  return failed;
 }
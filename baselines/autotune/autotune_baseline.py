@@ -0,0 +1,239 @@
+import itertools
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+load_dotenv()
+USER_PREFIX = os.getenv('USER_PREFIX')
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../llm/src')))
+from energy.src.benchmark import rapl_measure
+from energy.src.registry import baseline_dir, binary_name, compile_benchmark, compile_with_profile, expected_digest, get_benchmark, load_registry, output_digest, prepare_inputs, run_benchmark, shell_command
+from candidate_index import binary_digest
+
+AUTOTUNE_DIR = os.path.abspath(os.path.dirname(__file__))
+FLAG_SPACE_FILE = os.getenv("AUTOTUNE_FLAG_SPACE", f"{AUTOTUNE_DIR}/flag_space.json")
+BUILD_DIR = f"{AUTOTUNE_DIR}/build"
+RESULTS_DIR = f"{AUTOTUNE_DIR}/results"
+# RAPL/main appends to energy/src/<language>.csv, keep the search apart from the optimizer's c++.csv
+RAPL_LANGUAGE = "autotune"
+
+# Successive halving keeps the best 1/ETA configurations after each rung
+ETA = int(os.getenv("AUTOTUNE_ETA", 3))
+COMPILE_JOBS = int(os.getenv("AUTOTUNE_JOBS", os.cpu_count() or 1))
+TRAINING_INPUT = os.getenv("AUTOTUNE_TRAINING_INPUT", "small")
+# Proxy inputs of the rungs, the production input is always the last rung
+RUNG_INPUTS = ["small", "medium"]
+
+class Configuration():
+    def __init__(self, config_id, flags, env=None, pgo=False):
+        self.config_id = config_id
+        self.flags = flags
+        self.env = env or {}
+        self.pgo = pgo
+        self.binary_path = None
+        self.digest = None
+        # set when the configuration is dropped: compile error, wrong output, ...
+        self.pruned = None
+        self.same_binary_as = None
+        # input size -> (avg_energy, avg_runtime)
+        self.results = {}
+
+    def name(self):
+        parts = list(self.flags) or ["registry flags"]
+        parts += [f"{key}={value}" for key, value in self.env.items()]
+        if self.pgo:
+            parts.append("pgo")
+        return " ".join(parts)
+
+    def to_dict(self):
+        return {
+            "config": self.name(),
+            "flags": self.flags,
+            "env": self.env,
+            "pgo": self.pgo,
+            "pruned": self.pruned,
+            "same_binary_as": self.same_binary_as,
+            "results": self.results
+        }
+
+def load_flag_space(path=FLAG_SPACE_FILE):
+    with open(path, "r") as file:
+        return json.load(file)
+
+def configurations(entry, flag_space):
+    """Every combination of the flag space; OpenMP settings only for OpenMP benchmarks."""
+    compile_dimensions = list(flag_space["compile"].values())
+    env_names = list(flag_space.get("openmp_env", {}).keys())
+    env_dimensions = list(flag_space.get("openmp_env", {}).values())
+    if "-fopenmp" not in entry["compile_flags"]:
+        env_dimensions = [[""] for _ in env_dimensions]
+
+    configs = []
+    for compile_options in itertools.product(*compile_dimensions):
+        flags = [flag for option in compile_options for flag in option.split()]
+        for env_options in itertools.product(*env_dimensions):
+            env = {name: value for name, value in zip(env_names, env_options) if value}
+            for pgo in flag_space.get("pgo", [False]):
+                configs.append(Configuration(len(configs) + 2, flags, env, pgo))
+    return configs
+
+def build(entry, benchmark, config):
+    """Compile one configuration in its own directory, PGO builds are trained first."""
+    directory = f"{BUILD_DIR}/{benchmark}/{config.config_id}"
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    source_path = f"{directory}/{entry['source']}"
+    shutil.copyfile(f"{baseline_dir(benchmark)}/{entry['source']}", source_path)
+    binary_path = f"{directory}/{binary_name(entry['source'])}"
+
+    with open(f"{directory}/build_log.txt", "w") as build_log:
+        if config.pgo:
+            config.pruned = compile_with_profile(entry, source_path, binary_path, build_log, config.flags, TRAINING_INPUT, cwd=directory)
+            if config.pruned is not None:
+                return config
+        elif not compile_benchmark(entry, source_path, binary_path, build_log, config.flags, config.flags, cwd=directory):
+            config.pruned = "compile_error"
+            return config
+
+    config.binary_path = binary_path
+    config.digest = binary_digest(binary_path)
+    return config
+
+def env_prefix(config):
+    return "".join(f"{key}={value} " for key, value in config.env.items())
+
+class Autotuner():
+    """Successive-halving search over compiler flags for one benchmark.
+
+    All configurations are compiled in parallel first. Measurements then run
+    one at a time so concurrent work does not disturb RAPL: every surviving
+    configuration is checked against the reference output and measured on
+    the rung's proxy input, and the best 1/ETA move on to the next rung. The
+    last rung uses the production input.
+    """
+    def __init__(self, benchmark, flag_space):
+        self.benchmark = benchmark
+        self.entry = get_benchmark(benchmark)
+        self.raw = Configuration(0, [])
+        self.o3 = Configuration(1, ["-O3"])
+        self.configs = configurations(self.entry, flag_space)
+        self.reference_digests = {}
+
+    def compile_all(self):
+        configs = [self.raw, self.o3] + self.configs
+        with ThreadPoolExecutor(max_workers=COMPILE_JOBS) as executor:
+            list(executor.map(lambda config: build(self.entry, self.benchmark, config), configs))
+        if self.raw.pruned is not None:
+            raise RuntimeError(f"{self.benchmark} does not compile with the registry flags")
+
+        # configurations that produce the same executable are only measured once
+        seen = {(self.raw.digest, ()): self.raw, (self.o3.digest, ()): self.o3}
+        for config in self.configs:
+            if config.pruned is not None:
+                continue
+            key = (config.digest, tuple(sorted(config.env.items())))
+            if key in seen:
+                config.pruned = "duplicate_binary"
+                config.same_binary_as = seen[key].name()
+            else:
+                seen[key] = config
+        print(f"Autotuner.compile_all: {self.benchmark}: {sum(config.pruned is None for config in self.configs)} of {len(self.configs)} configurations to measure")
+
+    def reference_digest(self, size):
+        if size not in self.reference_digests:
+            digest = expected_digest(self.entry, size)
+            if digest is None:
+                result = run_benchmark(self.entry, self.raw.binary_path, size, cwd=os.path.dirname(self.raw.binary_path))
+                digest = output_digest(result.stdout)
+            self.reference_digests[size] = digest
+        return self.reference_digests[size]
+
+    def measure(self, config, size):
+        directory = os.path.dirname(config.binary_path)
+        try:
+            result = run_benchmark(self.entry, config.binary_path, size, cwd=directory)
+        except subprocess.TimeoutExpired:
+            config.pruned = f"timeout_{size}"
+            return None
+        if result.returncode != 0:
+            config.pruned = f"run_failed_{size}"
+            return None
+        if output_digest(result.stdout) != self.reference_digest(size):
+            config.pruned = f"wrong_output_{size}"
+            return None
+
+        command = env_prefix(config) + shell_command(self.entry, config.binary_path, size, cwd=directory)
+        try:
+            trials = rapl_measure(command, RAPL_LANGUAGE, self.entry["rapl_name"])
+        except subprocess.CalledProcessError as e:
+            config.pruned = f"measure_failed_{size}"
+            print(f"Autotuner.measure: {config.name()}: {e}")
+            return None
+        avg_energy = round(sum(data[1] for data in trials) / len(trials), 3)
+        avg_runtime = round(sum(data[2] for data in trials) / len(trials), 3)
+        config.results[size] = (avg_energy, avg_runtime)
+        print(f"Autotuner.measure: [{size}] {config.name()}  |  Avg Energy (J): {avg_energy}  | Avg Runtime (ms): {avg_runtime}")
+        return avg_energy
+
+    def run(self):
+        self.compile_all()
+        survivors = [config for config in self.configs if config.pruned is None]
+        rungs = [size for size in RUNG_INPUTS if size in self.entry["inputs"] and size != self.entry["production_input"]]
+        rungs.append(self.entry["production_input"])
+        input_error = prepare_inputs(self.entry, rungs)
+        if input_error is not None:
+            raise RuntimeError(f"{self.benchmark} inputs could not be generated: {input_error}")
+
+        for rung, size in enumerate(rungs):
+            for config in survivors:
+                self.measure(config, size)
+            survivors = sorted((config for config in survivors if config.pruned is None), key=lambda config: config.results[size][0])
+            if rung < len(rungs) - 1:
+                keep = max(1, math.ceil(len(survivors) / ETA))
+                for config in survivors[keep:]:
+                    config.pruned = f"halved_{size}"
+                survivors = survivors[:keep]
+            print(f"Autotuner.run: {self.benchmark}: {len(survivors)} configurations left after {size}")
+
+        production = self.entry["production_input"]
+        for config in (self.raw, self.o3):
+            self.measure(config, production)
+        best = survivors[0] if survivors else None
+        return self.report(best, production)
+
+    def report(self, best, size):
+        report = {
+            "benchmark": self.benchmark,
+            "input": size,
+            "raw": self.raw.results.get(size),
+            "O3": self.o3.results.get(size),
+            "best": best.to_dict() if best is not None else None,
+            "configurations": [config.to_dict() for config in self.configs]
+        }
+        if best is not None and report["O3"] is not None:
+            report["best_vs_O3"] = round(1 - best.results[size][0] / report["O3"][0], 4)
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        with open(f"{RESULTS_DIR}/{self.benchmark}.json", "w") as file:
+            json.dump(report, file, indent=4)
+        return report
+
+if __name__ == "__main__":
+    # python3 baselines/autotune/autotune_baseline.py [benchmark ...]
+    flag_space = load_flag_space()
+    full_report = {}
+    for benchmark in sys.argv[1:] or load_registry().keys():
+        try:
+            full_report[benchmark] = Autotuner(benchmark, flag_space).run()
+        except Exception as e:
+            print(f"Error while autotuning {benchmark}: {e}\n")
+
+    #Print out results nicely
+    for benchmark, report in full_report.items():
+        best = report["best"]
+        best_energy = best["results"][report["input"]][0] if best is not None else None
+        print(f"{benchmark}  |  raw (J): {report['raw'] and report['raw'][0]}  |  -O3 (J): {report['O3'] and report['O3'][0]}  |  best (J): {best_energy}  |  {best['config'] if best is not None else 'no valid configuration'}")
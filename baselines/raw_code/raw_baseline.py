@@ -1,10 +1,15 @@
 import os
 import subprocess
+import sys
 from dotenv import load_dotenv
 load_dotenv()
 USER_PREFIX = os.getenv('USER_PREFIX')
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from energy.src.registry import baseline_dir, binary_name, compile_benchmark, load_registry, prepare_inputs, production_input, shell_command
+from energy.src.analytics import BASELINE_RESULTS, save_baseline
+
+rapl_main_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../RAPL/main'))
 
-benchmark_dirs = ["pidigits", "k-nucleotide", "binary-trees", "fannkuch-redux", "n-body", "regex-redux"]
 
 full_report = {}
 
@@ -12,62 +17,36 @@ full_report = {}
 energy_csv_file = open(f"{USER_PREFIX}/energy/data/C++.csv", 'w')
 energy_csv_file.close()
 
-#Iterate through all the folders in benchmarks folder
-for benchmark in benchmark_dirs:
+#RAPL/main reads the counters through the msr module, loaded once for every benchmark
+subprocess.run(["sudo", "modprobe", "msr"], check=True)
+
+#Iterate through all the benchmarks in benchmarks/registry.json
+for benchmark, entry in load_registry().items():
+    directory = baseline_dir(benchmark)
+    binary_path = f"{directory}/{binary_name(entry['source'])}"
+
     #Compile the benchmark's code
-    try:
-        result = subprocess.run("make compile", cwd= f"{USER_PREFIX}/benchmarks/{benchmark}", stderr=subprocess.PIPE, check=True, shell=True)
+    if compile_benchmark(entry, f"{directory}/{entry['source']}", binary_path, extra_flags=None, cwd=directory):
         print(f"Successfully compiled {benchmark}.")
-    except subprocess.CalledProcessError as e:
-        print(f"Error while compiling {benchmark} raw code:")
-        print(e.stderr.decode(), "\n") 
+    else:
+        print(f"Error while compiling {benchmark} raw code, skipped\n")
+        continue
+    
+    #Generate the input files it reads from stdin
+    if prepare_inputs(entry, [production_input(entry)]) is not None:
+        print(f"Error while generating the inputs of {benchmark}, skipped\n")
+        continue
     
     #Run benchmark and measure energy (automatically runs it 5 times as 5 was specified in RAP/main.c)
     try:
-        result = subprocess.run("make measure", cwd= f"{USER_PREFIX}/benchmarks/{benchmark}", stderr=subprocess.PIPE, check=True, shell=True)
+        result = subprocess.run(["sudo", "-E", rapl_main_path, shell_command(entry, binary_path, cwd=directory), "C++", entry["rapl_name"]], cwd=directory, stderr=subprocess.PIPE, check=True)
         print(f"Successfully measured energy data for {benchmark}.")
     except subprocess.CalledProcessError as e:
         print(f"Error while measuring energy for {benchmark}:")
         print(e.stderr.decode(), "\n") 
 
-    
-
-#Now process C++.csv NUM_TRIALS lines at a time and get average energy and runtime values
-energy_data_file = open(f"{USER_PREFIX}/energy/data/C++.csv")
-benchmark_data = []
-
-for line in energy_data_file:
-    parts = line.split(';')
-    benchmark_name = parts[0].strip()
-    energy_data = [vals.strip() for vals in parts[1].split(',')]
-    
-    #Remove empty strings for CPU, GPU, DRAM and convert remaining numbers to floats
-    energy_data = [float(num) for num in energy_data if num]
-    benchmark_data.append((benchmark_name, *energy_data))
-
-# print(benchmark_data)
-
-
-#Find average energy usage and average runtime
-averages = []
-for i in range(0, len(benchmark_data), 5):
-    n_runs_data = benchmark_data[i:i + 5]
-
-    total_energy = 0
-    total_runtime = 0
-    count = 0
-    
-    for data in n_runs_data:
-        total_energy += data[1]
-        total_runtime += data[2]
-        count += 1
-
-    avg_energy = round(total_energy / count, 3)
-    avg_runtime = round(total_runtime / count, 3)
-
-    full_report[n_runs_data[0][0]] = (avg_energy, avg_runtime)
-
-# print(f"{full_report}")
+#Average the trials of every benchmark in C++.csv and keep them for energy/src/analytics.py
+full_report = save_baseline(f"{USER_PREFIX}/energy/data/C++.csv", BASELINE_RESULTS["raw"])
 
 #Print out results nicely
 for benchmark in full_report.keys():
@@ -0,0 +1,437 @@
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+import numpy as np
+from dotenv import load_dotenv
+try:
+    from .registry import match_benchmark, read_result_file
+except ImportError:
+    from registry import match_benchmark, read_result_file
+load_dotenv()
+USER_PREFIX = os.getenv('USER_PREFIX')
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../'))
+#run results: the curated test_results and the latest run of each benchmark; a run found under
+#both is counted once, from the first pattern
+RESULT_PATTERNS = [f"{root_dir}/test_results/*/result_file*.txt", f"{root_dir}/llm/benchmarks_out/*/result_file.txt"]
+REPORT_DIR = f"{root_dir}/energy/reports"
+CACHE_PATH = f"{REPORT_DIR}/runs_cache.npz"
+BASELINE_RESULTS = {
+    "raw": f"{root_dir}/baselines/raw_code/results.json",
+    "O3": f"{root_dir}/baselines/compiler_optimization/results.json"
+}
+AUTOTUNE_RESULTS = f"{root_dir}/baselines/autotune/results"
+KNOWLEDGE_PATH = os.getenv("KNOWLEDGE_PATH", f"{USER_PREFIX}/llm/knowledge_base.jsonl")
+
+# "Program catched 0 compilation_errors and 0 output_errors" after the JSON of older runs
+ERRORS_RE = re.compile(r'(\d+) compilation_errors and (\d+) output_errors')
+
+# Per-run columns; strings are stored as numpy unicode arrays
+RUN_COLUMNS = ("path", "mtime", "digest", "benchmark", "variant", "model", "versions", "compile_errors", "output_errors", "stopped_early")
+VERSION_COLUMNS = ("run", "version", "energy", "runtime", "source_chars")
+
+def parse_result_file(path):
+    """(version rows, run fields) of one result_file; the sources are only counted, never kept."""
+    versions, notes = read_result_file(path)
+    rows = sorted((key, value[1], value[2], len(value[0])) for key, value in versions.items())
+    # the same run copied into test_results has the same versions
+    digest = hashlib.sha256(json.dumps(sorted(versions.items())).encode()).hexdigest()[:16]
+    del versions
+
+    directory = os.path.dirname(path)
+    label = os.path.basename(directory).lower()
+    fields = {
+        "digest": digest,
+        "benchmark": match_benchmark(label) or label,
+        # test_results keeps runs with and without -O3 in separate directories
+        "variant": "no-o3" if label.endswith("no-o3") else "o3" if label.endswith("-o3") else "default",
+        "model": "unknown",
+        "compile_errors": -1,
+        "output_errors": -1,
+        # runs that hit a rate limit or were killed
+        "stopped_early": bool(re.search(r'rate|limit|stopped', os.path.basename(path) + notes, re.I))
+    }
+    errors = ERRORS_RE.search(notes)
+    if errors:
+        fields["compile_errors"], fields["output_errors"] = int(errors.group(1)), int(errors.group(2))
+    summary_path = f"{directory}/run_summary.txt"
+    if os.path.basename(path) == "result_file.txt" and os.path.isfile(summary_path):
+        with open(summary_path, "r") as file:
+            summary = json.load(file)
+        fields["model"] = summary.get("model", "unknown")
+        fields["compile_errors"] = summary.get("total_compilation_errors", -1)
+        fields["output_errors"] = summary.get("total_output_errors", -1)
+    return rows, fields
+
+class Runs():
+    """All runs as columns: one row per run in self.runs, one row per measured version in self.versions.
+
+    versions["run"] indexes into the run columns. Parsed files are cached in
+    CACHE_PATH by path and mtime, so only new or changed files are read again.
+    """
+    def __init__(self, runs, versions):
+        self.runs = runs
+        self.versions = versions
+
+    @classmethod
+    def load(cls, patterns=None, cache_path=CACHE_PATH):
+        paths = [path for pattern in patterns or RESULT_PATTERNS for path in sorted(glob.glob(pattern))]
+        cached = cls._read_cache(cache_path)
+        run_rows, version_rows = [], []
+        digests = set()
+        reused = {}
+        if cached is not None:
+            for index, (path, mtime) in enumerate(zip(cached.runs["path"], cached.runs["mtime"])):
+                reused[(str(path), float(mtime))] = index
+            # cached versions are grouped by run
+            bounds = np.searchsorted(cached.versions["run"], np.arange(len(cached) + 1))
+        for path in paths:
+            mtime = os.path.getmtime(path)
+            run = len(run_rows)
+            if (path, mtime) in reused:
+                index = reused[(path, mtime)]
+                digest = cached.runs["digest"][index].item()
+                if digest in digests:
+                    continue
+                digests.add(digest)
+                run_rows.append(tuple(cached.runs[column][index].item() for column in RUN_COLUMNS))
+                rows = slice(bounds[index], bounds[index + 1])
+                version_rows.extend(zip([run] * (bounds[index + 1] - bounds[index]), *(cached.versions[column][rows].tolist() for column in VERSION_COLUMNS[1:])))
+                continue
+            try:
+                rows, fields = parse_result_file(path)
+            except ValueError as e:
+                print(f"Runs.load: skipped {path}: {e}")
+                continue
+            if fields["digest"] in digests:
+                continue
+            digests.add(fields["digest"])
+            run_rows.append((path, mtime, fields["digest"], fields["benchmark"], fields["variant"], fields["model"], len(rows), fields["compile_errors"], fields["output_errors"], fields["stopped_early"]))
+            version_rows.extend((run, *row) for row in rows)
+        runs = {column: np.array([row[i] for row in run_rows]) for i, column in enumerate(RUN_COLUMNS)}
+        versions = {
+            "run": np.array([row[0] for row in version_rows], dtype=np.int64),
+            "version": np.array([row[1] for row in version_rows], dtype=np.int64),
+            "energy": np.array([row[2] for row in version_rows], dtype=np.float64),
+            "runtime": np.array([row[3] for row in version_rows], dtype=np.float64),
+            "source_chars": np.array([row[4] for row in version_rows], dtype=np.int64)
+        }
+        loaded = cls(runs, versions)
+        if cache_path is not None and run_rows:
+            loaded._write_cache(cache_path)
+        return loaded
+
+    @classmethod
+    def _read_cache(cls, cache_path):
+        if cache_path is None or not os.path.isfile(cache_path):
+            return None
+        with np.load(cache_path) as data:
+            if any(f"run_{column}" not in data for column in RUN_COLUMNS):
+                # written before a column was added
+                return None
+            return cls({column: data[f"run_{column}"] for column in RUN_COLUMNS}, {column: data[f"version_{column}"] for column in VERSION_COLUMNS})
+
+    def _write_cache(self, cache_path):
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        columns = {f"run_{column}": values for column, values in self.runs.items()}
+        columns.update({f"version_{column}": values for column, values in self.versions.items()})
+        np.savez(cache_path, **columns)
+
+    def __len__(self):
+        return len(self.runs["path"])
+
+    def per_run(self):
+        """Original, best and final energy, best iteration and improvements of every run, as columns."""
+        count = len(self)
+        run, runtime, version = self.versions["run"], self.versions["runtime"], self.versions["version"]
+        # RAPL counter wraps left zero or negative energies in some runs, those versions are no measurement
+        energy = np.where(self.versions["energy"] > 0, self.versions["energy"], np.nan)
+        # versions are sorted by run and version, so the first and last row of a run are its original and final version
+        starts = np.searchsorted(run, np.arange(count), side="left")
+        ends = np.searchsorted(run, np.arange(count), side="right")
+        present = ends > starts
+        original = np.full(count, np.nan)
+        final = np.full(count, np.nan)
+        original[present] = energy[starts[present]]
+        final[present] = energy[ends[present] - 1]
+        original_runtime = np.full(count, np.nan)
+        original_runtime[present] = runtime[starts[present]]
+        # lowest energy of each run, and the first version that reached it
+        best = np.full(count, np.inf)
+        np.minimum.at(best, run, np.where(np.isnan(energy), np.inf, energy))
+        at_best = energy == best[run]
+        best_iteration = np.full(count, np.iinfo(np.int64).max)
+        np.minimum.at(best_iteration, run[at_best], version[at_best])
+        best_runtime = np.full(count, np.nan)
+        first_best = at_best & (version == best_iteration[run])
+        best_runtime[run[first_best]] = runtime[first_best]
+        best[~present | np.isinf(best)] = np.nan
+        best_iteration = np.where(present, best_iteration, -1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return {
+                "original": original,
+                "best": best,
+                "final": final,
+                "best_iteration": best_iteration,
+                "improvement": 1 - best / original,
+                "final_improvement": 1 - final / original,
+                "runtime_improvement": 1 - best_runtime / original_runtime,
+                "successes": np.maximum(self.runs["versions"].astype(np.int64) - 1, 0)
+            }
+
+def distribution(values):
+    values = values[~np.isnan(values)]
+    if values.size == 0:
+        return {"n": 0}
+    p10, p50, p90 = np.percentile(values, [10, 50, 90])
+    return {"n": int(values.size), "mean": round(float(values.mean()), 4), "min": round(float(values.min()), 4), "p10": round(float(p10), 4),
+            "median": round(float(p50), 4), "p90": round(float(p90), 4), "max": round(float(values.max()), 4)}
+
+def group_keys(runs, by):
+    """Label of every run for the grouping, e.g. by=("benchmark", "model")."""
+    labels = runs.runs[by[0]].astype(str)
+    for column in by[1:]:
+        labels = np.char.add(np.char.add(labels, " / "), runs.runs[column].astype(str))
+    return labels
+
+def summarize(runs, by=("benchmark",)):
+    """Per group: improvement distributions, best iteration and failure rates."""
+    metrics = runs.per_run()
+    labels = group_keys(runs, by)
+    compile_errors = runs.runs["compile_errors"].astype(np.int64)
+    output_errors = runs.runs["output_errors"].astype(np.int64)
+    summary = {}
+    for label in np.unique(labels):
+        mask = labels == label
+        counted = mask & (compile_errors >= 0)
+        successes = int(metrics["successes"][counted].sum())
+        compiles = int(compile_errors[counted].sum())
+        outputs = int(output_errors[counted].sum())
+        attempts = successes + compiles + outputs
+        summary[str(label)] = {
+            "runs": int(mask.sum()),
+            "stopped_early": int(runs.runs["stopped_early"][mask].astype(bool).sum()),
+            "improvement": distribution(metrics["improvement"][mask]),
+            "final_improvement": distribution(metrics["final_improvement"][mask]),
+            "runtime_improvement": distribution(metrics["runtime_improvement"][mask]),
+            "best_iteration": distribution(metrics["best_iteration"][mask & (metrics["best_iteration"] >= 0)].astype(np.float64)),
+            "successes": int(metrics["successes"][mask].sum()),
+            # only runs that recorded their failures count towards the rates
+            "compile_failure_rate": round(compiles / attempts, 4) if attempts else None,
+            "logic_failure_rate": round(outputs / attempts, 4) if attempts else None
+        }
+    return summary
+
+def average_trials(csv_path):
+    """Benchmark -> (avg_energy, avg_runtime) of a RAPL/main csv, whatever the number of trials per benchmark."""
+    names, energy, runtime = [], [], []
+    with open(csv_path, "r") as file:
+        for line in file:
+            parts = line.split(';')
+            if len(parts) < 2:
+                continue
+            values = [float(value) for value in parts[1].split(',') if value.strip()]
+            names.append(parts[0].strip())
+            energy.append(values[0])
+            runtime.append(values[1])
+    if not names:
+        return {}
+    labels, index = np.unique(names, return_inverse=True)
+    counts = np.bincount(index)
+    energy = np.bincount(index, weights=energy) / counts
+    runtime = np.bincount(index, weights=runtime) / counts
+    return {str(label): (round(float(e), 3), round(float(r), 3)) for label, e, r in zip(labels, energy, runtime)}
+
+def save_baseline(csv_path, results_path):
+    """Average a baseline's csv into results_path as registry name -> (avg_energy, avg_runtime), for compare_o3."""
+    report = {match_benchmark(name) or name: values for name, values in average_trials(csv_path).items()}
+    with open(results_path, "w") as file:
+        json.dump(report, file, indent=4)
+    return report
+
+def load_baselines():
+    """Benchmark -> {"raw": joules, "O3": joules, "autotuned": joules} from the baseline scripts' results."""
+    baselines = {}
+    for name, path in BASELINE_RESULTS.items():
+        if not os.path.isfile(path):
+            continue
+        with open(path, "r") as file:
+            for benchmark, (energy, _) in json.load(file).items():
+                baselines.setdefault(benchmark, {})[name] = energy
+    for path in glob.glob(f"{AUTOTUNE_RESULTS}/*.json"):
+        with open(path, "r") as file:
+            report = json.load(file)
+        values = baselines.setdefault(report["benchmark"], {})
+        for name in ("raw", "O3"):
+            if report.get(name):
+                values.setdefault(name, report[name][0])
+        if report.get("best"):
+            values["autotuned"] = report["best"]["results"][report["input"]][0]
+    return baselines
+
+def compare_o3(runs, baselines=None):
+    """Best LLM version of every benchmark against -O3 of the same source.
+
+    The -O3 energy comes from the baseline results, or else from the original
+    version of the benchmark's runs compiled with -O3 (test_results/*-o3).
+    """
+    baselines = load_baselines() if baselines is None else baselines
+    metrics = runs.per_run()
+    benchmarks = runs.runs["benchmark"].astype(str)
+    variants = runs.runs["variant"].astype(str)
+    comparison = {}
+    for benchmark in np.unique(benchmarks):
+        mask = benchmarks == benchmark
+        o3 = baselines.get(str(benchmark), {}).get("O3")
+        source = "baseline"
+        o3_runs = mask & (variants == "o3")
+        if o3 is None and o3_runs.any():
+            o3 = float(np.nanmedian(metrics["original"][o3_runs]))
+            source = "o3 runs"
+        llm_runs = mask & (variants != "o3")
+        if o3 is None or not llm_runs.any():
+            continue
+        best = float(np.nanmin(metrics["best"][llm_runs]))
+        median_best = float(np.nanmedian(metrics["best"][llm_runs]))
+        entry = {
+            "O3": round(o3, 3),
+            "O3_source": source,
+            "original": round(float(np.nanmedian(metrics["original"][llm_runs])), 3),
+            "best": round(best, 3),
+            "best_vs_O3": round(1 - best / o3, 4),
+            "median_best_vs_O3": round(1 - median_best / o3, 4)
+        }
+        if o3_runs.any():
+            # the LLM optimizing code that is itself compiled with -O3
+            entry["best_o3_build_vs_O3"] = round(1 - float(np.nanmin(metrics["best"][o3_runs])) / o3, 4)
+        if "autotuned" in baselines.get(str(benchmark), {}):
+            entry["best_vs_autotuned"] = round(1 - best / baselines[str(benchmark)]["autotuned"], 4)
+        comparison[str(benchmark)] = entry
+    return comparison
+
+def candidate_outcomes(path=KNOWLEDGE_PATH, by=("benchmark", "model")):
+    """Share of every candidate outcome per group, from the knowledge base of recent runs."""
+    if not os.path.isfile(path):
+        return {}
+    counts = {}
+    with open(path, "r") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            label = " / ".join(str(entry.get(column)) for column in by)
+            group = counts.setdefault(label, {})
+            group[entry["outcome"]] = group.get(entry["outcome"], 0) + 1
+    return {label: {outcome: round(count / sum(group.values()), 4) for outcome, count in group.items()} | {"candidates": sum(group.values())} for label, group in counts.items()}
+
+def _percent(value):
+    return "-" if value is None else f"{value:+.1%}"
+
+def format_summary(summary, title):
+    lines = [f"### {title}", "", "| group | runs | median improvement | p10 | p90 | best | median best iteration | compile fail | logic fail |", "|---|---|---|---|---|---|---|---|---|"]
+    for label, group in summary.items():
+        improvement = group["improvement"]
+        if improvement["n"] == 0:
+            continue
+        lines.append(f"| {label} | {group['runs']} | {_percent(improvement['median'])} | {_percent(improvement['p10'])} | {_percent(improvement['p90'])} | {_percent(improvement['max'])} | "
+                     f"{group['best_iteration'].get('median', '-')} | {_percent(group['compile_failure_rate'])} | {_percent(group['logic_failure_rate'])} |")
+    return "\n".join(lines)
+
+def format_comparison(comparison):
+    lines = ["### Best version against -O3", "", "| benchmark | -O3 J | from | original J | best J | best vs -O3 | median run vs -O3 | best -O3 build vs -O3 | best vs autotuned |", "|---|---|---|---|---|---|---|---|---|"]
+    for benchmark, entry in comparison.items():
+        lines.append(f"| {benchmark} | {entry['O3']} | {entry['O3_source']} | {entry['original']} | {entry['best']} | {_percent(entry['best_vs_O3'])} | {_percent(entry['median_best_vs_O3'])} | "
+                     f"{_percent(entry.get('best_o3_build_vs_O3'))} | {_percent(entry.get('best_vs_autotuned'))} |")
+    return "\n".join(lines)
+
+def plot(runs, report_dir):
+    """Improvement per benchmark and energy over the iterations of every run, as PNGs; needs matplotlib."""
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("plot: matplotlib is not installed, skipping plots")
+        return []
+    metrics = runs.per_run()
+    benchmarks = runs.runs["benchmark"].astype(str)
+    names = list(np.unique(benchmarks))
+    paths = []
+
+    figure, axis = plt.subplots(figsize=(max(6, len(names)), 4))
+    axis.boxplot([metrics["improvement"][(benchmarks == name) & ~np.isnan(metrics["improvement"])] * 100 for name in names])
+    axis.set_xticks(range(1, len(names) + 1), names, rotation=30, ha="right")
+    axis.set_ylabel("energy improvement of best version (%)")
+    figure.tight_layout()
+    paths.append(f"{report_dir}/improvement.png")
+    figure.savefig(paths[-1])
+    plt.close(figure)
+
+    figure, axis = plt.subplots(figsize=(7, 4))
+    run, version, energy = runs.versions["run"], runs.versions["version"], runs.versions["energy"]
+    relative = energy / metrics["original"][run]
+    colors = {name: plt.cm.tab10(index % 10) for index, name in enumerate(names)}
+    # versions are grouped by run
+    for rows in np.split(np.arange(run.size), np.flatnonzero(np.diff(run)) + 1):
+        if rows.size:
+            benchmark = benchmarks[run[rows[0]]]
+            axis.plot(version[rows], relative[rows], color=colors[benchmark], alpha=0.6, label=benchmark)
+    handles, labels = axis.get_legend_handles_labels()
+    unique = dict(zip(labels, handles))
+    axis.legend(unique.values(), unique.keys(), fontsize="small")
+    axis.set_xlabel("iteration")
+    axis.set_ylabel("energy / original")
+    figure.tight_layout()
+    paths.append(f"{report_dir}/trajectories.png")
+    figure.savefig(paths[-1])
+    plt.close(figure)
+    return paths
+
+def report(patterns=None, report_dir=REPORT_DIR, plots=True):
+    """Write report.md, report.json and the plots to report_dir and return the report path."""
+    start = time.time()
+    runs = Runs.load(patterns)
+    os.makedirs(report_dir, exist_ok=True)
+    results = {
+        "runs": len(runs),
+        "versions": len(runs.versions["run"]),
+        "by_benchmark": summarize(runs, ("benchmark",)),
+        "by_benchmark_variant": summarize(runs, ("benchmark", "variant")),
+        "by_model": summarize(runs, ("model",)),
+        "vs_O3": compare_o3(runs),
+        "candidate_outcomes": candidate_outcomes()
+    }
+    with open(f"{report_dir}/report.json", "w") as file:
+        json.dump(results, file, indent=4)
+    sections = [f"# Optimization results: {results['runs']} runs, {results['versions']} measured versions", "",
+                format_summary(results["by_benchmark"], "By benchmark"), "",
+                format_summary(results["by_benchmark_variant"], "By benchmark and compile variant"), "",
+                format_summary(results["by_model"], "By model"), "",
+                format_comparison(results["vs_O3"])]
+    if results["candidate_outcomes"]:
+        sections += ["", "### Candidate outcomes (knowledge base)", ""] + [f"- {label}: {json.dumps(outcomes)}" for label, outcomes in results["candidate_outcomes"].items()]
+    if plots:
+        sections += [""] + [f"![{os.path.basename(path)}]({os.path.basename(path)})" for path in plot(runs, report_dir)]
+    with open(f"{report_dir}/report.md", "w") as file:
+        file.write("\n".join(sections) + "\n")
+    print(f"report: {len(runs)} runs in {time.time() - start:.2f} s")
+    return f"{report_dir}/report.md"
+
+if __name__ == "__main__":
+    # python3 energy/src/analytics.py report [result file glob ...] [--no-plots]
+    # python3 energy/src/analytics.py summary [benchmark|model|variant ...]
+    command = sys.argv[1] if len(sys.argv) > 1 else "report"
+    if command == "summary":
+        runs = Runs.load()
+        by = tuple(sys.argv[2:]) or ("benchmark",)
+        print(format_summary(summarize(runs, by), "By " + ", ".join(by)))
+        print()
+        print(format_comparison(compare_o3(runs)))
+    else:
+        patterns = [arg for arg in sys.argv[2:] if arg != "--no-plots"]
+        path = report(patterns or None, plots="--no-plots" not in sys.argv)
+        print(f"analytics: report written to {path}")
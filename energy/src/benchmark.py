@@ -1,7 +1,26 @@
 import subprocess
+import hashlib
+import math
 import os
 import pickle
+import random
+import shlex
+import statistics
+import sys
+import time
 from dotenv import load_dotenv
+try:
+    from .memory import massif_profile, memory_profile, read_time_file, time_prefix
+    from .cpufreq import edp, frequency_sweep, get_controller
+    from .threads import config_name, launch_prefix, sweep_configurations
+    from .registry import binary_name, compile_with_profile, expected_digest, get_benchmark, out_dir, output_digest, prepare_inputs, run_benchmark, run_command, shell_command, stdin_path, verified_digest
+except ImportError:
+    from memory import massif_profile, memory_profile, read_time_file, time_prefix
+    from cpufreq import edp, frequency_sweep, get_controller
+    from threads import config_name, launch_prefix, sweep_configurations
+    from registry import binary_name, compile_with_profile, expected_digest, get_benchmark, out_dir, output_digest, prepare_inputs, run_benchmark, run_command, shell_command, stdin_path, verified_digest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../llm/src')))
+import tracing
 load_dotenv()
 USER_PREFIX = os.getenv('USER_PREFIX')
 
@@ -9,65 +28,493 @@ USER_PREFIX = os.getenv('USER_PREFIX')
 #define raletive path to RAPL
 rapl_main_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../RAPL/main'))
 root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../'))
+#input the profile-guided builds are trained on
+PGO_TRAINING_INPUT = os.getenv("PGO_TRAINING_INPUT", "small")
+#thread sweep: CPU counts and placement policies to try, and which optimum a version keeps ("energy" or "edp")
+THREAD_COUNTS = [int(count) for count in os.getenv("THREAD_COUNTS", "").split(",") if count.strip()] or None
+THREAD_POLICIES = [policy.strip() for policy in os.getenv("THREAD_POLICIES", "").split(",") if policy.strip()] or None
+THREAD_SWEEP_OBJECTIVE = os.getenv("THREAD_SWEEP_OBJECTIVE", "energy")
+#massif heap profiles are slow, they run on a smaller input
+MASSIF_INPUT = os.getenv("MASSIF_INPUT", "small")
+#"rapl" measures with RAPL/main, "powercap" reads the package's intel-rapl energy counter in sysfs,
+#"simulated" times the runs and models package power (no sudo or MSRs needed)
+ENERGY_BACKEND = os.getenv("ENERGY_BACKEND", "rapl")
+POWERCAP_DIR = "/sys/class/powercap"
+#measure on the workers of this distributed.py coordinator instead of locally (e.g. http://10.0.0.5:8766)
+MEASURE_COORDINATOR = os.getenv("MEASURE_COORDINATOR")
+#set by load_msr once the msr module is loaded
+msr_loaded = False
+#remote jobs submitted ahead of their measurement (see prefetch_remote), by (benchmark, source digest)
+prefetched_jobs = {}
+#trials per measurement, RAPL/main's default ntimes
+RAPL_TRIALS = 2
+SIMULATED_PACKAGE_POWER = float(os.getenv("SIMULATED_PACKAGE_POWER", 30.0))
+SIMULATED_NOISE = float(os.getenv("SIMULATED_NOISE", 0.02))
+#sequential testing: candidates are measured a trial at a time, up to RAPL_TRIALS; a candidate stops
+#as soon as it is worse or better than the best version with SEQUENTIAL_CONFIDENCE, and one that
+#looks better without being clearly better gets up to SEQUENTIAL_MAX_TRIALS; SEQUENTIAL_TEST=0
+#measures every version with one RAPL_TRIALS run
+SEQUENTIAL_TEST = os.getenv("SEQUENTIAL_TEST", "1") != "0"
+SEQUENTIAL_MAX_TRIALS = int(os.getenv("SEQUENTIAL_MAX_TRIALS", 6))
+SEQUENTIAL_CONFIDENCE = float(os.getenv("SEQUENTIAL_CONFIDENCE", 0.99))
+#relative noise of one trial assumed until the measured versions show more
+SEQUENTIAL_MIN_NOISE = float(os.getenv("SEQUENTIAL_MIN_NOISE", 0.02))
+WORSE = "worse"
+BETTER = "better"
+UNDECIDED = "undecided"
+
+def parse_energy_csv(path):
+    """(benchmark name, package energy, runtime) per RAPL/main trial in the csv."""
+    benchmark_data = []
+    with open(path, "r") as energy_data_file:
+        for line in energy_data_file:
+            parts = line.split(';')
+            if len(parts) < 2:
+                continue
+            benchmark_name = parts[0].strip()
+            energy_data = [vals.strip() for vals in parts[1].split(',')]
+
+            #Remove empty strings for CPU, GPU, DRAM and convert remaining numbers to floats
+            energy_data = [float(num) for num in energy_data if num]
+            benchmark_data.append((benchmark_name, *energy_data))
+    return benchmark_data
+
+def trial_metrics(benchmark_data):
+    energy_trials = [data[1] for data in benchmark_data]
+    runtime_trials = [data[2] for data in benchmark_data]
+    return {
+        "energy_trials": energy_trials,
+        "runtime_trials": runtime_trials,
+        "energy_std": round(statistics.stdev(energy_trials), 3) if len(energy_trials) > 1 else 0.0,
+        "runtime_std": round(statistics.stdev(runtime_trials), 3) if len(runtime_trials) > 1 else 0.0,
+        "measurement_energy": round(sum(energy_trials), 3)
+    }
+
+def write_trials(path, trials):
+    """(test name, energy, runtime) trials in RAPL/main's csv format."""
+    with open(path, "w") as log_file:
+        for test_name, energy, runtime in trials:
+            log_file.write(f"{test_name} ; {energy:.18f},  ,  ,  {runtime:G} \n")
+
+def load_msr():
+    """Load the msr module RAPL/main reads the counters through, once per process."""
+    global msr_loaded
+    if not msr_loaded:
+        subprocess.run(["sudo", "modprobe", "msr"], check=True)
+        msr_loaded = True
+
+def rapl_measure(command, language, test_name, log_file_path=None, trials=RAPL_TRIALS):
+    """Run a shell command under RAPL/main and return its trials from energy/src/<language>.csv.
+
+    log_file_path moves the csv (RAPL/main always writes its own) and
+    trials sets the number of runs.
+    """
+    # First clear the contents of the energy data log file
+    if log_file_path is None or ENERGY_BACKEND == "rapl":
+        log_file_path = f"{USER_PREFIX}/energy/src/{language}.csv"
+    if os.path.exists(log_file_path):
+        file = open(log_file_path, "w+")
+        file.close()
+
+    with tracing.span("rapl_measure", language=language, command=command, backend=ENERGY_BACKEND) as rapl_span:
+        if ENERGY_BACKEND == "simulated":
+            simulated_measure(command, log_file_path, test_name, trials)
+        elif ENERGY_BACKEND == "powercap":
+            powercap_measure(command, log_file_path, test_name, trials)
+        else:
+            load_msr()
+            subprocess.run(["sudo", rapl_main_path, command, language, test_name, str(trials)], check=True)
+            # RAPL/main creates the csv as root and appends to it afterwards, so this is needed once per csv
+            if os.stat(log_file_path).st_mode & 0o777 != 0o777:
+                subprocess.run(["sudo", "chmod", "-R", "777", log_file_path], check=True)
+        trials = parse_energy_csv(log_file_path)
+        rapl_span["trials"] = len(trials)
+        rapl_span["measured_energy"] = round(sum(data[1] for data in trials), 3)
+    return trials
+
+def simulated_measure(command, log_file_path, test_name, trials=RAPL_TRIALS):
+    """Stand-in for RAPL/main: runs the command like system() does and appends the same csv lines.
+
+    Energy is the wall time at SIMULATED_PACKAGE_POWER watts with
+    SIMULATED_NOISE relative gaussian noise. A failing command raises
+    CalledProcessError, as the rapl backend does.
+    """
+    with open(log_file_path, "a") as log_file:
+        for _ in range(trials):
+            start = time.time()
+            subprocess.run(command, shell=True, stdout=subprocess.DEVNULL, check=True)
+            runtime = time.time() - start
+            energy = runtime * SIMULATED_PACKAGE_POWER * max(0.0, random.gauss(1.0, SIMULATED_NOISE))
+            log_file.write(f"{test_name} ; {energy:.18f},  ,  ,  {runtime * 1000:G} \n")
+
+def prefetch_remote(filename, source):
+    """Queue the remote measurement of a version now, so several run on the workers at once.
+
+    Benchmark.run_remote of the same source later waits for this job instead
+    of submitting its own.
+    """
+    try:
+        from .distributed import submit_remote
+    except ImportError:
+        from distributed import submit_remote
+    entry = get_benchmark(filename)
+    with open(f"{USER_PREFIX}/llm/llm_input_files/input_code/{filename}", "r") as file:
+        original_source = file.read()
+    key = (entry["name"], hashlib.sha256(source.encode()).hexdigest())
+    if key not in prefetched_jobs:
+        prefetched_jobs[key] = submit_remote(MEASURE_COORDINATOR, entry, filename.split(".")[-1], source, original_source)
+
+def cpu_package(cpu):
+    with open(f"/sys/devices/system/cpu/cpu{cpu}/topology/physical_package_id", "r") as file:
+        return int(file.read())
+
+def powercap_domain(package=None):
+    """intel-rapl sysfs domain of a package: RAPL_PACKAGE, else the package of the first CPU this process may run on."""
+    if package is None:
+        package = int(os.getenv("RAPL_PACKAGE")) if os.getenv("RAPL_PACKAGE") else cpu_package(min(os.sched_getaffinity(0)))
+    for name in sorted(os.listdir(POWERCAP_DIR)):
+        domain = f"{POWERCAP_DIR}/{name}"
+        if name.count(":") != 1 or not os.path.isfile(f"{domain}/energy_uj"):
+            continue
+        with open(f"{domain}/name", "r") as file:
+            if file.read().strip() == f"package-{package}":
+                return domain
+    raise FileNotFoundError(f"powercap_domain: no intel-rapl domain for package {package} in {POWERCAP_DIR}")
+
+def _read_counter(path):
+    with open(path, "r") as file:
+        return int(file.read())
+
+def powercap_measure(command, log_file_path, test_name, trials=RAPL_TRIALS):
+    """RAPL/main's measurement from the sysfs package counter, so workers pinned to different sockets can measure at once."""
+    domain = powercap_domain()
+    wrap = _read_counter(f"{domain}/max_energy_range_uj")
+    with open(log_file_path, "a") as log_file:
+        for _ in range(trials):
+            before = _read_counter(f"{domain}/energy_uj")
+            start = time.time()
+            subprocess.run(command, shell=True, stdout=subprocess.DEVNULL, check=True)
+            runtime = time.time() - start
+            after = _read_counter(f"{domain}/energy_uj")
+            # the counter wraps at max_energy_range_uj
+            energy = ((after - before) % (wrap + 1)) / 1e6
+            log_file.write(f"{test_name} ; {energy:.18f},  ,  ,  {runtime * 1000:G} \n")
+
+def trial_noise(trial_sets):
+    """Relative standard deviation of one trial, pooled over the sets with at least two trials."""
+    variances = [statistics.variance(trials) / statistics.mean(trials) ** 2 for trials in trial_sets if len(trials) > 1 and statistics.mean(trials) > 0]
+    return max(SEQUENTIAL_MIN_NOISE, math.sqrt(statistics.mean(variances))) if variances else SEQUENTIAL_MIN_NOISE
+
+def sequential_decision(energies, reference_energies, noise):
+    """Whether a candidate is worse or better than the reference, and the probability that it is worse.
+
+    Both means get a normal posterior with noise relative standard deviation
+    per trial (flat prior), so their difference is normal as well. The
+    candidate is decided once either side has SEQUENTIAL_CONFIDENCE.
+    """
+    mean = statistics.mean(energies)
+    reference = statistics.mean(reference_energies)
+    deviation = math.sqrt((noise * mean) ** 2 / len(energies) + (noise * reference) ** 2 / len(reference_energies))
+    probability = 0.5 * (1 + math.erf((mean - reference) / (deviation * math.sqrt(2)))) if deviation > 0 else float(mean > reference)
+    if probability >= SEQUENTIAL_CONFIDENCE:
+        return WORSE, probability
+    if 1 - probability >= SEQUENTIAL_CONFIDENCE:
+        return BETTER, probability
+    return UNDECIDED, probability
 
 class Benchmark():
-    def __init__(self, benchmark_language, benchmark_name, filename, benchmark_data):
+    def __init__(self, benchmark_language, benchmark_name, filename, benchmark_data, benchmark_metrics=None):
         self.benchmark_language = benchmark_language
         self.benchmark_name = benchmark_name
+        self.filename = filename
+        self.entry = get_benchmark(filename)
         self.benchmark_data = benchmark_data
+        # Per-iteration trial statistics, kept apart from the (source, energy, runtime) records
+        self.benchmark_metrics = benchmark_metrics if benchmark_metrics is not None else {}
+        # Fingerprint and calibration of versions measured by a remote worker, stored with their metrics
+        self.remote_measurements = {}
+        # Outcome of the sequential test of each candidate, stored with its metrics
+        self.sequential_tests = {}
+        # Memory use recorded during the measured trials, stored with the metrics
+        self.trial_memory = {}
 
-    def run(self, optim_iter):
-        # First clear the contents of the energy data log file
-        print(f"Benchmark.run: clearing content in {self.benchmark_language}.csv")
+    @tracing.traced("benchmark.run")
+    def run(self, optim_iter, reference=None):
+        """Measure a version under RAPL/main with the registry's production input.
+
+        Versions get RAPL_TRIALS trials. A candidate is tested against the
+        reference version after every trial and stops early once it is
+        clearly worse; a tie in its favour is measured up to
+        SEQUENTIAL_MAX_TRIALS, since it would become the reference for the
+        next ones. Returns the (name, energy, runtime) trials, False when the
+        measurement failed.
+        """
+        directory = out_dir(self.filename)
+        os.chdir(directory)
+        print(f"Benchmark.run: {directory}")
+
+        #collect original data, or measure the optimized code energy
+        source_filename = self.filename if optim_iter == 0 else f"optimized_{self.filename}"
+        if MEASURE_COORDINATOR:
+            return self.run_remote(optim_iter, f"{directory}/{source_filename}")
+        # /usr/bin/time records the memory use of the trials, so it needs no run of its own
+        memory_file = f"{directory}/memory.{optim_iter}.txt"
+        command = time_prefix(memory_file) + shell_command(self.entry, f"{directory}/{binary_name(source_filename)}", cwd=directory)
         log_file_path = f"{USER_PREFIX}/energy/src/{self.benchmark_language}.csv"
-        if os.path.exists(log_file_path):
-            file = open(log_file_path, "w+")
-            file.close()
-
-        #run make measure using make file
-        #change current directory to benchmarks/folder to run make file
-        os.chdir(f"{USER_PREFIX}/llm/benchmarks_out/{self.benchmark_name}")
-        print(f"{USER_PREFIX}/llm/benchmarks_out/{self.benchmark_name}")
-        current_dir = os.getcwd()
-        print(f"Current directory: {current_dir}")
-
-        #collect original data
-        if optim_iter == 0: 
-            try: 
-                subprocess.run(["make", "measure"], check=True)
-                print("Benchmark.run: make measure successfully\n")
-                return True
-            except subprocess.CalledProcessError as e:
-                print(f"Benchmark.run: make measure failed: {e}\n")
+        reference_energies = self.benchmark_metrics.get(reference, {}).get("energy_trials") if optim_iter != 0 and reference is not None else None
+        total = RAPL_TRIALS
+        step = 1 if SEQUENTIAL_TEST and reference_energies else RAPL_TRIALS
+        trials = []
+        try:
+            while len(trials) < total:
+                trials += rapl_measure(command, self.benchmark_language, self.entry["rapl_name"], trials=min(step, total - len(trials)))
+                if not SEQUENTIAL_TEST or not reference_energies:
+                    continue
+                energies = [trial[1] for trial in trials]
+                noise = trial_noise([energies] + [metrics.get("energy_trials", []) for metrics in self.benchmark_metrics.values()])
+                decision, probability = sequential_decision(energies, reference_energies, noise)
+                self.sequential_tests[optim_iter] = {"reference": reference, "decision": decision, "probability_worse": round(probability, 4), "noise": round(noise, 4), "trials": len(trials)}
+                if decision == WORSE or (decision == BETTER and len(trials) >= RAPL_TRIALS):
+                    break
+                if len(trials) == total and decision == UNDECIDED and statistics.mean(energies) < statistics.mean(reference_energies):
+                    total = max(total, SEQUENTIAL_MAX_TRIALS)
+            print("Benchmark.run: measured successfully\n")
+        except subprocess.CalledProcessError as e:
+            print(f"Benchmark.run: measure failed: {e}\n")
             return False
+        write_trials(log_file_path, trials)
+        memory = read_time_file(memory_file)
+        if memory is not None:
+            self.trial_memory[optim_iter] = memory
+
+        test = self.sequential_tests.get(optim_iter)
+        if test is not None:
+            print(f"Benchmark.run: version {optim_iter} is {test['decision']} than version {reference} after {test['trials']} of {total} trials (P(worse) = {test['probability_worse']})\n")
+            span = tracing.current()
+            span["sequential"] = test["decision"]
+            span["trials"] = test["trials"]
+
+        return trials
+
+
+    def run_remote(self, optim_iter, source_path):
+        """Compile and measure the version on a worker of MEASURE_COORDINATOR.
+
+        Versions measured on other hardware than the original are scaled by
+        the calibration of both fingerprints; without one the measurement fails.
+        """
+        try:
+            from .distributed import calibrated_trials, measure_remote
+        except ImportError:
+            from distributed import calibrated_trials, measure_remote
+        with open(source_path, "r") as file:
+            source = file.read()
+        with open(f"{USER_PREFIX}/llm/llm_input_files/input_code/{self.filename}", "r") as file:
+            original_source = file.read()
+        job_id = prefetched_jobs.pop((self.entry["name"], hashlib.sha256(source.encode()).hexdigest()), None) if optim_iter != 0 else None
+        try:
+            with tracing.span("remote_measure", coordinator=MEASURE_COORDINATOR, prefetched=job_id is not None) as remote_span:
+                result = measure_remote(MEASURE_COORDINATOR, self.entry, self.benchmark_language, source, original_source, original=optim_iter == 0, job_id=job_id)
+                remote_span["worker"] = result["worker"]
+            # every version is expressed on the hardware that measured the original
+            base = self.benchmark_metrics.get(0, {}).get("measured_on", {}).get("fingerprint_id") if optim_iter != 0 else None
+            trials, factors = calibrated_trials(result, base or result["fingerprint"]["id"])
+        except (OSError, RuntimeError, ValueError) as e:
+            print(f"Benchmark.run: remote measure failed: {e}\n")
+            return False
+        self.remote_measurements[optim_iter] = {"fingerprint_id": result["fingerprint"]["id"], "host": result["fingerprint"]["host"], "worker": result["worker"], "calibration": factors}
+        print(f"Benchmark.run: measured on {result['fingerprint']['host']} ({result['fingerprint']['id']}), calibration {factors}\n")
+        # kept in memory, the shared csv belongs to local RAPL measurements
+        return trials
+
+    def run_memory(self, optim_iter, massif=False):
+        """Peak RSS and page faults of a version on the production input, optionally a massif heap profile.
+
+        The record comes from the measured trials when /usr/bin/time is
+        installed, otherwise from one run with the version's thread
+        configuration. massif only profiles the original and a version that
+        is the best so far, on MASSIF_INPUT.
+        """
+        directory = out_dir(self.filename)
+        source_filename = self.filename if optim_iter == 0 else f"optimized_{self.filename}"
+        binary = f"{directory}/{binary_name(source_filename)}"
+        prefix = shlex.split(self.launch_prefix(optim_iter))
+        memory = self.benchmark_metrics.get(optim_iter, {}).get("memory")
+        if memory is None:
+            try:
+                memory = memory_profile(run_command(self.entry, binary), stdin_path(self.entry, cwd=directory), cwd=directory, timeout=self.entry["timeout"], prefix=prefix)
+            except subprocess.TimeoutExpired:
+                memory = {"status": "timeout"}
+        best = min(self.benchmark_data, key=lambda version: self.benchmark_data[version][1]) if self.benchmark_data else optim_iter
+        if massif and optim_iter not in (0, best):
+            memory["massif"] = {"status": "not_best"}
+        elif massif and prepare_inputs(self.entry, [MASSIF_INPUT]) is not None:
+            memory["massif"] = {"status": "input_failed"}
+        elif massif:
+            memory["massif"] = massif_profile(
+                run_command(self.entry, binary, MASSIF_INPUT),
+                f"{directory}/massif.out.{optim_iter}",
+                stdin_path(self.entry, MASSIF_INPUT, cwd=directory),
+                cwd=directory,
+                timeout=self.entry["timeout"],
+                prefix=prefix
+            )
+        self.benchmark_metrics.setdefault(optim_iter, {})["memory"] = memory
+        print(f"Benchmark.run_memory: version {optim_iter}: peak RSS {memory.get('peak_rss_kb')} KB, {memory.get('major_page_faults')} major / {memory.get('minor_page_faults')} minor page faults")
+
+        with open(f"{USER_PREFIX}/energy/{self.benchmark_language}/benchmark_metrics.pkl", "wb") as benchmark_metrics_pkl_file:
+            pickle.dump(self.benchmark_metrics, benchmark_metrics_pkl_file)
+        return memory
+
+    def launch_prefix(self, optim_iter):
+        """Thread count and placement chosen for a version by the thread sweep, if any."""
+        return launch_prefix(self.benchmark_metrics.get(optim_iter, {}).get("thread_config"), self.entry["threading"])
+
+    def run_thread_sweep(self, optim_iter):
+        """Measure a version on every CPU count and placement policy.
+
+        The energy-optimal and EDP-optimal configurations are stored in
+        benchmark_metrics[optim_iter]["thread_sweep"]. The one picked by
+        THREAD_SWEEP_OBJECTIVE becomes the version's "thread_config" and its
+        measurement replaces the default-placement one, so comparisons between
+        versions use each version's own best configuration.
+        """
+        if self.entry["threading"] == "none":
+            return None
+        directory = out_dir(self.filename)
+        source_filename = self.filename if optim_iter == 0 else f"optimized_{self.filename}"
+        command = shell_command(self.entry, f"{directory}/{binary_name(source_filename)}", cwd=directory)
+        metrics = self.benchmark_metrics[optim_iter]
+        source_code, avg_energy, avg_runtime = self.benchmark_data[optim_iter]
+
+        default = dict(metrics, config=None, avg_energy=avg_energy, avg_runtime=avg_runtime)
+        results = [default]
+        memory_file = f"{directory}/memory.sweep.txt"
+        for config in sweep_configurations(self.entry["threading"], THREAD_COUNTS, THREAD_POLICIES):
+            try:
+                trials = rapl_measure(time_prefix(memory_file) + launch_prefix(config, self.entry["threading"]) + command, self.benchmark_language, self.entry["rapl_name"])
+            except subprocess.CalledProcessError as e:
+                print(f"Benchmark.run_thread_sweep: {config_name(config)} failed: {e}")
+                continue
+            result = trial_metrics(trials)
+            result["config"] = config
+            result["memory"] = read_time_file(memory_file)
+            result["avg_energy"] = round(statistics.mean(result["energy_trials"]), 3)
+            result["avg_runtime"] = round(statistics.mean(result["runtime_trials"]), 3)
+            results.append(result)
+            metrics["measurement_energy"] = round(metrics["measurement_energy"] + result["measurement_energy"], 3)
+            print(f"Benchmark.run_thread_sweep: {config_name(config)}  |  Avg Energy (J): {result['avg_energy']}  | Avg Runtime (ms): {result['avg_runtime']}")
+
+        for result in results:
+            result["edp"] = edp(result["avg_energy"], result["avg_runtime"])
+        energy_optimal = min(results, key=lambda result: result["avg_energy"])
+        edp_optimal = min(results, key=lambda result: result["edp"])
+        chosen = edp_optimal if THREAD_SWEEP_OBJECTIVE == "edp" else energy_optimal
+
+        sweep = {
+            "objective": THREAD_SWEEP_OBJECTIVE,
+            "energy_optimal": {"config": energy_optimal["config"], "avg_energy": energy_optimal["avg_energy"], "avg_runtime": energy_optimal["avg_runtime"]},
+            "edp_optimal": {"config": edp_optimal["config"], "edp": edp_optimal["edp"], "avg_energy": edp_optimal["avg_energy"], "avg_runtime": edp_optimal["avg_runtime"]},
+            "results": [{key: result[key] for key in ("config", "avg_energy", "avg_runtime", "energy_std", "edp")} for result in results]
+        }
+        print(f"Benchmark.run_thread_sweep: version {optim_iter}: energy-optimal {config_name(energy_optimal['config'])}, EDP-optimal {config_name(edp_optimal['config'])}")
+
+        if chosen is not default:
+            for key in ("energy_trials", "runtime_trials", "energy_std", "runtime_std", "memory"):
+                metrics[key] = chosen[key]
+            self.benchmark_data[optim_iter] = (source_code, chosen["avg_energy"], chosen["avg_runtime"])
+        metrics["thread_config"] = chosen["config"]
+        metrics["thread_sweep"] = sweep
+
+        with open(f"{USER_PREFIX}/energy/{self.benchmark_language}/benchmark_data.pkl", "wb") as benchmark_data_pkl_file:
+            pickle.dump(self.benchmark_data, benchmark_data_pkl_file)
+        with open(f"{USER_PREFIX}/energy/{self.benchmark_language}/benchmark_metrics.pkl", "wb") as benchmark_metrics_pkl_file:
+            pickle.dump(self.benchmark_metrics, benchmark_metrics_pkl_file)
+        return sweep
+
+    def run_frequency_sweep(self, optim_iter):
+        """Energy, runtime and EDP of a version at every cpufreq setting, stored as metrics["frequency_sweep"].
+
+        The operating point is a machine setting, so the version's own record
+        keeps the measurement at the default frequency.
+        """
+        directory = out_dir(self.filename)
+        source_filename = self.filename if optim_iter == 0 else f"optimized_{self.filename}"
+        command = self.launch_prefix(optim_iter) + shell_command(self.entry, f"{directory}/{binary_name(source_filename)}", cwd=directory)
+        controller = get_controller()
+        if controller.name == "simulated":
+            _, avg_energy, avg_runtime = self.benchmark_data[optim_iter]
+            measure = lambda: controller.simulate(avg_energy, avg_runtime)
         else:
-        #might need to change things here
-        #measure the optimize code energy 
-            try: 
-                subprocess.run(["make", "measure_optimized"], check=True)
-                print("Benchmark.run: make measure successfully\n")
-                return True
+            measure = lambda: rapl_measure(command, self.benchmark_language, self.entry["rapl_name"])
+
+        report = frequency_sweep(controller, measure)
+        metrics = self.benchmark_metrics[optim_iter]
+        metrics["frequency_sweep"] = report
+        if controller.name != "simulated":
+            metrics["measurement_energy"] = round(metrics["measurement_energy"] + sum(result["measurement_energy"] for result in report.get("results", [])), 3)
+
+        with open(f"{USER_PREFIX}/energy/{self.benchmark_language}/benchmark_metrics.pkl", "wb") as benchmark_metrics_pkl_file:
+            pickle.dump(self.benchmark_metrics, benchmark_metrics_pkl_file)
+        return report
+
+    def run_pgo(self, optim_iter):
+        """Profile-guided build of a measured version, verified and measured like the plain build.
+
+        The outcome is stored as benchmark_metrics[optim_iter]["pgo"]; "best_build"
+        records which of the two executables reaches the lower energy.
+        """
+        directory = out_dir(self.filename)
+        source_filename = self.filename if optim_iter == 0 else f"optimized_{self.filename}"
+        plain_binary = f"{directory}/{binary_name(source_filename)}"
+        pgo_binary = plain_binary.rsplit('.', 1)[0] + ".pgo.gpp_run"
+        metrics = self.benchmark_metrics.setdefault(optim_iter, {})
+
+        print(f"Benchmark.run_pgo: building {os.path.basename(pgo_binary)} with the {PGO_TRAINING_INPUT} input")
+        with open(f"{directory}/pgo_build_log.txt", "w") as build_log:
+            failure = compile_with_profile(self.entry, f"{directory}/{source_filename}", pgo_binary, build_log, training_size=PGO_TRAINING_INPUT, cwd=directory)
+
+        #the profile-guided executable has to produce the output the regression test verified for the plain one
+        reference = verified_digest(plain_binary) or expected_digest(self.entry)
+        if failure is None and reference is None:
+            failure = "no_reference_output"
+        if failure is None:
+            try:
+                result = run_benchmark(self.entry, pgo_binary, cwd=directory)
+                if result.returncode != 0 or output_digest(result.stdout) != reference:
+                    failure = "output_differs"
+            except subprocess.TimeoutExpired:
+                failure = "timeout"
+
+        if failure is None:
+            try:
+                pgo_metrics = trial_metrics(rapl_measure(self.launch_prefix(optim_iter) + shell_command(self.entry, pgo_binary, cwd=directory), self.benchmark_language, self.entry["rapl_name"]))
             except subprocess.CalledProcessError as e:
-                print(f"Benchmark.run: make measure failed: {e}\n")
-            return False
+                print(f"Benchmark.run_pgo: measure failed: {e}\n")
+                failure = "measure_failed"
 
-        #Return path to results file
-        results_file = f"{self.benchmark_language}.csv"
-        return results_file
+        if failure is not None:
+            print(f"Benchmark.run_pgo: no profile-guided build for version {optim_iter}: {failure}")
+            metrics["pgo"] = {"status": failure}
+        else:
+            pgo_metrics["status"] = "measured"
+            pgo_metrics["binary"] = pgo_binary
+            pgo_metrics["avg_energy"] = round(statistics.mean(pgo_metrics["energy_trials"]), 3)
+            pgo_metrics["avg_runtime"] = round(statistics.mean(pgo_metrics["runtime_trials"]), 3)
+            metrics["pgo"] = pgo_metrics
+            plain_energy = self.benchmark_data[optim_iter][1] if optim_iter in self.benchmark_data else None
+            metrics["best_build"] = "pgo" if plain_energy is None or pgo_metrics["avg_energy"] < plain_energy else "plain"
+            print(f"Benchmark.run_pgo: version {optim_iter}: plain {plain_energy} J, pgo {pgo_metrics['avg_energy']} J")
 
+        with open(f"{USER_PREFIX}/energy/{self.benchmark_language}/benchmark_metrics.pkl", "wb") as benchmark_metrics_pkl_file:
+            pickle.dump(self.benchmark_metrics, benchmark_metrics_pkl_file)
+        return metrics["pgo"]
 
-    def process_results(self, results_file, optim_iter, source_code_path) -> float:
-        energy_data_file = open(f"{USER_PREFIX}/energy/src/{self.benchmark_language}.csv", "r")
-        benchmark_data = []
-        for line in energy_data_file:
-            parts = line.split(';')
-            benchmark_name = parts[0].strip()
-            energy_data = [vals.strip() for vals in parts[1].split(',')]
-            
-            #Remove empty strings for CPU, GPU, DRAM and convert remaining numbers to floats
-            energy_data = [float(num) for num in energy_data if num]
-            print(energy_data)
-            benchmark_data.append((benchmark_name, *energy_data))
+    @tracing.traced("benchmark.process_results")
+    def process_results(self, trials, optim_iter, source_code_path) -> float:
+        if not trials:
+            raise RuntimeError(f"Benchmark.process_results: version {optim_iter} was not measured")
+        benchmark_data = [tuple(trial) for trial in trials]
 
         #Find average energy usage and average runtime
         avg_energy = 0
@@ -79,6 +526,15 @@ class Benchmark():
         avg_energy /= len(benchmark_data)
         avg_runtime /= len(benchmark_data)
 
+        #Keep trial-level data so callers can tell real improvements from measurement noise
+        self.benchmark_metrics[optim_iter] = trial_metrics(benchmark_data)
+        if optim_iter in self.remote_measurements:
+            self.benchmark_metrics[optim_iter]["measured_on"] = self.remote_measurements[optim_iter]
+        if optim_iter in self.sequential_tests:
+            self.benchmark_metrics[optim_iter]["sequential_test"] = self.sequential_tests[optim_iter]
+        if optim_iter in self.trial_memory:
+            self.benchmark_metrics[optim_iter]["memory"] = self.trial_memory[optim_iter]
+
         #Append results to benchmark data dict
         source_code_file = open(source_code_path, "r")
         source_code = source_code_file.read()
@@ -87,8 +543,9 @@ class Benchmark():
         #Update PKL file with latest version of benchmark data dict
         with open(f"{USER_PREFIX}/energy/{self.benchmark_language}/benchmark_data.pkl", "wb") as benchmark_data_pkl_file:
             pickle.dump(self.benchmark_data, benchmark_data_pkl_file)
+        with open(f"{USER_PREFIX}/energy/{self.benchmark_language}/benchmark_metrics.pkl", "wb") as benchmark_metrics_pkl_file:
+            pickle.dump(self.benchmark_metrics, benchmark_metrics_pkl_file)
 
         #Close all files
-        energy_data_file.close()
         source_code_file.close()
         benchmark_data_pkl_file.close()
\ No newline at end of file
@@ -0,0 +1,239 @@
+import glob
+import os
+import subprocess
+
+CPUFREQ_DIR = "/sys/devices/system/cpu"
+# Frequencies tried with the userspace governor or max-frequency capping, as fractions of the range
+FREQUENCY_STEPS = [0.0, 0.25, 0.5, 0.75, 1.0]
+
+def edp(avg_energy, avg_runtime):
+    # energy-delay product in J*s, runtime is in ms
+    return round(avg_energy * avg_runtime / 1000, 3)
+
+def _read(path):
+    try:
+        with open(path, "r") as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+class SysfsCpufreq():
+    """Sets the operating point of every cpu through /sys/devices/system/cpu/cpu*/cpufreq.
+
+    Uses the userspace governor when the driver offers it, otherwise the
+    energy_performance_preference levels (intel_pstate/amd_pstate active
+    mode), otherwise caps scaling_max_freq. Writes go through `sudo -n tee`,
+    like the RAPL measurements use sudo.
+    """
+    name = "sysfs"
+
+    def __init__(self):
+        self.policy_dirs = sorted(glob.glob(f"{CPUFREQ_DIR}/cpu[0-9]*/cpufreq"))
+        self.mode = None
+        self.saved = {}
+        self.reason = None
+        if not self.policy_dirs:
+            self.reason = "no cpufreq driver (/sys/devices/system/cpu/cpu*/cpufreq missing)"
+            return
+        first = self.policy_dirs[0]
+        governors = (_read(f"{first}/scaling_available_governors") or "").split()
+        preferences = (_read(f"{first}/energy_performance_available_preferences") or "").split()
+        if "userspace" in governors:
+            self.mode = "userspace"
+        elif preferences:
+            self.mode = "epp"
+        elif _read(f"{first}/scaling_max_freq") is not None:
+            self.mode = "max_freq"
+        else:
+            self.reason = "cpufreq driver exposes no frequency controls"
+            return
+        # probe with a no-op write so an unwritable sysfs is reported before measuring
+        probe_file = "scaling_governor" if self.mode == "userspace" else ("energy_performance_preference" if self.mode == "epp" else "scaling_max_freq")
+        if not self._write(f"{first}/{probe_file}", _read(f"{first}/{probe_file}")):
+            self.reason = f"{first}/{probe_file} is not writable (needs passwordless sudo)"
+            self.mode = None
+
+    def available(self):
+        return self.mode is not None
+
+    def settings(self):
+        first = self.policy_dirs[0]
+        if self.mode == "epp":
+            return (_read(f"{first}/energy_performance_available_preferences") or "").split()
+        frequencies = sorted(int(frequency) for frequency in (_read(f"{first}/scaling_available_frequencies") or "").split())
+        if frequencies:
+            return sorted({frequencies[round(step * (len(frequencies) - 1))] for step in FREQUENCY_STEPS})
+        low, high = int(_read(f"{first}/cpuinfo_min_freq")), int(_read(f"{first}/cpuinfo_max_freq"))
+        return sorted({int(low + step * (high - low)) // 1000 * 1000 for step in FREQUENCY_STEPS})
+
+    def _write(self, path, value):
+        result = subprocess.run(["sudo", "-n", "tee", path], input=f"{value}\n", text=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return result.returncode == 0
+
+    def _files(self):
+        if self.mode == "userspace":
+            return ["scaling_governor", "scaling_setspeed"]
+        if self.mode == "epp":
+            return ["energy_performance_preference"]
+        return ["scaling_max_freq"]
+
+    def apply(self, setting):
+        """Write the setting to every cpu, False when any write failed."""
+        applied = True
+        for policy_dir in self.policy_dirs:
+            for file in self._files():
+                self.saved.setdefault(f"{policy_dir}/{file}", _read(f"{policy_dir}/{file}"))
+            if self.mode == "userspace":
+                writes = [("scaling_governor", "userspace"), ("scaling_setspeed", setting)]
+            elif self.mode == "epp":
+                writes = [("energy_performance_preference", setting)]
+            else:
+                writes = [("scaling_max_freq", setting)]
+            for file, value in writes:
+                if not self._write(f"{policy_dir}/{file}", value):
+                    print(f"SysfsCpufreq.apply: could not write {value} to {policy_dir}/{file}")
+                    applied = False
+        return applied
+
+    def restore(self):
+        # the governor goes back last, scaling_setspeed is only writable under userspace
+        for path, value in sorted(self.saved.items(), key=lambda item: item[0].endswith("scaling_governor")):
+            if value is not None and value != "<unsupported>":
+                self._write(path, value)
+        self.saved = {}
+
+class SimulatedCpufreq():
+    """Stand-in for machines without cpufreq control and for testing the sweep.
+
+    Runtime scales with 1/f only for the compute-bound part of the program,
+    package power has a static part plus a dynamic part that grows with f^3
+    (voltage follows frequency). Measurements are derived from the version's
+    measurement at the nominal (highest) frequency.
+    """
+    name = "simulated"
+
+    def __init__(self, frequencies=None, memory_bound=None, static_power=None):
+        self.frequencies = frequencies or [1200000, 1800000, 2400000, 3000000, 3600000]
+        self.memory_bound = memory_bound if memory_bound is not None else float(os.getenv("CPUFREQ_SIM_MEMORY_BOUND", 0.3))
+        self.static_power = static_power if static_power is not None else float(os.getenv("CPUFREQ_SIM_STATIC_POWER", 0.3))
+        self.current = max(self.frequencies)
+        self.reason = None
+        self.mode = "simulated"
+
+    def available(self):
+        return True
+
+    def settings(self):
+        return list(self.frequencies)
+
+    def apply(self, setting):
+        self.current = setting
+        return True
+
+    def restore(self):
+        self.current = max(self.frequencies)
+
+    def simulate(self, base_energy, base_runtime, trials=5):
+        """(name, energy, runtime) trials at the current frequency, in the RAPL csv layout."""
+        ratio = self.current / max(self.frequencies)
+        runtime = base_runtime * (self.memory_bound + (1 - self.memory_bound) / ratio)
+        base_power = base_energy / base_runtime
+        power = base_power * (self.static_power + (1 - self.static_power) * ratio ** 3)
+        return [("simulated", round(power * runtime, 3), round(runtime, 3)) for _ in range(trials)]
+
+def get_controller(backend=None):
+    """CPUFREQ_BACKEND=sysfs (default) or simulated."""
+    backend = backend or os.getenv("CPUFREQ_BACKEND", "sysfs")
+    if backend == "simulated":
+        return SimulatedCpufreq()
+    return SysfsCpufreq()
+
+def frequency_sweep(controller, measure):
+    """Run measure() (returning RAPL trials) at every setting of the controller.
+
+    Returns energy, runtime and EDP per setting plus the energy- and
+    EDP-optimal settings. When the controller cannot change the operating
+    point the report says why and nothing is measured; settings that could
+    not be applied to every cpu are listed in "skipped".
+    """
+    report = {"backend": controller.name, "mode": controller.mode}
+    if not controller.available():
+        report["status"] = "unavailable"
+        report["reason"] = controller.reason
+        print(f"frequency_sweep: cpufreq control unavailable, skipping the sweep: {controller.reason}")
+        return report
+
+    results = []
+    skipped = []
+    try:
+        for setting in controller.settings():
+            if not controller.apply(setting):
+                # some cpus may still run at the previous setting, the measurement would mix both
+                print(f"frequency_sweep: {setting} could not be applied, skipped")
+                skipped.append(setting)
+                continue
+            try:
+                trials = measure()
+            except subprocess.CalledProcessError as e:
+                print(f"frequency_sweep: measurement at {setting} failed: {e}")
+                continue
+            avg_energy = round(sum(data[1] for data in trials) / len(trials), 3)
+            avg_runtime = round(sum(data[2] for data in trials) / len(trials), 3)
+            results.append({
+                "setting": setting,
+                "avg_energy": avg_energy,
+                "avg_runtime": avg_runtime,
+                "edp": edp(avg_energy, avg_runtime),
+                "measurement_energy": round(sum(data[1] for data in trials), 3)
+            })
+            print(f"frequency_sweep: {setting}  |  Avg Energy (J): {avg_energy}  | Avg Runtime (ms): {avg_runtime}")
+    finally:
+        controller.restore()
+
+    report["status"] = "measured" if results else "failed"
+    report["results"] = results
+    if skipped:
+        report["skipped"] = skipped
+    if results:
+        report["energy_optimal"] = min(results, key=lambda result: result["avg_energy"])["setting"]
+        report["edp_optimal"] = min(results, key=lambda result: result["edp"])["setting"]
+    return report
+
+def print_report(report):
+    if report["status"] != "measured":
+        print(f"Frequency sweep ({report['backend']}): {report['status']}, {report.get('reason') or 'no setting could be measured'}")
+        return
+    print(f"Frequency sweep ({report['backend']}, {report['mode']}):")
+    for result in report["results"]:
+        marks = [name for name in ("energy_optimal", "edp_optimal") if report[name] == result["setting"]]
+        print(f"  {str(result['setting']):>28}  |  Energy (J): {result['avg_energy']:>10}  |  Runtime (ms): {result['avg_runtime']:>10}  |  EDP (J*s): {result['edp']:>10}  {' '.join(marks)}")
+    if report.get("skipped"):
+        print(f"  not applied to every cpu, skipped: {', '.join(str(setting) for setting in report['skipped'])}")
+
+if __name__ == "__main__":
+    # python3 energy/src/cpufreq.py <benchmark> [original|optimized]
+    # Sweeps a compiled version in llm/benchmarks_out, CPUFREQ_BACKEND=simulated for a dry run
+    import sys
+    from benchmark import rapl_measure
+    from registry import binary_name, get_benchmark, out_dir, prepare_inputs, production_input, shell_command
+
+    entry = get_benchmark(sys.argv[1])
+    version = sys.argv[2] if len(sys.argv) > 2 else "original"
+    source_filename = entry["source"] if version == "original" else f"optimized_{entry['source']}"
+    directory = out_dir(entry["name"])
+    if prepare_inputs(entry, [production_input(entry)]) is not None:
+        sys.exit(1)
+    command = shell_command(entry, f"{directory}/{binary_name(source_filename)}", cwd=directory)
+    controller = get_controller()
+    if controller.name == "simulated":
+        # CPUFREQ_SIM_BASE="<energy J>,<runtime ms>" skips the one real measurement at the default frequency
+        if os.getenv("CPUFREQ_SIM_BASE"):
+            base_energy, base_runtime = [float(value) for value in os.getenv("CPUFREQ_SIM_BASE").split(",")]
+        else:
+            trials = rapl_measure(command, "cpufreq", entry["rapl_name"])
+            base_energy = sum(data[1] for data in trials) / len(trials)
+            base_runtime = sum(data[2] for data in trials) / len(trials)
+        measure = lambda: controller.simulate(base_energy, base_runtime)
+    else:
+        measure = lambda: rapl_measure(command, "cpufreq", entry["rapl_name"])
+    print_report(frequency_sweep(controller, measure))
@@ -0,0 +1,402 @@
+import argparse
+import collections
+import hashlib
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+try:
+    from .benchmark import ENERGY_BACKEND, POWERCAP_DIR, cpu_package, rapl_measure
+    from .registry import binary_name, compile_benchmark, get_benchmark, prepare_inputs, production_input, shell_command
+except ImportError:
+    from benchmark import ENERGY_BACKEND, POWERCAP_DIR, cpu_package, rapl_measure
+    from registry import binary_name, compile_benchmark, get_benchmark, prepare_inputs, production_input, shell_command
+
+COORDINATOR_HOST = os.getenv("COORDINATOR_HOST", "127.0.0.1")
+COORDINATOR_PORT = int(os.getenv("COORDINATOR_PORT", 8766))
+# A leased job whose worker has not answered within this many seconds goes back to the queue
+LEASE_SECONDS = float(os.getenv("MEASURE_LEASE_SECONDS", 900))
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", 2))
+REMOTE_TIMEOUT = float(os.getenv("MEASURE_REMOTE_TIMEOUT", 3600))
+
+# Job states
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+def _read(path):
+    try:
+        with open(path, "r") as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+def _cpuinfo():
+    """Fields of the first processor in /proc/cpuinfo."""
+    fields = {}
+    with open("/proc/cpuinfo", "r") as file:
+        for line in file:
+            if not line.strip():
+                break
+            key, _, value = line.partition(":")
+            fields[key.strip()] = value.strip()
+    return fields
+
+def rapl_units():
+    """Power, energy and time units of MSR_RAPL_POWER_UNIT, or the powercap counter range when the MSR is not readable."""
+    try:
+        with open("/dev/cpu/0/msr", "rb") as file:
+            file.seek(0x606)
+            value = int.from_bytes(file.read(8), "little")
+        return {"power_w": 1 / 2 ** (value & 0xf), "energy_j": 1 / 2 ** ((value >> 8) & 0x1f), "time_s": 1 / 2 ** ((value >> 16) & 0xf)}
+    except OSError:
+        pass
+    max_range = _read(f"{POWERCAP_DIR}/intel-rapl:0/max_energy_range_uj")
+    return {"max_energy_range_uj": int(max_range)} if max_range is not None else None
+
+def hardware_fingerprint():
+    """What a measurement depends on: host, CPU model and microcode, governor, RAPL units, CPUs, kernel and backend.
+
+    The id hashes all of it. Workers pinned to different sockets of one host
+    get different ids, since each socket is its own RAPL package.
+    """
+    cpus = sorted(os.sched_getaffinity(0))
+    cpuinfo = _cpuinfo()
+    try:
+        packages = sorted({cpu_package(cpu) for cpu in cpus})
+    except OSError:
+        packages = None
+    fingerprint = {
+        "host": socket.gethostname(),
+        "cpu_model": cpuinfo.get("model name"),
+        "cpu_signature": "-".join(cpuinfo.get(key, "?") for key in ("cpu family", "model", "stepping")),
+        "microcode": cpuinfo.get("microcode"),
+        "governor": _read(f"/sys/devices/system/cpu/cpu{cpus[0]}/cpufreq/scaling_governor"),
+        "rapl_units": rapl_units(),
+        "packages": packages,
+        "cpus": len(cpus),
+        "kernel": os.uname().release,
+        "backend": ENERGY_BACKEND
+    }
+    fingerprint["id"] = hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()[:12]
+    return fingerprint
+
+def _mean_trials(trials):
+    return {"avg_energy": statistics.mean(trial[1] for trial in trials), "avg_runtime": statistics.mean(trial[2] for trial in trials)}
+
+def calibrated_trials(result, base_fingerprint):
+    """Trials of a result expressed on base_fingerprint's hardware, and the (energy, runtime) factors used.
+
+    Results from another fingerprint are scaled by how the original performs
+    on both. Without a calibration of both they are never compared: ValueError.
+    """
+    fingerprint = result["fingerprint"]["id"]
+    trials = [tuple(trial) for trial in result["trials"]]
+    if fingerprint == base_fingerprint:
+        return trials, (1.0, 1.0)
+    calibration = result.get("calibration", {})
+    if base_fingerprint not in calibration or fingerprint not in calibration:
+        raise ValueError(f"calibrated_trials: measured on {fingerprint}, no calibration against {base_fingerprint}")
+    energy_factor = calibration[base_fingerprint]["avg_energy"] / calibration[fingerprint]["avg_energy"]
+    runtime_factor = calibration[base_fingerprint]["avg_runtime"] / calibration[fingerprint]["avg_runtime"]
+    return [(name, energy * energy_factor, runtime * runtime_factor) for name, energy, runtime in trials], (round(energy_factor, 4), round(runtime_factor, 4))
+
+class Coordinator():
+    """Queue of compile+measure jobs leased to workers, and the calibration of every fingerprint.
+
+    The calibration of a benchmark on a fingerprint is the original's mean
+    energy and runtime measured there. A worker whose fingerprint has none
+    yet is asked to measure the original along with the candidate.
+
+    RAPL/main reads one package and writes one csv per host, so a second
+    rapl worker on a host where one was seen within LEASE_SECONDS is refused.
+    """
+    def __init__(self):
+        self.jobs = {}
+        self.queue = collections.deque()
+        self.calibration = {}
+        self.workers = {}
+        self.next_id = 1
+        self.lock = threading.Lock()
+
+    def submit(self, job):
+        with self.lock:
+            job_id = self.next_id
+            self.next_id += 1
+            self.jobs[job_id] = dict(job, id=job_id, status=QUEUED, submitted=time.time(), attempts=0, result=None, error=None)
+            self.queue.append(job_id)
+            return job_id
+
+    def _requeue_expired(self):
+        now = time.time()
+        for job in self.jobs.values():
+            if job["status"] == LEASED and now - job["leased"] > LEASE_SECONDS:
+                print(f"Coordinator: lease of job {job['id']} by {job['worker']} expired, requeued")
+                job["status"] = QUEUED
+                self.queue.appendleft(job["id"])
+
+    def _conflicting_worker(self, worker, fingerprint):
+        if fingerprint["backend"] != "rapl":
+            return None
+        now = time.time()
+        for name, other in self.workers.items():
+            if name != worker and other["fingerprint"]["backend"] == "rapl" and other["fingerprint"]["host"] == fingerprint["host"] and now - other["seen"] < LEASE_SECONDS:
+                return name
+        return None
+
+    def lease(self, worker, fingerprint):
+        """The next job for a worker, None when there is none; ValueError for a second rapl worker on a host."""
+        with self.lock:
+            conflict = self._conflicting_worker(worker, fingerprint)
+            if conflict is not None:
+                raise ValueError(f"{conflict} already measures with RAPL/main on {fingerprint['host']}, use one rapl worker per host or ENERGY_BACKEND=powercap")
+            self.workers[worker] = {"fingerprint": fingerprint, "seen": time.time()}
+            self._requeue_expired()
+            while self.queue:
+                job = self.jobs[self.queue.popleft()]
+                if job["status"] != QUEUED:
+                    continue
+                job.update(status=LEASED, leased=time.time(), worker=worker, attempts=job["attempts"] + 1)
+                calibrated = fingerprint["id"] in self.calibration.get(job["benchmark"], {})
+                return dict(job, calibrate=not job["original"] and not calibrated)
+            return None
+
+    def complete(self, job_id, worker, result=None, error=None):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] != LEASED or job["worker"] != worker:
+                # the lease expired and the job went to another worker
+                return False
+            if error is not None:
+                job.update(status=FAILED, error=error, finished=time.time())
+                return True
+            calibration = self.calibration.setdefault(job["benchmark"], {})
+            reference = result["trials"] if job["original"] else result.get("reference_trials")
+            if reference:
+                calibration[result["fingerprint"]["id"]] = _mean_trials(reference)
+            result["calibration"] = dict(calibration)
+            job.update(status=DONE, result=result, finished=time.time())
+            return True
+
+    def status(self, job_id=None):
+        with self.lock:
+            if job_id is not None:
+                return dict(self.jobs[job_id]) if job_id in self.jobs else None
+            return {
+                "queued": sum(1 for job in self.jobs.values() if job["status"] == QUEUED),
+                "leased": sum(1 for job in self.jobs.values() if job["status"] == LEASED),
+                "done": sum(1 for job in self.jobs.values() if job["status"] == DONE),
+                "failed": sum(1 for job in self.jobs.values() if job["status"] == FAILED),
+                "workers": dict(self.workers),
+                "calibration": dict(self.calibration)
+            }
+
+def make_handler(coordinator):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _body(self):
+            return json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+        def do_GET(self):
+            parts = self.path.strip("/").split("/")
+            if parts == ["status"]:
+                self._send(200, coordinator.status())
+            elif len(parts) == 2 and parts[0] == "jobs" and parts[1].isdigit() and coordinator.status(int(parts[1])) is not None:
+                self._send(200, coordinator.status(int(parts[1])))
+            else:
+                self._send(404, {"error": f"unknown endpoint {self.path}"})
+
+        def do_POST(self):
+            parts = self.path.strip("/").split("/")
+            body = self._body()
+            if parts == ["jobs"]:
+                self._send(201, {"id": coordinator.submit(body)})
+            elif parts == ["lease"]:
+                try:
+                    self._send(200, {"job": coordinator.lease(body["worker"], body["fingerprint"])})
+                except ValueError as e:
+                    self._send(409, {"job": None, "error": str(e)})
+            elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "result" and parts[1].isdigit():
+                accepted = coordinator.complete(int(parts[1]), body["worker"], body.get("result"), body.get("error"))
+                self._send(200 if accepted else 409, {"accepted": accepted})
+            else:
+                self._send(404, {"error": f"unknown endpoint {self.path}"})
+    return Handler
+
+def serve(host=COORDINATOR_HOST, port=COORDINATOR_PORT):
+    server = ThreadingHTTPServer((host, port), make_handler(Coordinator()))
+    print(f"serve: coordinator on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+def request(url, path, body=None, timeout=30):
+    data = json.dumps(body).encode() if body is not None else None
+    http_request = urllib.request.Request(f"{url}{path}", data=data, method="POST" if data is not None else "GET", headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(http_request, timeout=timeout) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        return json.load(e)
+
+def submit_remote(url, entry, language, source, original_source, original=False):
+    """Queue a compile+measure job, returns its id without waiting."""
+    return request(url, "/jobs", {"benchmark": entry["name"], "language": language, "source": source, "original_source": original_source, "original": original})["id"]
+
+def measure_remote(url, entry, language, source, original_source, original=False, timeout=REMOTE_TIMEOUT, job_id=None):
+    """Wait for the result (trials, fingerprint, calibration) of a job, submitting it unless job_id is given."""
+    if job_id is None:
+        job_id = submit_remote(url, entry, language, source, original_source, original)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = request(url, f"/jobs/{job_id}")
+        if job["status"] == DONE:
+            return dict(job["result"], worker=job["worker"])
+        if job["status"] == FAILED:
+            raise RuntimeError(f"measure_remote: job {job_id} failed on {job['worker']}: {job['error']}")
+        time.sleep(WORKER_POLL_SECONDS)
+    raise RuntimeError(f"measure_remote: job {job_id} not measured within {timeout} s")
+
+def _build(entry, source, work_dir):
+    """Binary of a source, compiled once per worker and kept by content."""
+    digest = hashlib.sha256(source.encode()).hexdigest()[:16]
+    directory = f"{work_dir}/{digest}"
+    binary_path = f"{directory}/{binary_name(entry['source'])}"
+    if os.path.isfile(binary_path):
+        return binary_path
+    os.makedirs(directory, exist_ok=True)
+    source_path = f"{directory}/{entry['source']}"
+    with open(source_path, "w") as file:
+        file.write(source)
+    with open(f"{directory}/compile.log", "w") as output_log:
+        if not compile_benchmark(entry, source_path, binary_path, output_log, cwd=directory):
+            raise RuntimeError(f"does not compile: {_read(f'{directory}/compile.log')}")
+    return binary_path
+
+def measure_job(job, work_dir, fingerprint):
+    entry = get_benchmark(job["benchmark"])
+    input_error = prepare_inputs(entry, [production_input(entry)])
+    if input_error is not None:
+        raise RuntimeError(f"input not generated: {input_error}")
+
+    def measure(source):
+        binary_path = _build(entry, source, work_dir)
+        command = shell_command(entry, binary_path, cwd=os.path.dirname(binary_path))
+        return [list(trial) for trial in rapl_measure(command, job["language"], entry["rapl_name"], f"{work_dir}/{job['language']}.csv")]
+
+    result = {"fingerprint": fingerprint, "trials": measure(job["source"])}
+    if job.get("calibrate"):
+        result["reference_trials"] = measure(job["original_source"])
+    return result
+
+def worker(url, name=None, cpus=None):
+    """Lease jobs from the coordinator forever, one measurement at a time."""
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    name = name or f"{socket.gethostname()}-{os.getpid()}"
+    fingerprint = hardware_fingerprint()
+    work_dir = tempfile.mkdtemp(prefix=f"eedc-worker-{os.getpid()}-")
+    print(f"worker: {name} on {fingerprint['cpu_model']} ({fingerprint['id']}, packages {fingerprint['packages']}, {fingerprint['cpus']} cpus)")
+    try:
+        while True:
+            try:
+                response = request(url, "/lease", {"worker": name, "fingerprint": fingerprint})
+            except (OSError, urllib.error.URLError) as e:
+                print(f"worker: coordinator unreachable: {e}")
+                time.sleep(WORKER_POLL_SECONDS * 5)
+                continue
+            if response.get("error"):
+                print(f"worker: refused by the coordinator: {response['error']}")
+                return
+            job = response["job"]
+            if job is None:
+                time.sleep(WORKER_POLL_SECONDS)
+                continue
+            print(f"worker: job {job['id']} ({job['benchmark']}{', with calibration' if job['calibrate'] else ''})")
+            try:
+                body = {"worker": name, "result": measure_job(job, work_dir, fingerprint)}
+            except (OSError, RuntimeError, subprocess.CalledProcessError) as e:
+                body = {"worker": name, "error": str(e)}
+            request(url, f"/jobs/{job['id']}/result", body)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def cpu_groups(count):
+    """CPU sets for count local workers: one socket each when there are enough sockets, else equal slices of the CPUs."""
+    cpus = sorted(os.sched_getaffinity(0))
+    packages = collections.defaultdict(list)
+    for cpu in cpus:
+        try:
+            packages[cpu_package(cpu)].append(cpu)
+        except OSError:
+            packages[0].append(cpu)
+    if len(packages) >= count:
+        return [packages[package] for package in sorted(packages)[:count]]
+    size = max(1, len(cpus) // count)
+    return [cpus[i * size:(i + 1) * size] for i in range(count)]
+
+def parse_cpus(text):
+    """"0-3,8" -> [0, 1, 2, 3, 8]"""
+    cpus = []
+    for part in text.split(","):
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+if __name__ == "__main__":
+    # python3 energy/src/distributed.py coordinator
+    # python3 energy/src/distributed.py worker [--coordinator http://host:8766] [--cpus 0-7 | --package 1]
+    # python3 energy/src/distributed.py local 4    (coordinator and 4 pinned workers on this machine)
+    # python3 energy/src/distributed.py status
+    parser = argparse.ArgumentParser(description="Distributed compile+measure workers and their coordinator")
+    parser.add_argument("command", choices=["coordinator", "worker", "local", "status"])
+    parser.add_argument("workers", nargs="?", type=int, default=2)
+    parser.add_argument("--coordinator", default=os.getenv("MEASURE_COORDINATOR", f"http://{COORDINATOR_HOST}:{COORDINATOR_PORT}"))
+    parser.add_argument("--name", default=None)
+    parser.add_argument("--cpus", default=None, help="CPUs the worker is pinned to, e.g. 0-7")
+    parser.add_argument("--package", type=int, default=None, help="pin the worker to every CPU of this socket")
+    args = parser.parse_args()
+
+    if args.command == "coordinator":
+        serve()
+    elif args.command == "worker":
+        cpus = parse_cpus(args.cpus) if args.cpus else None
+        if args.package is not None:
+            cpus = [cpu for cpu in sorted(os.sched_getaffinity(0)) if cpu_package(cpu) == args.package]
+            os.environ["RAPL_PACKAGE"] = str(args.package)
+        worker(args.coordinator, args.name, cpus)
+    elif args.command == "local":
+        threading.Thread(target=serve, daemon=True).start()
+        processes = []
+        for index, cpus in enumerate(cpu_groups(args.workers)):
+            command = [sys.executable, __file__, "worker", "--coordinator", f"http://{COORDINATOR_HOST}:{COORDINATOR_PORT}", "--name", f"local-{index}", "--cpus", ",".join(map(str, cpus))]
+            processes.append(subprocess.Popen(command))
+        try:
+            for process in processes:
+                process.wait()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+    else:
+        print(json.dumps(request(args.coordinator, "/status"), indent=4))
@@ -0,0 +1,252 @@
+import math
+import os
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+from dotenv import load_dotenv
+try:
+    import pynvml
+except ImportError:
+    pynvml = None
+
+load_dotenv()
+USER_PREFIX = os.getenv('USER_PREFIX')
+
+#what meters the optimizer itself: "powercap" sums the intel-rapl package and dram counters in sysfs
+#(plus the NVIDIA GPUs when pynvml is installed),
+#"simulated" charges SIMULATED_PACKAGE_POWER watts of wall time, "none" turns metering off;
+#defaults to the measurement backend, with RAPL/main falling back to powercap
+ENERGY_BACKEND = os.getenv("ENERGY_BACKEND", "rapl")
+ENERGY_METER = os.getenv("ENERGY_METER", "powercap" if ENERGY_BACKEND == "rapl" else ENERGY_BACKEND)
+POWERCAP_DIR = "/sys/class/powercap"
+SIMULATED_PACKAGE_POWER = float(os.getenv("SIMULATED_PACKAGE_POWER", 30.0))
+#seconds between background reads of the powercap counters, well inside their wrap period
+METER_INTERVAL = float(os.getenv("METER_INTERVAL", 30))
+#energy per token of inference that does not run on this machine (OpenAI, a remote Ollama); unset leaves it out
+LLM_JOULES_PER_TOKEN = float(os.getenv("LLM_JOULES_PER_TOKEN")) if os.getenv("LLM_JOULES_PER_TOKEN") else None
+
+# Pipeline stages the optimization cost is split into, by span name
+STAGE_SPANS = {
+    "llm": ("llm.optimize", "llm.compilation_error", "llm.logic_error", "llm.evaluator"),
+    "compile": ("compile",),
+    "regression": ("run", "differential_test"),
+    "measurement": ("rapl_measure", "remote_measure")
+}
+# Time outside every stage: the driver, builds of the measurement stage, profiling, idle waits
+OTHER = "other"
+
+def stage_of(span_name):
+    for stage, names in STAGE_SPANS.items():
+        if span_name in names:
+            return stage
+    return None
+
+def _nvml_devices():
+    """NVML handles of the GPUs that report their total energy, none without pynvml or a driver."""
+    if pynvml is None:
+        return []
+    try:
+        pynvml.nvmlInit()
+        handles = [pynvml.nvmlDeviceGetHandleByIndex(index) for index in range(pynvml.nvmlDeviceGetCount())]
+    except pynvml.NVMLError:
+        return []
+    devices = []
+    for handle in handles:
+        try:
+            pynvml.nvmlDeviceGetTotalEnergyConsumption(handle)
+            devices.append(handle)
+        except pynvml.NVMLError:
+            # before Volta the counter does not exist
+            pass
+    return devices
+
+class PowercapMeter():
+    """Joules of the CPU packages, their DRAM and the GPUs since the meter was created.
+
+    The package and dram domains of intel-rapl are summed; core and uncore
+    are part of their package and psys already contains the packages. GPUs
+    are read through NVML when pynvml is installed. scope names what is
+    covered, "package" alone means the figure is CPU-package only.
+    """
+    def __init__(self):
+        self.domains = []
+        kinds = set()
+        for name in sorted(os.listdir(POWERCAP_DIR)):
+            domain = f"{POWERCAP_DIR}/{name}"
+            if not name.startswith("intel-rapl:"):
+                continue
+            with open(f"{domain}/name", "r") as file:
+                kind = file.read().strip().split("-")[0]
+            if kind not in ("package", "dram"):
+                continue
+            with open(f"{domain}/max_energy_range_uj", "r") as file:
+                wrap = int(file.read())
+            self.domains.append((f"{domain}/energy_uj", wrap))
+            kinds.add(kind)
+        if not self.domains:
+            raise FileNotFoundError(f"PowercapMeter: no intel-rapl package domains in {POWERCAP_DIR}")
+        self.gpus = _nvml_devices()
+        self.scope = "+".join([kind for kind in ("package", "dram") if kind in kinds] + (["gpu"] if self.gpus else []))
+        self.last = [self._counter(path) for path, _ in self.domains]
+        self.last_gpu = [pynvml.nvmlDeviceGetTotalEnergyConsumption(handle) for handle in self.gpus]
+        self.total = 0.0
+
+    def _counter(self, path):
+        with open(path, "r") as file:
+            return int(file.read())
+
+    def read(self):
+        # the counters wrap at max_energy_range_uj
+        for index, (path, wrap) in enumerate(self.domains):
+            value = self._counter(path)
+            self.total += ((value - self.last[index]) % (wrap + 1)) / 1e6
+            self.last[index] = value
+        # millijoules since the driver was loaded
+        for index, handle in enumerate(self.gpus):
+            value = pynvml.nvmlDeviceGetTotalEnergyConsumption(handle)
+            self.total += (value - self.last_gpu[index]) / 1e3
+            self.last_gpu[index] = value
+        return self.total
+
+class SimulatedMeter():
+    """Wall time at SIMULATED_PACKAGE_POWER watts, the model simulated measurements use."""
+    def __init__(self):
+        self.start = time.time()
+        self.scope = "simulated"
+
+    def read(self):
+        return (time.time() - self.start) * SIMULATED_PACKAGE_POWER
+
+def make_meter(kind=ENERGY_METER):
+    """The meter of kind and None, or None and why it is off or this machine cannot provide it."""
+    if kind == "simulated":
+        return SimulatedMeter(), None
+    if kind != "powercap":
+        return None, f"ENERGY_METER={kind}"
+    try:
+        return PowercapMeter(), None
+    except PermissionError as e:
+        # energy_uj is root-only since kernel 5.10 (CVE-2020-8694)
+        reason = f"{e.filename} is only readable by root, run as root or make the intel-rapl energy_uj files readable"
+    except OSError as e:
+        reason = f"powercap not readable ({e})"
+    print(f"make_meter: {reason}, optimizer energy is not metered")
+    return None, reason
+
+class EnergyAccount():
+    """Energy of the machine, split over the pipeline stages that were running.
+
+    The counter is read whenever a stage starts or ends, and the joules in
+    between are shared equally by the stage spans open at that time (or
+    booked as OTHER when none is). Overlapping stages of the pipeline mode
+    are therefore not counted twice and the stages add up to the total.
+    """
+    def __init__(self, meter=None, reason=None):
+        self.meter = meter
+        self.reason = reason
+        self.lock = threading.Lock()
+        self.active = {}
+        self.totals = {}
+        self.last = meter.read() if meter else 0.0
+        if isinstance(meter, PowercapMeter):
+            threading.Thread(target=self._sample, daemon=True).start()
+
+    def _sample(self):
+        # long stages would otherwise let a counter wrap more than once between reads
+        while True:
+            time.sleep(METER_INTERVAL)
+            self.read()
+
+    def _advance(self):
+        reading = self.meter.read()
+        delta = reading - self.last
+        self.last = reading
+        open_spans = sum(self.active.values())
+        if open_spans == 0:
+            self.totals[OTHER] = self.totals.get(OTHER, 0.0) + delta
+            return reading
+        for stage, count in self.active.items():
+            if count:
+                self.totals[stage] = self.totals.get(stage, 0.0) + delta * count / open_spans
+        return reading
+
+    def read(self):
+        """Cumulative joules, None without a meter."""
+        if self.meter is None:
+            return None
+        with self.lock:
+            return self._advance()
+
+    def enter(self, stage):
+        if self.meter is None:
+            return None
+        with self.lock:
+            reading = self._advance()
+            self.active[stage] = self.active.get(stage, 0) + 1
+        return reading
+
+    def exit(self, stage):
+        if self.meter is None:
+            return None
+        with self.lock:
+            reading = self._advance()
+            self.active[stage] -= 1
+        return reading
+
+    def snapshot(self):
+        """Joules per stage so far."""
+        if self.meter is None:
+            return None
+        with self.lock:
+            self._advance()
+            return dict(self.totals)
+
+account = EnergyAccount(*make_meter())
+
+def local_llm(client, host=None):
+    """Whether the LLM runs on this machine, so the meter already sees its inference."""
+    if client == "openai":
+        return False
+    host = urlparse(host or os.getenv("OLLAMA_HOST", "http://localhost:11434")).hostname
+    return host in ("localhost", "127.0.0.1", "::1", "0.0.0.0")
+
+def net_energy(start, end, usage, inference_local, original_energy, best_energy):
+    """Optimization cost, per-execution savings and break-even executions of a run.
+
+    start and end are account snapshots taken around the run; usage is the
+    run's llm_usage. Inference elsewhere is added at LLM_JOULES_PER_TOKEN.
+    """
+    if start is None or end is None:
+        return {"metered": False, "meter": ENERGY_METER, "reason": account.reason}
+    stages = {stage: round(end.get(stage, 0.0) - start.get(stage, 0.0), 3) for stage in list(STAGE_SPANS) + [OTHER]}
+    tokens = usage["prompt_tokens"] + usage["completion_tokens"]
+    if not inference_local:
+        stages["llm_remote"] = round(tokens * LLM_JOULES_PER_TOKEN, 3) if LLM_JOULES_PER_TOKEN is not None else None
+    total = round(sum(joules for joules in stages.values() if joules is not None), 3)
+    savings = round(original_energy - best_energy, 3) if original_energy is not None and best_energy is not None else None
+    return {
+        "metered": True,
+        "meter": ENERGY_METER,
+        # "package" alone: CPU-package only, DRAM and GPUs are not in the figure
+        "scope": account.meter.scope if account.meter else None,
+        "inference_local": inference_local,
+        "optimization_joules": total,
+        "stages": stages,
+        "original_joules_per_execution": original_energy,
+        "best_joules_per_execution": best_energy,
+        "savings_joules_per_execution": savings,
+        # production executions of the best version before the optimizer's energy is paid back
+        "break_even_executions": math.ceil(total / savings) if savings and savings > 0 else None
+    }
+
+if __name__ == "__main__":
+    # python3 energy/src/energy_meter.py [seconds]: package power of this machine as the meter sees it
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    start = account.read()
+    if start is None:
+        print(f"energy_meter: no meter ({account.reason})")
+        sys.exit(1)
+    time.sleep(seconds)
+    joules = account.read() - start
+    print(f"energy_meter: {ENERGY_METER} ({account.meter.scope}), {joules:.3f} J in {seconds} s, {joules / seconds:.2f} W")
@@ -1,28 +1,102 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from dotenv import load_dotenv
+import difflib
 import json
-from openai import OpenAI
 import os
 from pydantic import BaseModel
+import sys
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../llm/src')))
+from llm_clients import complete
+from llm_usage import get_usage
+import artifacts
+import tracing
 
 load_dotenv()
-openai_key = os.getenv('API_KEY')
 
-def evaluator_llm(client, model_name, benchmark_info):
+# Evaluator modes: full analysis, a shorter targeted review, or no call at all
+FULL = "full"
+BRIEF = "brief"
+SKIP = "skip"
 
-    #extract original
-    original_source_code = benchmark_info["original"]["source_code"]
-    original_avg_energy = benchmark_info["original"]["avg_energy"]
-    original_avg_runtime = benchmark_info["original"]["avg_runtime"]
-    # print(original_source_code)
-    lowest_soruce_code = benchmark_info["lowest_avg_energy"]["source_code"]
-    lowest_avg_energy = benchmark_info["lowest_avg_energy"]["avg_energy"]
-    lowest_avg_runtime = benchmark_info["lowest_avg_energy"]["avg_runtime"]
+# Send diffs against the original when this share of the lines is unchanged
+DIFF_SIMILARITY = 0.6
 
-    current_source_code = benchmark_info["current"]["source_code"]  
-    current_avg_energy = benchmark_info["current"]["avg_energy"]
-    current_avg_runtime = benchmark_info["current"]["avg_runtime"]
+def _code_block(source_code):
+    return f"""```
+    {source_code}
+    ```"""
 
-    prompt = f"""
+def _diff_against_original(original_source_code, source_code):
+    diff = difflib.unified_diff(
+        original_source_code.splitlines(),
+        source_code.splitlines(),
+        fromfile="original",
+        tofile="version",
+        lineterm=""
+    )
+    return "\n".join(diff)
+
+def _memory_line(version):
+    memory = version.get("memory") or {}
+    if memory.get("peak_rss_kb") is None:
+        return ""
+    line = f"\n    Peak memory (RSS): {memory['peak_rss_kb']} KB, page faults: {memory.get('major_page_faults')} major / {memory.get('minor_page_faults')} minor"
+    if (memory.get("massif") or {}).get("peak_heap_bytes") is not None:
+        line += f", peak heap: {memory['massif']['peak_heap_bytes']} bytes"
+    return line
+
+def format_code_sections(benchmark_info, mode=FULL):
+    """Code part of the evaluator prompt, using diffs when the versions are close."""
+    original = benchmark_info["original"]
+    lowest = benchmark_info["lowest_avg_energy"]
+    current = benchmark_info["current"]
+
+    use_diff = all(
+        difflib.SequenceMatcher(None, original["source_code"].splitlines(), version["source_code"].splitlines(), autojunk=False).ratio() >= DIFF_SIMILARITY
+        for version in (lowest, current)
+    )
+
+    def show(version):
+        if use_diff:
+            return "(unified diff against the original code)\n    " + _code_block(_diff_against_original(original["source_code"], version["source_code"]))
+        return _code_block(version["source_code"])
+
+    sections = f"""Here is the original code snippet:
+    {_code_block(original["source_code"])}
+    Average energy usage: {original["avg_energy"]}
+    Average run time: {original["avg_runtime"]}{_memory_line(original)}
+"""
+    # the best version is only worth a separate copy when it is not the current one
+    if mode == FULL and lowest["source_code"] != current["source_code"]:
+        sections += f"""
+    Here is the best code snippets(the lowest energy usage):
+    {show(lowest)}
+    Average energy usage: {lowest["avg_energy"]}
+    Average run time: {lowest["avg_runtime"]}{_memory_line(lowest)}
+"""
+    sections += f"""
+    Here is the current code snippiets that you are tasked to optimize:
+    {show(current)}
+    Average energy usage: {current["avg_energy"]}
+    Average run time: {current["avg_runtime"]}{_memory_line(current)}
+"""
+    return sections
+
+def evaluator_llm(client, model_name, benchmark_info, mode=FULL):
+
+    code_sections = format_code_sections(benchmark_info, mode)
+
+    if mode == BRIEF:
+        prompt = f"""
+    You are a code optimization and energy efficiency expert. The current code below performs about the same as the best version found so far. Briefly list the three most promising remaining changes that could reduce its energy consumption, most impactful first, each with a short code example.
+
+    {code_sections}
+    Please respond in natural language (English) with concise, actionable suggestions.
+    """
+    else:
+        prompt = f"""
     You are a code optimization and energy efficiency expert. Evaluate the following current code snippet in terms of time complexity, space complexity, readability, energy usage, and performance, considering both the original and optimized code. Please provide a comprehensive analysis of the code's efficiency, energy consumption, and suggest further optimizations. Your feedback should include:
 
     1. **Current Code Behavior**:
@@ -50,26 +124,7 @@ def evaluator_llm(client, model_name, benchmark_info):
     - Suggest best practices and coding patterns for energy-efficient code, particularly focusing on areas where the current code deviates from these principles.
     - Point out potential areas where energy could be saved, such as reducing CPU-bound tasks, optimizing memory usage, or minimizing I/O operations.
 
-    Here is the original code snippet:
-    ```
-    {original_source_code}
-    ```
-    Average energy usage: {original_avg_energy}
-    Average run time: {original_avg_runtime}
-
-    Here is the best code snippets(the lowest energy usage):
-    ```
-    {lowest_soruce_code}
-    ```
-    Average energy usage: {lowest_avg_energy}
-    Average run time: {lowest_avg_runtime}
-
-    Here is the current code snippiets that you are tasked to optimize:
-    ```
-    {current_source_code}
-    ```
-    Average energy usage: {current_avg_energy}
-    Average run time: {current_avg_runtime}
+    {code_sections}
 
     Please respond in natural language (English) with actionable suggestions for improving the code's performance in terms of energy usage. Provide only the best code with the lowest energy usage.
     """
@@ -84,17 +139,9 @@ def evaluator_llm(client, model_name, benchmark_info):
                     "content": prompt
                 }
                 ]
-    if client == "openai":
-        client = OpenAI(api_key=openai_key)
-        
-        response = client.beta.chat.completions.parse(
-            model="gpt-4o-2024-08-06",
-            messages=messages
-        )
-        evaluator_feedback = response.choices[0].message.content
-    else:
-        output = client.chat(model=model_name, messages=messages)
-        evaluator_feedback = output["message"]["content"]
+    with tracing.span("llm.evaluator", model=model_name) as llm_span:
+        evaluator_feedback = complete(client, model_name, "evaluator", messages).text
+        llm_span["response_chars"] = len(evaluator_feedback)
 
 
     #write to file
@@ -103,7 +150,114 @@ def evaluator_llm(client, model_name, benchmark_info):
     prompt_path = os.path.join(current_dir, "evaluator_promt.txt")
     with open(prompt_path, "w") as file:
         file.write(prompt)
-    with open(file_path, "w") as file:
+    # the optimizer may read the feedback while a background evaluation writes it
+    with open(file_path + ".tmp", "w") as file:
         file.write(evaluator_feedback)
+    os.replace(file_path + ".tmp", file_path)
+    artifacts.record("evaluator_prompt", prompt)
+    artifacts.record("evaluator_feedback", evaluator_feedback)
     
-    return evaluator_feedback
\ No newline at end of file
+    return evaluator_feedback
+
+class AsyncEvaluator():
+    """Runs evaluator_llm in the background and decides how much of it is needed.
+
+    A version whose source was already evaluated, or whose energy is within
+    noise_factor standard deviations of the best seen so far, does not get a
+    new full evaluation: the previous feedback is kept (skip), or a brief review
+    is requested when there is no feedback yet.
+    """
+    def __init__(self, client, model_name, noise_factor=2.0, call_guard=None):
+        self.client = client
+        self.model_name = model_name
+        self.noise_factor = noise_factor
+        # context manager factory held around every evaluator call (the pipeline's MeasurementGate)
+        self.call_guard = call_guard
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+        self.last_source = None
+        self.last_feedback = None
+        self.best_energy = None
+        self.calls = []
+
+    def choose_mode(self, benchmark_info):
+        current = benchmark_info["current"]
+        if self.last_feedback is not None and current["source_code"] == self.last_source:
+            return SKIP
+        if self.best_energy is not None:
+            noise = self.noise_factor * current.get("energy_std", 0.0)
+            if abs(self.best_energy - current["avg_energy"]) <= noise:
+                return SKIP if self.last_feedback is not None else BRIEF
+        return FULL
+
+    def busy(self):
+        return self.pending is not None and not self.pending.done()
+
+    def submit(self, benchmark_info, on_done=None):
+        """Start evaluating a measured version, returns the chosen mode."""
+        # one evaluation at a time, the newest version wins
+        self.wait()
+        mode = self.choose_mode(benchmark_info)
+        energies = [benchmark_info["original"]["avg_energy"], benchmark_info["current"]["avg_energy"]]
+        if self.best_energy is not None:
+            energies.append(self.best_energy)
+        self.best_energy = min(energies)
+
+        if mode == SKIP:
+            stats = {"mode": SKIP, "latency": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "waited": 0.0, "feedback": self.last_feedback}
+            self.calls.append(stats)
+            print("AsyncEvaluator: skipping evaluator, keeping previous feedback")
+            if on_done is not None:
+                on_done(stats)
+            return mode
+
+        self.pending = self.executor.submit(self._evaluate, benchmark_info, mode)
+        if on_done is not None:
+            self.pending.add_done_callback(lambda future: on_done(future.result()) if future.exception() is None else None)
+        return mode
+
+    def _evaluate(self, benchmark_info, mode):
+        before = get_usage()["by_stage"].get("evaluator", {})
+        start_time = time.time()
+        with self.call_guard() if self.call_guard is not None else nullcontext():
+            feedback = evaluator_llm(self.client, self.model_name, benchmark_info, mode)
+        latency = time.time() - start_time
+        after = get_usage()["by_stage"].get("evaluator", {})
+
+        self.last_source = benchmark_info["current"]["source_code"]
+        self.last_feedback = feedback
+        stats = {
+            "mode": mode,
+            "latency": latency,
+            "prompt_tokens": after.get("prompt_tokens", 0) - before.get("prompt_tokens", 0),
+            "completion_tokens": after.get("completion_tokens", 0) - before.get("completion_tokens", 0),
+            "waited": 0.0,
+            "feedback": feedback
+        }
+        self.calls.append(stats)
+        return stats
+
+    def poll(self):
+        """Stats of the last evaluation if it has finished, without blocking."""
+        if self.pending is None or not self.pending.done():
+            return None
+        return self.wait()
+
+    def wait(self):
+        """Block until the running evaluation finishes, returns its stats (or None)."""
+        if self.pending is None:
+            return None
+        start_time = time.time()
+        try:
+            stats = self.pending.result()
+        except Exception as e:
+            print(f"AsyncEvaluator: evaluator failed: {e}")
+            stats = None
+        else:
+            stats["waited"] = time.time() - start_time
+        self.pending = None
+        return stats
+
+    def shutdown(self):
+        self.wait()
+        self.executor.shutdown()
@@ -0,0 +1,147 @@
+import fcntl
+import mmap
+import os
+import shutil
+import subprocess
+import sys
+try:
+    from .registry import baseline_dir, binary_name, compile_benchmark, get_benchmark, load_registry, run_command
+except ImportError:
+    from registry import baseline_dir, binary_name, compile_benchmark, get_benchmark, load_registry, run_command
+
+# Generated inputs live in memory, so no trial or regression run reads them from storage
+TMPFS_DIR = "/dev/shm/eedc-inputs"
+# Used when /dev/shm is missing or full; files there are pre-faulted into the page cache before each use
+DISK_DIR = "llm/inputs"
+
+def _is_tmpfs(path):
+    path = os.path.realpath(path)
+    best, fstype = "", None
+    with open("/proc/mounts", "r") as file:
+        for line in file:
+            fields = line.split()
+            mount_point = fields[1]
+            if (path == mount_point or path.startswith(mount_point.rstrip("/") + "/")) and len(mount_point) > len(best):
+                best, fstype = mount_point, fields[2]
+    return fstype == "tmpfs"
+
+def staging_dirs():
+    """Directories tried for generated inputs, INPUT_STAGING_DIR first when set."""
+    user_prefix = os.getenv('USER_PREFIX') or os.path.abspath(os.path.join(os.path.dirname(__file__), '../..'))
+    dirs = [os.getenv("INPUT_STAGING_DIR")] if os.getenv("INPUT_STAGING_DIR") else []
+    return dirs + [TMPFS_DIR, f"{user_prefix}/{DISK_DIR}"]
+
+def prefault(path):
+    """Pull every page of the file into memory, so reading it does no storage I/O."""
+    if os.path.getsize(path) == 0:
+        return
+    with open(path, "rb") as file:
+        os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        with mmap.mmap(file.fileno(), 0, prot=mmap.PROT_READ) as mapped:
+            mapped.madvise(mmap.MADV_WILLNEED)
+            for offset in range(0, len(mapped), mmap.PAGESIZE):
+                mapped[offset]
+
+def _generator_binary(generator, directory):
+    """The original generator benchmark, built once in the staging directory."""
+    entry = get_benchmark(generator)
+    binary_path = os.path.join(directory, binary_name(entry["source"]))
+    if not os.path.isfile(binary_path):
+        # built from a copy, the object file would otherwise land in benchmarks/
+        source_path = os.path.join(directory, entry["source"])
+        shutil.copyfile(os.path.join(baseline_dir(entry["name"]), entry["source"]), source_path)
+        if not compile_benchmark(entry, source_path, binary_path + ".tmp", cwd=directory):
+            raise RuntimeError(f"staged_input: {entry['source']} does not compile")
+        os.replace(binary_path + ".tmp", binary_path)
+        os.remove(source_path + ".o")
+    return entry, binary_path
+
+def _generate(stdin, path):
+    """Write the input to path, and its size to path.size once it is complete.
+
+    The generator's output is copied through a pipe: writing it straight to a
+    full tmpfs would truncate the file while the generator still exits 0,
+    here the write raises OSError (ENOSPC) instead.
+    """
+    with open(path + ".tmp", "wb") as file:
+        if stdin["generator"] != "empty":
+            entry, binary_path = _generator_binary(stdin["generator"], os.path.dirname(path))
+            command = run_command(entry, binary_path, {"args": [str(stdin["n"])]})
+            with subprocess.Popen(command, cwd=os.path.dirname(path), stdout=subprocess.PIPE) as process:
+                try:
+                    shutil.copyfileobj(process.stdout, file)
+                except OSError:
+                    process.kill()
+                    raise
+            if process.returncode != 0:
+                raise subprocess.CalledProcessError(process.returncode, command)
+    os.replace(path + ".tmp", path)
+    with open(path + ".size", "w") as file:
+        file.write(str(os.path.getsize(path)))
+
+def _is_complete(path):
+    """Whether a staged file has the size recorded when it was generated."""
+    try:
+        with open(path + ".size", "r") as file:
+            return int(file.read()) == os.path.getsize(path)
+    except (OSError, ValueError):
+        return False
+
+def input_name(stdin):
+    # named after the generator and n, so benchmarks reading the same FASTA share it
+    return "empty.txt" if stdin["generator"] == "empty" else f"{stdin['generator']}-{stdin['n']}.txt"
+
+def staged_path(stdin):
+    """Where a generated stdin file is staged, without generating it.
+
+    Before staged_input made it, this is where it would go first, which does
+    not exist yet.
+    """
+    paths = [os.path.join(directory, input_name(stdin)) for directory in staging_dirs()]
+    return next((path for path in paths if _is_complete(path)), paths[0])
+
+def staged_input(stdin):
+    """Path of a generated stdin file (the generator benchmark's output for n, or empty), made once.
+
+    Generation is locked, so concurrent runs wait for one writer instead of
+    each producing a copy. A file whose size differs from the one recorded at
+    generation (truncated, or staged before sizes were recorded) is made
+    again. Raises RuntimeError when no directory can hold it or the generator
+    does not build, and CalledProcessError when it fails.
+    """
+    name = input_name(stdin)
+    for directory in staging_dirs():
+        path = os.path.join(directory, name)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, ".lock"), "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if not _is_complete(path):
+                    if os.path.isfile(path):
+                        print(f"staged_input: {path} does not have its recorded size, generating it again")
+                    _generate(stdin, path)
+        except OSError as e:
+            # tmpfs full or not writable, try the next directory
+            print(f"staged_input: cannot stage {name} in {directory}: {e}")
+            for leftover in (path, path + ".tmp", path + ".size"):
+                if os.path.isfile(leftover):
+                    os.remove(leftover)
+            continue
+        if not _is_tmpfs(directory):
+            prefault(path)
+        return path
+    raise RuntimeError(f"staged_input: no staging directory could hold {name}")
+
+def stage_all(names=None):
+    """Generate the stdin files of every input set and test input ahead of the run."""
+    registry = load_registry()
+    for name in names or registry.keys():
+        entry = registry[name]
+        for size, input_set in list(entry["inputs"].items()) + list(entry.get("test_inputs", {}).items()):
+            if "generator" in input_set.get("stdin", {}):
+                path = staged_input(input_set["stdin"])
+                print(f"stage_all: {name} ({size}) {path} {os.path.getsize(path)} bytes")
+
+if __name__ == "__main__":
+    # python3 energy/src/inputs.py [benchmark ...]
+    stage_all(sys.argv[1:] or None)
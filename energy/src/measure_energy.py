@@ -2,10 +2,12 @@ try:
     # Try relative imports
     from .benchmark import Benchmark
     from .evaluator import evaluator_llm
+    from .registry import out_dir
 except ImportError:
     # If relative imports fail, use absolute imports
     from benchmark import Benchmark
     from evaluator import evaluator_llm
+    from registry import out_dir
 import pickle
 import os
 from dotenv import load_dotenv
@@ -13,6 +15,7 @@ import os
 load_dotenv()
 USER_PREFIX = os.getenv('USER_PREFIX')
 benchmark_data = {}
+benchmark_metrics = {}
 
 def load_benchmark_data(filepath):
     with open(filepath, "rb") as file:
@@ -20,7 +23,27 @@ def load_benchmark_data(filepath):
     # print(contents)
     return contents
 
-def extract_content(contents):
+# Versions whose peak RSS grows past this multiple of the original's are never the best (unset: no limit)
+MAX_PEAK_RSS_RATIO = float(os.getenv("MAX_PEAK_RSS_RATIO")) if os.getenv("MAX_PEAK_RSS_RATIO") else None
+
+def peak_rss_ratio(metrics, key):
+    """Peak RSS of a version relative to the original, None when either was not profiled."""
+    original = metrics.get(0, {}).get("memory", {}).get("peak_rss_kb")
+    version = metrics.get(key, {}).get("memory", {}).get("peak_rss_kb")
+    if not original or version is None:
+        return None
+    return round(version / original, 3)
+
+def within_memory_limit(metrics, key):
+    ratio = peak_rss_ratio(metrics, key)
+    return MAX_PEAK_RSS_RATIO is None or ratio is None or ratio <= MAX_PEAK_RSS_RATIO
+
+def reference_version(contents, metrics, exclude):
+    """Lowest-energy measured version within the memory limit, the one a candidate is tested against."""
+    keys = [key for key in contents if key != exclude and (key == 0 or within_memory_limit(metrics, key))]
+    return min(keys, key=lambda key: contents[key][1]) if keys else None
+
+def extract_content(contents, metrics=None):
     # Convert keys to a sorted list to access the first and last elements
     keys = list(contents.keys())
 
@@ -43,6 +66,9 @@ def extract_content(contents):
     min_avg_energy = float('inf')
     min_energy_key = None
     for key, (source_code, avg_energy, avg_runtime) in contents.items():
+        # a version that trades too much memory for energy is not a candidate for the best
+        if key != first_key and metrics is not None and not within_memory_limit(metrics, key):
+            continue
         if avg_energy < min_avg_energy:
             min_avg_energy = avg_energy
             min_energy_key = key
@@ -68,6 +94,13 @@ def extract_content(contents):
         }
     }
     
+    # Peak memory of each version, next to its energy
+    if metrics is not None:
+        for name, key in (("original", first_key), ("lowest_avg_energy", min_energy_key), ("current", last_key)):
+            benchmark_info[name]["memory"] = metrics.get(key, {}).get("memory")
+            benchmark_info[name]["peak_rss_ratio"] = peak_rss_ratio(metrics, key)
+        benchmark_info["current"]["within_memory_limit"] = within_memory_limit(metrics, last_key)
+
     return benchmark_info
 
 def print_benchmark_info(benchmark_info):
@@ -91,9 +124,41 @@ def print_benchmark_info(benchmark_info):
     # print("Source Code:", benchmark_info["current"]["source_code"])
     print("Average Energy:", benchmark_info["current"]["avg_energy"])
     print("Average Runtime:", benchmark_info["current"]["avg_runtime"])
+    if benchmark_info["current"].get("memory"):
+        print("Peak RSS (KB):", benchmark_info["current"]["memory"].get("peak_rss_kb"))
     print("\n")
 
-def get_evaluator_feedback(client, model_name, filename, optim_iter):
+class MeasureOptions():
+    """Extra measurements of every version, set from main's command line arguments."""
+    # command line argument of each option
+    ARGUMENTS = {"pgo": "pgo", "thread_sweep": "threads", "frequency_sweep": "freq", "massif": "massif"}
+
+    def __init__(self, pgo=False, thread_sweep=False, frequency_sweep=False, massif=False):
+        # also build and measure a profile-guided executable
+        self.pgo = pgo
+        # sweep thread counts and placement
+        self.thread_sweep = thread_sweep
+        # measure at several cpufreq settings
+        self.frequency_sweep = frequency_sweep
+        # add a valgrind massif heap profile to the peak memory
+        self.massif = massif
+
+    @classmethod
+    def from_args(cls, options):
+        return cls(**{name: argument in options for name, argument in cls.ARGUMENTS.items()})
+
+def measure_extras(bmark, optim_iter, options):
+    # after the sweep, so the memory record belongs to the thread configuration the version keeps
+    if options.thread_sweep:
+        bmark.run_thread_sweep(optim_iter)
+    bmark.run_memory(optim_iter, options.massif)
+    if options.frequency_sweep:
+        bmark.run_frequency_sweep(optim_iter)
+    if options.pgo:
+        bmark.run_pgo(optim_iter)
+
+def measure_benchmark(filename, optim_iter, options=None):
+    options = options or MeasureOptions()
 
     language = filename.split(".")[-1]
     # print(f"language: {language}")
@@ -104,36 +169,72 @@ def get_evaluator_feedback(client, model_name, filename, optim_iter):
     original_code_path = f"{USER_PREFIX}/llm/llm_input_files/input_code/{filename}"
     # print(f"original_code_path: {original_code_path}")
 
-    optimized_code_path = f"{USER_PREFIX}/llm/benchmarks_out/{filename.split('.')[0]}/optimized_{filename}"
+    optimized_code_path = f"{out_dir(filename)}/optimized_{filename}"
     # print(f"optimized_code_path: {optimized_code_path}")
 
     pkl_path = os.path.join(os.path.dirname(__file__), f"../../energy/{language}/benchmark_data.pkl")
     # print(f"This is the pkl file path: {pkl_path}")
     
     #create a benchmark object
-    bmark = Benchmark(language, name, filename, benchmark_data)
+    bmark = Benchmark(language, name, filename, benchmark_data, benchmark_metrics)
     
     #run benchmark
     #load the original code and data into pkl file 
-    if optim_iter == 0:
-        results_file = bmark.run(optim_iter)
-        bmark.process_results(results_file, optim_iter, original_code_path)
-        
+    #(skipped when a resumed run already measured the original)
+    original_measured = False
+    if optim_iter == 0 and 0 not in benchmark_data:
+        trials = bmark.run(optim_iter)
+        bmark.process_results(trials, optim_iter, original_code_path)
+        original_measured = True
+        measure_extras(bmark, optim_iter, options)
+
 
     #load the optimized code and data
     optim_iter = optim_iter + 1 # offset
-    results_file = bmark.run(optim_iter)
-    bmark.process_results(results_file, optim_iter, original_code_path if optim_iter == 0 else optimized_code_path)
+    trials = bmark.run(optim_iter, reference_version(benchmark_data, benchmark_metrics, optim_iter))
+    bmark.process_results(trials, optim_iter, original_code_path if optim_iter == 0 else optimized_code_path)
+    measure_extras(bmark, optim_iter, options)
 
     # Load benchmark data
     contents = load_benchmark_data(pkl_path)
     
     # Find the required benchmark elements
-    benchmark_info = extract_content(contents)
+    benchmark_info = extract_content(contents, benchmark_metrics)
     
+    # Attach measurement noise of the original and current versions
+    benchmark_info["original"]["energy_std"] = benchmark_metrics.get(0, {}).get("energy_std", 0.0)
+    current_metrics = benchmark_metrics.get(optim_iter, {})
+    benchmark_info["current"]["energy_std"] = current_metrics.get("energy_std", 0.0)
+    benchmark_info["current"]["measurement_energy"] = current_metrics.get("measurement_energy", 0.0)
+    if original_measured:
+        benchmark_info["current"]["measurement_energy"] += benchmark_metrics.get(0, {}).get("measurement_energy", 0.0)
+    # Thread configuration each version was measured with
+    if options.thread_sweep:
+        benchmark_info["original"]["thread_config"] = benchmark_metrics.get(0, {}).get("thread_config")
+        benchmark_info["current"]["thread_config"] = current_metrics.get("thread_config")
+    # Energy-optimal operating point of the version
+    if options.frequency_sweep:
+        report = current_metrics.get("frequency_sweep", {})
+        benchmark_info["current"]["frequency_sweep"] = {key: report.get(key) for key in ("status", "energy_optimal", "edp_optimal")}
+    # Best energy each version reaches with a profile-guided build
+    if options.pgo:
+        for key, version in (("original", 0), ("current", optim_iter)):
+            version_metrics = benchmark_metrics.get(version, {})
+            benchmark_info[key]["pgo"] = version_metrics.get("pgo")
+            benchmark_info[key]["best_build"] = version_metrics.get("best_build", "plain")
+        benchmark_info["current"]["measurement_energy"] += current_metrics.get("pgo", {}).get("measurement_energy", 0.0)
+        if original_measured:
+            benchmark_info["current"]["measurement_energy"] += benchmark_metrics.get(0, {}).get("pgo", {}).get("measurement_energy", 0.0)
+
     # Print the benchmark information
     print_benchmark_info(benchmark_info)
 
+    return benchmark_info
+
+def get_evaluator_feedback(client, model_name, filename, optim_iter):
+
+    benchmark_info = measure_benchmark(filename, optim_iter)
+
     #run evaluator
     print("get_evaluator_feedback: Getting evaluator feedback ....")
     evaluator_feedback = evaluator_llm(client, model_name, benchmark_info)
@@ -0,0 +1,110 @@
+import os
+import re
+import shutil
+import subprocess
+try:
+    from .sandbox import wait_with_rusage
+except ImportError:
+    from sandbox import wait_with_rusage
+
+TIME_PATH = "/usr/bin/time"
+# /usr/bin/time -v lines kept in the memory record
+TIME_FIELDS = {
+    "Maximum resident set size (kbytes)": "peak_rss_kb",
+    "Major (requiring I/O) page faults": "major_page_faults",
+    "Minor (reclaiming a frame) page faults": "minor_page_faults",
+    "Voluntary context switches": "voluntary_context_switches",
+    "Involuntary context switches": "involuntary_context_switches",
+    "File system outputs": "file_system_outputs"
+}
+
+def parse_time_output(output):
+    memory = {}
+    for line in output.splitlines():
+        name, _, value = line.strip().rpartition(": ")
+        if name in TIME_FIELDS:
+            memory[TIME_FIELDS[name]] = int(value)
+    return memory
+
+def time_prefix(out_file):
+    """Shell prefix that writes the command's /usr/bin/time -v record to out_file, empty without it."""
+    if not os.path.isfile(TIME_PATH):
+        return ""
+    if os.path.exists(out_file):
+        os.remove(out_file)
+    return f"{TIME_PATH} -v -o {out_file} "
+
+def read_time_file(out_file):
+    """Memory record written through time_prefix, None when the run left none."""
+    if not os.path.isfile(out_file):
+        return None
+    with open(out_file, "r") as file:
+        memory = parse_time_output(file.read())
+    if "peak_rss_kb" not in memory:
+        return None
+    memory["source"] = "time"
+    return memory
+
+def memory_profile(command, stdin_path=None, cwd=None, timeout=None, prefix=None):
+    """Peak RSS, page faults and context switches of one run of `command` (argv list).
+
+    prefix (argv list, e.g. taskset and env) is run in front of the command,
+    so the version gets the thread configuration it was measured with.
+    """
+    command = (prefix or []) + command
+    stdin = open(stdin_path, "rb") if stdin_path is not None else subprocess.DEVNULL
+    try:
+        if os.path.isfile(TIME_PATH):
+            result = subprocess.run([TIME_PATH, "-v", *command], cwd=cwd, stdin=stdin, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, timeout=timeout)
+            memory = parse_time_output(result.stderr)
+            memory["exit_code"] = result.returncode
+            memory["source"] = "time"
+            return memory
+        process = subprocess.Popen(command, cwd=cwd, stdin=stdin, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            _, status, rusage = wait_with_rusage(process, timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            raise
+        return {
+            # ru_maxrss is in kilobytes on Linux
+            "peak_rss_kb": rusage.ru_maxrss,
+            "major_page_faults": rusage.ru_majflt,
+            "minor_page_faults": rusage.ru_minflt,
+            "voluntary_context_switches": rusage.ru_nvcsw,
+            "involuntary_context_switches": rusage.ru_nivcsw,
+            "file_system_outputs": rusage.ru_oublock,
+            "exit_code": os.waitstatus_to_exitcode(status),
+            "source": "rusage"
+        }
+    finally:
+        if stdin_path is not None:
+            stdin.close()
+
+def massif_profile(command, out_file, stdin_path=None, cwd=None, timeout=None, prefix=None):
+    """Peak heap (plus allocator overhead and stacks) from valgrind massif, None without valgrind."""
+    if shutil.which("valgrind") is None:
+        return None
+    stdin = open(stdin_path, "rb") if stdin_path is not None else subprocess.DEVNULL
+    try:
+        subprocess.run([*(prefix or []), "valgrind", "--tool=massif", "--stacks=yes", f"--massif-out-file={out_file}", *command],
+                       cwd=cwd, stdin=stdin, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {"status": "timeout"}
+    finally:
+        if stdin_path is not None:
+            stdin.close()
+    if not os.path.isfile(out_file):
+        return {"status": "failed"}
+
+    peak, snapshot = 0, {}
+    with open(out_file, "r") as file:
+        for line in file:
+            match = re.match(r"(mem_heap_B|mem_heap_extra_B|mem_stacks_B)=(\d+)", line)
+            if match:
+                snapshot[match.group(1)] = int(match.group(2))
+                if len(snapshot) == 3:
+                    peak = max(peak, sum(snapshot.values()))
+                    snapshot = {}
+    return {"status": "measured", "peak_heap_bytes": peak, "massif_file": out_file}
@@ -0,0 +1,279 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../'))
+REGISTRY_PATH = os.path.join(root_dir, "benchmarks/registry.json")
+
+_registry = None
+
+def load_registry(path=REGISTRY_PATH):
+    """Benchmark name -> entry, read once from benchmarks/registry.json."""
+    global _registry
+    if _registry is None or path != REGISTRY_PATH:
+        with open(path, "r") as file:
+            registry = json.load(file)
+        for name, entry in registry.items():
+            entry["name"] = name
+        if path != REGISTRY_PATH:
+            return registry
+        _registry = registry
+    return _registry
+
+def save_registry(registry, path=REGISTRY_PATH):
+    global _registry
+    contents = {name: {key: value for key, value in entry.items() if key != "name"} for name, entry in registry.items()}
+    # same layout as the hand-written file: lists of flags and args stay on one line
+    text = json.dumps(contents, indent=4)
+    text = re.sub(r'\[\n\s*([^\[\]{}]*?)\n\s*\]', lambda match: "[" + ", ".join(item.strip() for item in match.group(1).split(",\n")) + "]", text)
+    with open(path, "w") as file:
+        file.write(text + "\n")
+    _registry = None
+
+def benchmark_names():
+    return list(load_registry().keys())
+
+def source_filenames():
+    return [entry["source"] for entry in load_registry().values()]
+
+def get_benchmark(name):
+    """Accepts a registry name or any pipeline file name of the benchmark.
+
+    binarytrees, binarytrees.gpp-9.c++, optimized_binarytrees.gpp-9.c++ and
+    binarytrees.compiled.gpp-9.c++ all resolve to the binarytrees entry.
+    """
+    registry = load_registry()
+    stem = os.path.basename(name).split('.')[0]
+    if stem.startswith("optimized_"):
+        stem = stem[len("optimized_"):]
+    if stem in registry:
+        return registry[stem]
+    for entry in registry.values():
+        if stem in (entry["out_dir"], entry["baseline_dir"], entry["source"].split('.')[0]):
+            return entry
+    raise KeyError(f"Unknown benchmark: {name}")
+
+def match_benchmark(label):
+    """Registry name of a free-form label such as a results directory or RAPL name, None when nothing matches.
+
+    Binary-trees-no-o3, binary-trees and k-nucleotide resolve to binarytrees,
+    binarytrees and knucleotide.
+    """
+    name = re.sub(r'[^a-z]', '', label.lower())
+    matches = [benchmark for benchmark in benchmark_names() if name.startswith(benchmark)]
+    return max(matches, key=len) if matches else None
+
+def out_dir(name, user_prefix=None):
+    """Working directory of the benchmark in llm/benchmarks_out."""
+    user_prefix = user_prefix or os.getenv('USER_PREFIX') or root_dir
+    return f"{user_prefix}/llm/benchmarks_out/{get_benchmark(name)['out_dir']}"
+
+def read_result_file(path):
+    """(version -> (source, energy, runtime), notes) of a result_file, whose JSON may be followed by notes.
+
+    Raises ValueError when the file holds no results.
+    """
+    with open(path, "r") as file:
+        text = file.read()
+    start = text.find("{")
+    if start < 0:
+        raise ValueError(f"read_result_file: no results in {path}")
+    contents, end = json.JSONDecoder().raw_decode(text, start)
+    return {int(key): tuple(value) for key, value in contents.items()}, text[:start] + text[end:]
+
+def baseline_dir(name, user_prefix=None):
+    user_prefix = user_prefix or os.getenv('USER_PREFIX') or root_dir
+    return f"{user_prefix}/benchmarks/{get_benchmark(name)['baseline_dir']}"
+
+def binary_name(source_filename):
+    """binarytrees.gpp-9.c++ -> binarytrees.gpp-9.gpp_run"""
+    return source_filename.rsplit('.', 1)[0] + ".gpp_run"
+
+def compile_commands(entry, source_path, binary_path, extra_flags=None, link_extra_flags=None):
+    """Compile and link argv lists; extra_flags (e.g. -O3) go after the registry flags."""
+    object_path = source_path + ".o"
+    compile_command = [entry["compiler"], "-c", *entry["compile_flags"], *(extra_flags or []), source_path, "-o", object_path]
+    link_command = [entry["compiler"], object_path, "-o", binary_path, *entry["link_flags"], *(link_extra_flags or []), *[f"-l{library}" for library in entry["libraries"]]]
+    return [compile_command, link_command]
+
+def compile_benchmark(entry, source_path, binary_path, output_log=None, extra_flags=None, link_extra_flags=None, cwd=None):
+    """Compile a version of the benchmark, True on success."""
+    for command in compile_commands(entry, source_path, binary_path, extra_flags, link_extra_flags):
+        result = subprocess.run(command, cwd=cwd, stdout=output_log or subprocess.DEVNULL, stderr=output_log or subprocess.DEVNULL)
+        if result.returncode != 0:
+            return False
+    return True
+
+def compile_with_profile(entry, source_path, binary_path, output_log=None, extra_flags=None, training_size="small", cwd=None):
+    """Profile-guided build: instrument, run the training input, rebuild with the profile.
+
+    Returns None on success, otherwise the step that failed.
+    """
+    extra_flags = extra_flags or []
+    profile_dir = binary_path + ".profile"
+    shutil.rmtree(profile_dir, ignore_errors=True)
+    os.makedirs(profile_dir)
+    generate_flags = extra_flags + [f"-fprofile-generate={profile_dir}"]
+    if not compile_benchmark(entry, source_path, binary_path, output_log, generate_flags, generate_flags, cwd=cwd):
+        return "compile_error"
+    if prepare_inputs(entry, [training_size]) is not None:
+        return "training_input_failed"
+    try:
+        result = run_benchmark(entry, binary_path, training_size, cwd=cwd)
+    except subprocess.TimeoutExpired:
+        return "training_run_failed"
+    if result.returncode != 0:
+        return "training_run_failed"
+    use_flags = extra_flags + [f"-fprofile-use={profile_dir}", "-fprofile-correction", "-Wno-missing-profile"]
+    if not compile_benchmark(entry, source_path, binary_path, output_log, use_flags, extra_flags, cwd=cwd):
+        return "compile_error"
+    return None
+
+def production_input(entry):
+    """Size measured and regression tested, PRODUCTION_INPUT overrides the registry (e.g. small for dry runs)."""
+    return os.getenv("PRODUCTION_INPUT") or entry["production_input"]
+
+def input_set(entry, size=None):
+    """Input set by size name; an input set dict (e.g. one of test_inputs) is returned as is."""
+    if isinstance(size, dict):
+        return size
+    return entry["inputs"][size or production_input(entry)]
+
+def stdin_path(entry, size=None, cwd=None):
+    """Absolute path of the stdin file of an input set, or None.
+
+    Only a lookup: generated inputs are made by prepare_inputs, before that
+    the path does not exist yet.
+    """
+    stdin = input_set(entry, size).get("stdin")
+    if stdin is None:
+        return None
+    if "generator" in stdin:
+        # generated once and staged in memory, every run reads the same file
+        try:
+            from .inputs import staged_path
+        except ImportError:
+            from inputs import staged_path
+        return staged_path(stdin)
+    # inputs live next to the benchmark, older setups kept them in the repo root
+    candidates = [os.path.join(cwd, stdin["file"])] if cwd else []
+    candidates += [
+        os.path.join(out_dir(entry["name"]), stdin["file"]),
+        os.path.join(baseline_dir(entry["name"]), stdin["file"]),
+        os.path.join(os.getenv('USER_PREFIX') or root_dir, stdin["file"])
+    ]
+    for path in candidates:
+        if os.path.isfile(path):
+            return path
+    return candidates[0]
+
+def prepare_inputs(entry, sizes=None):
+    """Generate the stdin files of the input sets (the production input and test inputs by default).
+
+    Returns None when they are ready, otherwise why they are not.
+    """
+    try:
+        from .inputs import staged_input
+    except ImportError:
+        from inputs import staged_input
+    input_sets = [input_set(entry, size) for size in sizes] if sizes else [input_set(entry)] + list(entry.get("test_inputs", {}).values())
+    for stdin in [input_set.get("stdin") for input_set in input_sets]:
+        if stdin is None or "generator" not in stdin:
+            continue
+        try:
+            staged_input(stdin)
+        except (RuntimeError, OSError, subprocess.SubprocessError) as e:
+            print(f"prepare_inputs: {entry['name']}: {e}")
+            return str(e)
+    return None
+
+def run_command(entry, binary_path, size=None):
+    return [binary_path, *input_set(entry, size)["args"]]
+
+def shell_command(entry, binary_path, size=None, cwd=None):
+    """Single command string, as RAPL/main runs it through system()."""
+    command = " ".join(run_command(entry, binary_path, size))
+    path = stdin_path(entry, size, cwd)
+    if path is not None:
+        command += f" < {path}"
+    return command
+
+def run_benchmark(entry, binary_path, size=None, cwd=None, timeout=None):
+    """Run one input set, returns the CompletedProcess (TimeoutExpired propagates)."""
+    path = stdin_path(entry, size, cwd)
+    stdin = open(path, "rb") if path is not None else subprocess.DEVNULL
+    try:
+        return subprocess.run(
+            run_command(entry, binary_path, size),
+            cwd=cwd,
+            stdin=stdin,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=timeout or entry["timeout"]
+        )
+    finally:
+        if path is not None:
+            stdin.close()
+
+def output_digest(output):
+    """Digest of the output with all whitespace removed, as regression_test compares it."""
+    if isinstance(output, str):
+        output = output.encode()
+    return hashlib.sha256(re.sub(rb'\s+', b'', output)).hexdigest()
+
+def expected_digest(entry, size=None):
+    return entry["expected_output_sha256"].get(size or production_input(entry))
+
+def record_output_digest(binary_path, output):
+    """Keep the digest of an executable's verified production output next to it."""
+    with open(binary_path + ".digest", "w") as file:
+        file.write(output_digest(output))
+
+def verified_digest(binary_path):
+    """Digest stored by record_output_digest, None when missing or older than the executable."""
+    path = binary_path + ".digest"
+    if not os.path.isfile(path) or os.path.getmtime(path) < os.path.getmtime(binary_path):
+        return None
+    with open(path, "r") as file:
+        return file.read().strip()
+
+def record_digests(names=None, sizes=None):
+    """Compile the original of each benchmark and store its output digests in the registry."""
+    registry = load_registry()
+    for name in names or registry.keys():
+        entry = registry[name]
+        directory = out_dir(name)
+        source_path = os.path.join(directory, entry["source"])
+        binary_path = os.path.join(directory, binary_name(entry["source"]))
+        if not compile_benchmark(entry, source_path, binary_path, cwd=directory):
+            print(f"record_digests: {name} does not compile, skipped")
+            continue
+        if prepare_inputs(entry, sizes or list(entry["inputs"].keys())) is not None:
+            print(f"record_digests: {name} inputs could not be generated, skipped")
+            continue
+        for size in sizes or entry["inputs"].keys():
+            try:
+                result = run_benchmark(entry, binary_path, size, cwd=directory)
+            except subprocess.TimeoutExpired:
+                print(f"record_digests: {name} ({size}) timed out")
+                continue
+            if result.returncode != 0:
+                print(f"record_digests: {name} ({size}) failed: {result.stderr.decode(errors='replace')}")
+                continue
+            entry["expected_output_sha256"][size] = output_digest(result.stdout)
+            print(f"record_digests: {name} ({size}) {entry['expected_output_sha256'][size]}")
+    save_registry(registry)
+
+if __name__ == "__main__":
+    # python3 energy/src/registry.py list
+    # python3 energy/src/registry.py record-digests [benchmark ...]
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+    if command == "record-digests":
+        record_digests(sys.argv[2:] or None)
+    else:
+        for name, entry in load_registry().items():
+            print(f"{name:16} {entry['source']:26} inputs: {', '.join(entry['inputs'].keys())}")
@@ -0,0 +1,283 @@
+import hashlib
+import json
+import math
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dotenv import load_dotenv
+try:
+    from .benchmark import ENERGY_BACKEND, rapl_measure
+    from .distributed import hardware_fingerprint
+    from .registry import baseline_dir, binary_name, compile_benchmark, expected_digest, load_registry, out_dir, output_digest, prepare_inputs, production_input, read_result_file, run_benchmark, shell_command
+except ImportError:
+    from benchmark import ENERGY_BACKEND, rapl_measure
+    from distributed import hardware_fingerprint
+    from registry import baseline_dir, binary_name, compile_benchmark, expected_digest, load_registry, out_dir, output_digest, prepare_inputs, production_input, read_result_file, run_benchmark, shell_command
+load_dotenv()
+USER_PREFIX = os.getenv('USER_PREFIX')
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../'))
+BASELINES_PATH = os.getenv("REGRESSION_BASELINES", f"{root_dir}/energy/data/regression_baselines.json")
+REPORT_PATH = f"{root_dir}/energy/reports/regression_gate.json"
+# RAPL/main appends to energy/src/<language>.csv, keep the gate apart from the optimizer's c++.csv
+RAPL_LANGUAGE = "regression_gate"
+# Measurement rounds, each measures the original and then the best version (RAPL_TRIALS trials apiece)
+GATE_ROUNDS = int(os.getenv("GATE_ROUNDS", 3))
+# A change is a regression when it exceeds both GATE_TOLERANCE and GATE_NOISE_FACTOR standard errors
+GATE_TOLERANCE = float(os.getenv("GATE_TOLERANCE", 0.05))
+GATE_NOISE_FACTOR = float(os.getenv("GATE_NOISE_FACTOR", 3.0))
+# Fingerprint fields that make absolute energies comparable; kernel, microcode and governor may change
+MACHINE_FIELDS = ("host", "cpu_model", "cpu_signature", "cpus", "backend")
+
+# Benchmark statuses, the failing ones make the gate exit non-zero
+PASSED = "passed"
+REGRESSED = "regressed"
+IMPROVED = "improved"
+DRIFT = "drift"
+RECORDED = "recorded"
+NO_BASELINE = "no_baseline"
+NO_OPTIMIZED_VERSION = "no_optimized_version"
+FAILING = (REGRESSED, "compile_error", "output_differs", "run_failed", "measure_failed")
+
+def stored_versions(benchmark):
+    """Version -> (source, energy, runtime) of the benchmark's last run, from its result_file.txt."""
+    path = f"{out_dir(benchmark)}/result_file.txt"
+    if not os.path.isfile(path):
+        return {}
+    try:
+        return read_result_file(path)[0]
+    except ValueError:
+        return {}
+
+def best_version(versions):
+    """Key of the lowest-energy optimized version; energies <= 0 are counter wraps of older runs."""
+    measured = [key for key, value in versions.items() if key != 0 and value[1] > 0]
+    return min(measured, key=lambda key: versions[key][1]) if measured else None
+
+def source_digest(source):
+    return hashlib.sha256(source.encode()).hexdigest()[:16]
+
+def compiler_version(entry):
+    result = subprocess.run([entry["compiler"], "--version"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    return result.stdout.splitlines()[0] if result.stdout else None
+
+def series(values):
+    return {
+        "mean": round(statistics.mean(values), 6),
+        "std": round(statistics.stdev(values), 6) if len(values) > 1 else 0.0,
+        "n": len(values)
+    }
+
+def relative_error(stats):
+    """Standard error of the mean relative to the mean."""
+    return stats["std"] / math.sqrt(stats["n"]) / stats["mean"] if stats["mean"] else 0.0
+
+def compare(now, base, now_error, base_error):
+    """Relative change from base to now and the threshold it has to exceed to count.
+
+    The threshold is GATE_TOLERANCE, or GATE_NOISE_FACTOR combined standard
+    errors when the measurements are noisier than that.
+    """
+    change = now / base - 1
+    threshold = max(GATE_TOLERANCE, GATE_NOISE_FACTOR * math.sqrt(now_error ** 2 + base_error ** 2))
+    verdict = REGRESSED if change > threshold else IMPROVED if change < -threshold else PASSED
+    return {"change": round(change, 4), "threshold": round(threshold, 4), "verdict": verdict}
+
+def gain(measurement, metric):
+    """Best over original and its relative error, robust to whatever slows down both."""
+    best, original = measurement["best"][metric], measurement["original"][metric]
+    return best["mean"] / original["mean"], math.sqrt(relative_error(best) ** 2 + relative_error(original) ** 2)
+
+def build(entry, directory, name, source):
+    """Compile a source with the registry flags into directory, the binary path or None."""
+    source_path = f"{directory}/{name}_{entry['source']}"
+    with open(source_path, "w") as file:
+        file.write(source)
+    binary_path = f"{directory}/{binary_name(os.path.basename(source_path))}"
+    with open(f"{directory}/{name}_build_log.txt", "w") as build_log:
+        if not compile_benchmark(entry, source_path, binary_path, build_log, cwd=directory):
+            return None
+    return binary_path
+
+def measure(benchmark, entry, sources):
+    """Rebuild, verify and measure the original and the best version, interleaved so drift hits both alike.
+
+    Returns (measurement, None), or (None, (status, detail)) when a version
+    does not build, run or produce the expected output.
+    """
+    directory = tempfile.mkdtemp(prefix=f"eedc-gate-{benchmark}-")
+    try:
+        binaries = {}
+        for name, source in sources.items():
+            binaries[name] = build(entry, directory, name, source)
+            if binaries[name] is None:
+                return None, ("compile_error", f"{name} does not compile with {compiler_version(entry)}")
+
+        input_error = prepare_inputs(entry, [production_input(entry)])
+        if input_error is not None:
+            return None, ("input_failed", input_error)
+        reference = expected_digest(entry)
+        for name, binary_path in binaries.items():
+            try:
+                result = run_benchmark(entry, binary_path, cwd=directory)
+            except subprocess.TimeoutExpired:
+                return None, ("run_failed", f"{name} timed out")
+            if result.returncode != 0:
+                return None, ("run_failed", f"{name} exited with {result.returncode}")
+            digest = output_digest(result.stdout)
+            # without a registry digest the original's output is the reference
+            reference = reference or digest
+            if digest != reference:
+                return None, ("output_differs", f"{name} output differs from the reference")
+
+        trials = {name: [] for name in binaries}
+        for _ in range(GATE_ROUNDS):
+            for name, binary_path in binaries.items():
+                try:
+                    trials[name] += rapl_measure(shell_command(entry, binary_path, cwd=directory), RAPL_LANGUAGE, entry["rapl_name"], f"{directory}/{RAPL_LANGUAGE}.csv")
+                except subprocess.CalledProcessError as e:
+                    return None, ("measure_failed", f"{name}: {e}")
+        return {name: {"energy": series([trial[1] for trial in version_trials]), "runtime": series([trial[2] for trial in version_trials])} for name, version_trials in trials.items()}, None
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def evaluate(measurement, baseline, same_machine, changes):
+    """Checks of one benchmark against its baseline; the best version's own numbers only on the same machine.
+
+    When the original moved the same way as the best version and nothing
+    in the environment changed, the machine was busier or quieter than when
+    the baseline was recorded: that change is reported as drift and only
+    the gain over the original counts.
+    """
+    checks = {}
+    for metric in ("energy", "runtime"):
+        now_gain, now_error = gain(measurement, metric)
+        base_gain, base_error = gain(baseline, metric)
+        checks[f"gain_{metric}"] = compare(now_gain, base_gain, now_error, base_error)
+        if not same_machine:
+            continue
+        for name in ("best", "original"):
+            now, base = measurement[name][metric], baseline[name][metric]
+            checks[f"{name}_{metric}"] = compare(now["mean"], base["mean"], relative_error(now), relative_error(base))
+        best, original = checks[f"best_{metric}"], checks[f"original_{metric}"]
+        if not changes and best["verdict"] != PASSED and original["verdict"] == best["verdict"]:
+            best["verdict"] = DRIFT
+    # the original only shows what changed around the versions, it does not fail the gate
+    verdicts = [check["verdict"] for name, check in checks.items() if not name.startswith("original")]
+    status = REGRESSED if REGRESSED in verdicts else IMPROVED if IMPROVED in verdicts else DRIFT if DRIFT in verdicts else PASSED
+    return status, checks
+
+def environment_changes(baseline, environment):
+    changes = {}
+    for key in ("compiler", "best_source", "original_source"):
+        if baseline.get(key) != environment[key]:
+            changes[key] = [baseline.get(key), environment[key]]
+    for key, value in environment["fingerprint"].items():
+        if key != "id" and baseline["fingerprint"].get(key) != value:
+            changes[key] = [baseline["fingerprint"].get(key), value]
+    return changes
+
+def gate_benchmark(benchmark, entry, baselines, record=False):
+    versions = stored_versions(benchmark)
+    best = best_version(versions)
+    if best is None:
+        return {"benchmark": benchmark, "status": NO_OPTIMIZED_VERSION}
+    baseline = baselines.get(benchmark)
+    size = production_input(entry)
+    if not record and (baseline is None or baseline["input"] != size):
+        # measuring would not tell anything without numbers to compare to
+        return {"benchmark": benchmark, "status": NO_BASELINE, "detail": f"record a baseline for the {size} input first"}
+
+    if 0 in versions:
+        original_source = versions[0][0]
+    else:
+        with open(f"{baseline_dir(benchmark)}/{entry['source']}", "r") as file:
+            original_source = file.read()
+    print(f"gate_benchmark: {benchmark}: original and version {best} on the {size} input, {GATE_ROUNDS} rounds")
+    measurement, failure = measure(benchmark, entry, {"original": original_source, "best": versions[best][0]})
+    if failure is not None:
+        return {"benchmark": benchmark, "version": best, "status": failure[0], "detail": failure[1]}
+
+    fingerprint = hardware_fingerprint()
+    environment = {
+        "compiler": compiler_version(entry),
+        "best_source": source_digest(versions[best][0]),
+        "original_source": source_digest(original_source),
+        "fingerprint": fingerprint
+    }
+    result = {"benchmark": benchmark, "version": best, "input": size, **measurement, **environment}
+    if record:
+        result["recorded"] = round(time.time(), 3)
+        result["rounds"] = GATE_ROUNDS
+        return dict(result, status=RECORDED)
+
+    same_machine = all(baseline["fingerprint"].get(key) == fingerprint.get(key) for key in MACHINE_FIELDS)
+    changes = environment_changes(baseline, environment)
+    status, checks = evaluate(measurement, baseline, same_machine, changes)
+    return {
+        "benchmark": benchmark,
+        "version": best,
+        "status": status,
+        "same_machine": same_machine,
+        "checks": checks,
+        "changes": changes,
+        "measurement": measurement
+    }
+
+def load_baselines(path=BASELINES_PATH):
+    if not os.path.isfile(path):
+        return {}
+    with open(path, "r") as file:
+        return json.load(file)
+
+def run_gate(benchmarks=None, record=False, path=BASELINES_PATH):
+    """Gate (or record baselines for) every benchmark with a stored optimized version; returns the results."""
+    registry = load_registry()
+    baselines = load_baselines(path)
+    results = [gate_benchmark(benchmark, registry[benchmark], baselines, record) for benchmark in benchmarks or registry.keys()]
+    if record:
+        for result in results:
+            if result["status"] == RECORDED:
+                baselines[result["benchmark"]] = {key: value for key, value in result.items() if key not in ("benchmark", "status")}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as file:
+            json.dump(baselines, file, indent=4)
+    os.makedirs(os.path.dirname(REPORT_PATH), exist_ok=True)
+    with open(REPORT_PATH, "w") as file:
+        json.dump({"backend": ENERGY_BACKEND, "record": record, "tolerance": GATE_TOLERANCE, "noise_factor": GATE_NOISE_FACTOR, "results": results}, file, indent=4)
+    return results
+
+def format_report(results):
+    lines = [f"{'benchmark':16} {'version':>7} {'status':22} {'energy':>16} {'runtime':>16} {'gain E':>16} {'gain t':>16}"]
+    for result in results:
+        checks = result.get("checks", {})
+        cells = []
+        for name in ("best_energy", "best_runtime", "gain_energy", "gain_runtime"):
+            check = checks.get(name)
+            cells.append(f"{check['change']:+.1%} (±{check['threshold']:.1%})" if check else "-")
+        lines.append(f"{result['benchmark']:16} {str(result.get('version', '-')):>7} {result['status']:22} " + " ".join(f"{cell:>16}" for cell in cells))
+        if result.get("detail"):
+            lines.append(f"    {result['detail']}")
+        if "same_machine" in result and not result["same_machine"]:
+            lines.append("    baseline was recorded on another machine, only the gain over the original is compared")
+        if result["status"] == DRIFT:
+            lines.append(f"    the original moved as well ({checks['original_energy']['change']:+.1%} energy, {checks['original_runtime']['change']:+.1%} runtime), only the gain over the original is compared")
+        for key, (before, after) in result.get("changes", {}).items():
+            lines.append(f"    {key}: {before} -> {after}")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    # python3 energy/src/regression_gate.py record [benchmark ...]
+    # python3 energy/src/regression_gate.py check [benchmark ...]
+    command = sys.argv[1] if len(sys.argv) > 1 else "check"
+    results = run_gate(sys.argv[2:] or None, record=command == "record")
+    print(format_report(results))
+    failed = [result["benchmark"] for result in results if result["status"] in FAILING]
+    if failed:
+        print(f"regression_gate: {len(failed)} of {len(results)} benchmarks failed: {', '.join(failed)}")
+        sys.exit(1)
+    print(f"regression_gate: {'baselines written to ' + BASELINES_PATH if command == 'record' else 'no regressions'}")
@@ -0,0 +1,275 @@
+import os
+import resource
+import shutil
+import signal
+import subprocess
+import tempfile
+import time
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+# Limit violations reported by run_sandboxed
+TIMEOUT = "timeout"
+CPU_TIME = "cpu_time"
+MEMORY = "memory"
+FILE_SIZE = "file_size"
+PROCESSES = "processes"
+
+# Limits are this many times the original's footprint, with floors for tiny programs
+MEMORY_FACTOR = float(os.getenv("SANDBOX_MEMORY_FACTOR", 4))
+CPU_FACTOR = float(os.getenv("SANDBOX_CPU_FACTOR", 10))
+OUTPUT_FACTOR = float(os.getenv("SANDBOX_OUTPUT_FACTOR", 10))
+MIN_MEMORY_BYTES = 256 * 1024 * 1024
+MIN_CPU_SECONDS = 10
+MIN_FILE_SIZE_BYTES = 64 * 1024 * 1024
+MAX_PROCESSES = 512
+# Seconds between RSS checks when no cgroup enforces the memory limit
+RSS_POLL_SECONDS = 0.05
+# stderr of a candidate that ran out of memory or could not create a thread
+MEMORY_ERRORS = (b"bad_alloc", b"Cannot allocate memory", b"Thread creation failed")
+
+class Limits():
+    def __init__(self, memory_bytes=None, cpu_seconds=None, file_size_bytes=None, processes=MAX_PROCESSES, wall_time=None):
+        self.memory_bytes = memory_bytes
+        self.cpu_seconds = cpu_seconds
+        self.file_size_bytes = file_size_bytes
+        self.processes = processes
+        self.wall_time = wall_time
+
+    @classmethod
+    def from_footprint(cls, footprint, timeout):
+        """Limits for a candidate from the original's footprint (see Footprint), None means defaults."""
+        if footprint is None:
+            return cls(MIN_MEMORY_BYTES * 16, None, MIN_FILE_SIZE_BYTES * 16, MAX_PROCESSES, timeout)
+        return cls(
+            memory_bytes=max(int(footprint["peak_rss_kb"] * 1024 * MEMORY_FACTOR), MIN_MEMORY_BYTES),
+            cpu_seconds=max(int(footprint["cpu_seconds"] * CPU_FACTOR), MIN_CPU_SECONDS),
+            file_size_bytes=max(int(footprint["output_bytes"] * OUTPUT_FACTOR), MIN_FILE_SIZE_BYTES),
+            processes=MAX_PROCESSES,
+            wall_time=timeout
+        )
+
+    def to_dict(self):
+        return dict(vars(self))
+
+class SandboxResult():
+    def __init__(self, returncode, stdout, stderr, violation=None, footprint=None):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        # None, or which limit the run hit
+        self.violation = violation
+        # peak_rss_kb, cpu_seconds and output_bytes of the run
+        self.footprint = footprint
+
+class CgroupScope():
+    """A cgroup v2 child of our own cgroup with memory and pids limits.
+
+    Only used when the controllers are delegated to us; otherwise the sandbox
+    polls the candidate's RSS.
+    """
+    def __init__(self, limits):
+        self.path = None
+        try:
+            with open("/proc/self/cgroup", "r") as file:
+                own = file.read().strip().split("::", 1)[1]
+            parent = f"{CGROUP_ROOT}{own}"
+            with open(f"{parent}/cgroup.subtree_control", "r") as file:
+                controllers = file.read().split()
+            if "memory" not in controllers or "pids" not in controllers:
+                return
+            path = f"{parent}/eedc-sandbox-{os.getpid()}-{time.monotonic_ns()}"
+            os.mkdir(path)
+            self.path = path
+            if limits.memory_bytes is not None:
+                self._write("memory.max", limits.memory_bytes)
+                self._write("memory.swap.max", 0)
+            if limits.processes is not None:
+                self._write("pids.max", limits.processes)
+        except (OSError, IndexError):
+            self.cleanup()
+            self.path = None
+
+    def _write(self, name, value):
+        try:
+            with open(f"{self.path}/{name}", "w") as file:
+                file.write(str(value))
+        except OSError:
+            pass
+
+    def _events(self, name):
+        events = {}
+        try:
+            with open(f"{self.path}/{name}", "r") as file:
+                for line in file:
+                    key, value = line.split()
+                    events[key] = int(value)
+        except (OSError, ValueError):
+            pass
+        return events
+
+    def join(self):
+        """Move the calling process into the scope, in the child before exec so nothing runs outside it."""
+        with open(f"{self.path}/cgroup.procs", "w") as file:
+            file.write("0")
+
+    def violation(self):
+        if self.path is None:
+            return None
+        if self._events("memory.events").get("oom_kill", 0) > 0:
+            return MEMORY
+        if self._events("pids.events").get("max", 0) > 0:
+            return PROCESSES
+        return None
+
+    def cleanup(self):
+        if self.path is None:
+            return
+        # cgroup.kill (Linux 5.14+) takes down everything left in the scope
+        self._write("cgroup.kill", 1)
+        for _ in range(100):
+            try:
+                os.rmdir(self.path)
+                return
+            except OSError:
+                time.sleep(0.01)
+
+def _preexec(limits, scope=None):
+    def apply():
+        # own process group, so every process the candidate starts can be killed at once
+        os.setsid()
+        if scope is not None and scope.path is not None:
+            scope.join()
+        resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+        if limits.cpu_seconds is not None:
+            resource.setrlimit(resource.RLIMIT_CPU, (limits.cpu_seconds, limits.cpu_seconds + 5))
+        if limits.file_size_bytes is not None:
+            resource.setrlimit(resource.RLIMIT_FSIZE, (limits.file_size_bytes, limits.file_size_bytes))
+        # no RLIMIT_DATA: it counts reserved address space such as thread stacks, and the limit is on resident memory
+    return apply
+
+def resident_bytes(pid):
+    """Current RSS of a process, None once it is gone."""
+    try:
+        with open(f"/proc/{pid}/statm", "r") as file:
+            return int(file.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        return None
+
+def group_resident_bytes(pgid):
+    """Summed RSS of every process in a process group, None once none is left."""
+    total, found = 0, False
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat", "r") as file:
+                # the process group follows the state, after the parenthesized command name
+                fields = file.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(fields[2]) != pgid:
+            continue
+        rss = resident_bytes(int(name))
+        if rss is not None:
+            total, found = total + rss, True
+    return total if found else None
+
+def _kill_group(pgid):
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+def run_sandboxed(command, limits, stdin_path=None):
+    """Run an untrusted program with resource limits in a private temporary directory.
+
+    The program runs in its own session and process group, with TMPDIR and the
+    working directory pointing at a fresh directory, and stdout written to a
+    file there, so RLIMIT_FSIZE also caps runaway output. CPU time, output
+    size and core dumps are limited with rlimits; memory and process count
+    with a cgroup v2 scope when one can be created, otherwise the resident
+    memory is polled and the program killed once it exceeds the limit.
+    Whatever is still running afterwards is killed.
+    """
+    sandbox_dir = tempfile.mkdtemp(prefix="eedc-sandbox-")
+    scope = CgroupScope(limits)
+    env = dict(os.environ, TMPDIR=sandbox_dir, HOME=sandbox_dir)
+    stdout_path = f"{sandbox_dir}/stdout"
+    stderr_path = f"{sandbox_dir}/stderr"
+    stdin = open(stdin_path, "rb") if stdin_path is not None else subprocess.DEVNULL
+    violation = None
+    start = time.time()
+    try:
+        with open(stdout_path, "wb") as stdout, open(stderr_path, "wb") as stderr:
+            try:
+                process = subprocess.Popen(command, cwd=sandbox_dir, env=env, stdin=stdin, stdout=stdout, stderr=stderr,
+                                           preexec_fn=_preexec(limits, scope))
+            except subprocess.SubprocessError:
+                if scope.path is None:
+                    raise
+                # the child could not join the scope, poll its memory instead
+                scope.cleanup()
+                scope.path = None
+                process = subprocess.Popen(command, cwd=sandbox_dir, env=env, stdin=stdin, stdout=stdout, stderr=stderr,
+                                           preexec_fn=_preexec(limits))
+            try:
+                _, status, rusage = wait_with_rusage(process, limits.wall_time, limits.memory_bytes if scope.path is None else None)
+            except (subprocess.TimeoutExpired, MemoryError) as e:
+                violation = TIMEOUT if isinstance(e, subprocess.TimeoutExpired) else MEMORY
+                _kill_group(process.pid)
+                _, status, rusage = os.wait4(process.pid, 0)
+                process.returncode = os.waitstatus_to_exitcode(status)
+            # stray children and daemons of the candidate
+            _kill_group(process.pid)
+
+        returncode = os.waitstatus_to_exitcode(status)
+        with open(stdout_path, "rb") as file:
+            output = file.read()
+        with open(stderr_path, "rb") as file:
+            error = file.read()
+
+        if violation is None:
+            violation = scope.violation()
+        # a shell wrapper reports the signal as 128 + signal
+        if violation is None and returncode in (-signal.SIGXCPU, 128 + signal.SIGXCPU):
+            violation = CPU_TIME
+        if violation is None and returncode in (-signal.SIGXFSZ, 128 + signal.SIGXFSZ):
+            violation = FILE_SIZE
+        if violation is None and returncode != 0 and any(message in error for message in MEMORY_ERRORS):
+            violation = MEMORY
+
+        footprint = {
+            "peak_rss_kb": rusage.ru_maxrss,
+            "cpu_seconds": round(rusage.ru_utime + rusage.ru_stime, 3),
+            "output_bytes": len(output),
+            "wall_seconds": round(time.time() - start, 3)
+        }
+        return SandboxResult(returncode, output, error, violation, footprint)
+    finally:
+        if stdin_path is not None:
+            stdin.close()
+        scope.cleanup()
+        shutil.rmtree(sandbox_dir, ignore_errors=True)
+
+def wait_with_rusage(process, timeout, rss_limit=None):
+    """os.wait4 on the child (for its rusage) with a wall-clock timeout.
+
+    With rss_limit, MemoryError is raised once the resident memory of the
+    child's process group (the child leads it, see _preexec) exceeds it.
+    """
+    deadline = time.time() + timeout if timeout is not None else None
+    next_poll = time.time()
+    while True:
+        pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+        if pid != 0:
+            process.returncode = os.waitstatus_to_exitcode(status)
+            return pid, status, rusage
+        if deadline is not None and time.time() >= deadline:
+            raise subprocess.TimeoutExpired(process.args, timeout)
+        if rss_limit is not None and time.time() >= next_poll:
+            next_poll = time.time() + RSS_POLL_SECONDS
+            rss = group_resident_bytes(process.pid)
+            if rss is not None and rss > rss_limit:
+                raise MemoryError(f"resident memory {rss} exceeds {rss_limit}")
+        time.sleep(0.01)
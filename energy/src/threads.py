@@ -0,0 +1,96 @@
+import glob
+import os
+
+# Thread placement policies of the sweep
+COMPACT = "compact"   # fill both hyperthreads of a core before the next core
+SPREAD = "spread"     # one thread per core, spread over the sockets, hyperthreads last
+NO_SMT = "nosmt"      # only the first hyperthread of every core
+POLICIES = [COMPACT, SPREAD, NO_SMT]
+
+def cpu_topology():
+    """(package, core, logical cpu) of every online cpu, from sysfs."""
+    topology = []
+    for path in sorted(glob.glob("/sys/devices/system/cpu/cpu[0-9]*/topology")):
+        cpu = int(path.split("/")[-2][3:])
+        try:
+            with open(f"{path}/physical_package_id") as file:
+                package = int(file.read())
+            with open(f"{path}/core_id") as file:
+                core = int(file.read())
+        except (OSError, ValueError):
+            continue
+        topology.append((package, core, cpu))
+    if not topology:
+        topology = [(0, cpu, cpu) for cpu in range(os.cpu_count() or 1)]
+    return sorted(topology)
+
+def cpu_list(policy, threads, topology=None):
+    """Logical cpus a run with `threads` threads is pinned to, None if the policy cannot place them."""
+    topology = topology or cpu_topology()
+    cores = {}
+    for package, core, cpu in topology:
+        cores.setdefault((package, core), []).append(cpu)
+
+    if policy == COMPACT:
+        order = [cpu for siblings in cores.values() for cpu in siblings]
+    else:
+        # round robin over the packages so both sockets get work
+        by_package = {}
+        for (package, _), siblings in cores.items():
+            by_package.setdefault(package, []).append(siblings)
+        rounds = []
+        for level in range(max(len(siblings) for siblings in cores.values())):
+            if policy == NO_SMT and level > 0:
+                break
+            packages = [[siblings[level] for siblings in package_cores if level < len(siblings)] for package_cores in by_package.values()]
+            for i in range(max(len(cpus) for cpus in packages)):
+                rounds += [cpus[i] for cpus in packages if i < len(cpus)]
+        order = rounds
+
+    if threads > len(order):
+        return None
+    return sorted(order[:threads])
+
+def thread_counts(topology=None):
+    """Default CPU counts: 1, half the cores, all cores and all hyperthreads."""
+    topology = topology or cpu_topology()
+    cores = len({(package, core) for package, core, _ in topology})
+    return sorted({1, max(1, cores // 2), cores, len(topology)})
+
+def sweep_configurations(threading, counts=None, policies=None):
+    """Every (CPU count, policy) pair that can be placed; a single default run for serial benchmarks.
+
+    taskset only restricts the CPUs; a pthreads benchmark still starts as many
+    threads as it wants, so "threads" is only set where OMP_NUM_THREADS follows it.
+    """
+    if threading == "none":
+        return [{"threads": None, "policy": None, "cpus": None}]
+    topology = cpu_topology()
+    configs = []
+    seen = set()
+    for count in counts or thread_counts(topology):
+        for policy in policies or POLICIES:
+            cpus = cpu_list(policy, count, topology)
+            # different policies can end up on the same cpus
+            if cpus is None or tuple(cpus) in seen:
+                continue
+            seen.add(tuple(cpus))
+            configs.append({"threads": count if threading == "openmp" else None, "policy": policy, "cpus": cpus})
+    return configs
+
+def launch_prefix(config, threading):
+    """Shell prefix that runs a command with the thread configuration."""
+    if config is None or config.get("cpus") is None:
+        return ""
+    prefix = f"taskset -c {','.join(str(cpu) for cpu in config['cpus'])} "
+    if threading == "openmp":
+        bind = "close" if config["policy"] == COMPACT else "spread"
+        prefix += f"env OMP_NUM_THREADS={config['threads']} OMP_PROC_BIND={bind} OMP_PLACES=threads "
+    return prefix
+
+def config_name(config):
+    if config is None or config.get("cpus") is None:
+        return "default"
+    if config.get("threads") is None:
+        return f"{len(config['cpus'])} CPUs, {config['policy']}"
+    return f"{config['threads']} threads on {len(config['cpus'])} CPUs, {config['policy']}"
@@ -0,0 +1,20 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+from analytics import Runs
+
+RESULTS = '{"0": ["a", 10.0, 1.0], "1": ["b", 8.0, 0.9]}'
+
+def test_a_run_copied_into_test_results_is_counted_once(tmp_path):
+    for directory, name, text in (("test_results/nbody", "result_file_1.txt", RESULTS + "\nstopped"),
+                                  ("test_results/nbody", "result_file_2.txt", RESULTS.replace("8.0", "7.0")),
+                                  ("benchmarks_out/nbody", "result_file.txt", RESULTS)):
+        os.makedirs(tmp_path / directory, exist_ok=True)
+        (tmp_path / directory / name).write_text(text)
+    patterns = [f"{tmp_path}/test_results/*/result_file*.txt", f"{tmp_path}/benchmarks_out/*/result_file.txt"]
+    cache_path = str(tmp_path / "runs_cache.npz")
+    for _ in range(2):
+        # parsed, then from the cache
+        runs = Runs.load(patterns, cache_path)
+        assert [os.path.basename(path) for path in runs.runs["path"].tolist()] == ["result_file_1.txt", "result_file_2.txt"]
+        assert runs.versions["run"].tolist() == [0, 0, 1, 1]
@@ -0,0 +1,55 @@
+import os
+import subprocess
+import sys
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import benchmark
+from benchmark import BETTER, SEQUENTIAL_MIN_NOISE, UNDECIDED, WORSE, parse_energy_csv, rapl_measure, sequential_decision, simulated_measure, trial_noise
+
+def test_simulated_measure_writes_rapl_trials(tmp_path):
+    log_file_path = str(tmp_path / "C++.csv")
+    simulated_measure("true", log_file_path, "test", trials=3)
+    trials = parse_energy_csv(log_file_path)
+    assert len(trials) == 3 and all(name == "test" for name, _, _ in trials)
+
+def test_simulated_measure_raises_on_a_failing_command(tmp_path):
+    with pytest.raises(subprocess.CalledProcessError):
+        simulated_measure("exit 3", str(tmp_path / "C++.csv"), "test")
+
+def test_trial_noise_pools_the_sets_with_two_trials():
+    assert trial_noise([[10.0]]) == SEQUENTIAL_MIN_NOISE
+    # both sets have a relative variance of 0.02
+    assert trial_noise([[9.0, 11.0], [18.0, 22.0], [5.0]]) == pytest.approx(0.02 ** 0.5)
+    assert trial_noise([[10.0, 10.0]]) == SEQUENTIAL_MIN_NOISE
+
+def test_sequential_decision():
+    decision, probability = sequential_decision([120.0], [100.0, 101.0], 0.02)
+    assert decision == WORSE and probability > 0.99
+    decision, probability = sequential_decision([80.0, 81.0], [100.0, 100.0], 0.02)
+    assert decision == BETTER and probability < 0.01
+    # a 1% difference with 5% noise per trial is not decided after a few trials
+    decision, probability = sequential_decision([99.0, 99.0], [100.0, 100.0], 0.05)
+    assert decision == UNDECIDED and 0.01 < probability < 0.5
+
+def test_rapl_setup_runs_once(tmp_path, monkeypatch):
+    (tmp_path / "energy/src").mkdir(parents=True)
+    monkeypatch.setattr(benchmark, "USER_PREFIX", str(tmp_path))
+    monkeypatch.setattr(benchmark, "ENERGY_BACKEND", "rapl")
+    monkeypatch.setattr(benchmark, "msr_loaded", False)
+    calls = []
+
+    def run(args, check=False):
+        calls.append(args[1])
+        if args[1] == benchmark.rapl_main_path:
+            log_file_path = tmp_path / "energy/src" / f"{args[3]}.csv"
+            with open(log_file_path, "a") as file:
+                file.write(f"{args[4]} ; 1.5,  ,  ,  10 \n")
+            # RAPL/main runs as root, the csv it creates is not writable by others
+            if "chmod" not in calls:
+                os.chmod(log_file_path, 0o644)
+        elif args[1] == "chmod":
+            os.chmod(args[-1], 0o777)
+    monkeypatch.setattr(benchmark.subprocess, "run", run)
+    for _ in range(3):
+        assert rapl_measure("true", "C++", "test", trials=1) == [("test", 1.5, 10.0)]
+    assert calls == ["modprobe", benchmark.rapl_main_path, "chmod", benchmark.rapl_main_path, benchmark.rapl_main_path]
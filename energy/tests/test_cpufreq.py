@@ -0,0 +1,28 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import cpufreq
+from cpufreq import SimulatedCpufreq, SysfsCpufreq, frequency_sweep
+
+class PartialCpufreq(SimulatedCpufreq):
+    """Simulated controller whose lowest setting cannot be written to every cpu."""
+
+    def apply(self, setting):
+        super().apply(setting)
+        return setting != min(self.frequencies)
+
+def test_sweep_skips_settings_that_were_not_applied():
+    controller = PartialCpufreq()
+    report = frequency_sweep(controller, lambda: controller.simulate(10.0, 1000.0))
+    assert report["skipped"] == [min(controller.frequencies)]
+    assert min(controller.frequencies) not in [result["setting"] for result in report["results"]]
+    assert report["status"] == "measured"
+
+def test_sysfs_apply_reports_failed_writes(monkeypatch):
+    controller = SysfsCpufreq.__new__(SysfsCpufreq)
+    controller.policy_dirs, controller.mode, controller.saved = ["/cpu0", "/cpu1"], "max_freq", {}
+    monkeypatch.setattr(cpufreq, "_read", lambda path: "3000000")
+    monkeypatch.setattr(SysfsCpufreq, "_write", lambda self, path, value: path != "/cpu1/scaling_max_freq")
+    assert controller.apply(2000000) is False
+    monkeypatch.setattr(SysfsCpufreq, "_write", lambda self, path, value: True)
+    assert controller.apply(2000000) is True
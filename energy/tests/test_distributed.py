@@ -0,0 +1,64 @@
+import os
+import sys
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import distributed
+from distributed import Coordinator, DONE, LEASED, calibrated_trials
+
+def fingerprint(id, host="node1", backend="rapl"):
+    return {"id": id, "host": host, "backend": backend}
+
+def job(original=False):
+    return {"benchmark": "spectralnorm", "language": "c++", "source": "s", "original_source": "o", "original": original}
+
+def result(id, trials):
+    return {"fingerprint": fingerprint(id), "trials": trials}
+
+def test_an_expired_lease_is_requeued_and_the_stale_result_refused(monkeypatch):
+    coordinator = Coordinator()
+    job_id = coordinator.submit(job(original=True))
+    assert coordinator.lease("a", fingerprint("f1"))["id"] == job_id
+    assert coordinator.lease("b", fingerprint("f2", host="node2")) is None
+    coordinator.jobs[job_id]["leased"] -= distributed.LEASE_SECONDS + 1
+    leased = coordinator.lease("b", fingerprint("f2", host="node2"))
+    assert leased["id"] == job_id and leased["attempts"] == 2
+    assert coordinator.status(job_id)["status"] == LEASED
+
+    assert not coordinator.complete(job_id, "a", result("f1", [("t", 10.0, 1.0)]))
+    assert coordinator.complete(job_id, "b", result("f2", [("t", 20.0, 2.0)]))
+    assert coordinator.status(job_id)["status"] == DONE
+    assert coordinator.calibration["spectralnorm"] == {"f2": {"avg_energy": 20.0, "avg_runtime": 2.0}}
+
+def test_a_live_lease_is_not_requeued():
+    coordinator = Coordinator()
+    job_id = coordinator.submit(job())
+    coordinator.lease("a", fingerprint("f1"))
+    assert coordinator.lease("b", fingerprint("f2", host="node2")) is None
+    assert coordinator.status()["leased"] == 1 and coordinator.status(job_id)["worker"] == "a"
+
+def test_one_rapl_worker_per_host():
+    coordinator = Coordinator()
+    coordinator.submit(job())
+    coordinator.lease("a", fingerprint("f1"))
+    with pytest.raises(ValueError):
+        coordinator.lease("b", fingerprint("f1"))
+    # the same worker again, and powercap workers sharing the host, are fine
+    assert coordinator.lease("a", fingerprint("f1")) is None
+    assert coordinator.lease("c", fingerprint("f3", backend="powercap")) is None
+    assert coordinator.status()["queued"] == 0 and coordinator.status()["leased"] == 1
+
+def test_a_rapl_worker_gone_for_a_lease_frees_its_host():
+    coordinator = Coordinator()
+    coordinator.lease("a", fingerprint("f1"))
+    coordinator.workers["a"]["seen"] -= distributed.LEASE_SECONDS + 1
+    assert coordinator.lease("b", fingerprint("f1")) is None
+
+def test_calibrated_trials():
+    trials = [("t", 10.0, 1.0), ("t", 12.0, 1.2)]
+    assert calibrated_trials(result("f1", trials), "f1") == (trials, (1.0, 1.0))
+    calibration = {"f1": {"avg_energy": 20.0, "avg_runtime": 1.0}, "f2": {"avg_energy": 10.0, "avg_runtime": 2.0}}
+    scaled, factors = calibrated_trials(dict(result("f2", trials), calibration=calibration), "f1")
+    assert factors == (2.0, 0.5)
+    assert scaled == [("t", 20.0, 0.5), ("t", 24.0, 0.6)]
+    with pytest.raises(ValueError):
+        calibrated_trials(dict(result("f3", trials), calibration=calibration), "f1")
@@ -0,0 +1,47 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import energy_meter
+from energy_meter import EnergyAccount, PowercapMeter, make_meter, net_energy
+
+def domain(root, name, kind, energy_uj, wrap=1000000):
+    path = root / name
+    path.mkdir()
+    (path / "name").write_text(f"{kind}\n")
+    (path / "energy_uj").write_text(f"{energy_uj}\n")
+    (path / "max_energy_range_uj").write_text(f"{wrap}\n")
+    return path
+
+def test_packages_and_dram_are_summed(tmp_path, monkeypatch):
+    monkeypatch.setattr(energy_meter, "POWERCAP_DIR", str(tmp_path))
+    package = domain(tmp_path, "intel-rapl:0", "package-0", 100, wrap=10000000)
+    domain(tmp_path, "intel-rapl:0:0", "core", 50)
+    dram = domain(tmp_path, "intel-rapl:0:1", "dram", 10)
+    domain(tmp_path, "intel-rapl:1", "psys", 500)
+    meter = PowercapMeter()
+    assert meter.scope == "package+dram" and len(meter.domains) == 2
+    (package / "energy_uj").write_text("2000100\n")
+    # dram wrapped around
+    (dram / "energy_uj").write_text("9\n")
+    assert meter.read() == 2.0 + 1.0
+
+def test_package_only_scope(tmp_path, monkeypatch):
+    monkeypatch.setattr(energy_meter, "POWERCAP_DIR", str(tmp_path))
+    domain(tmp_path, "intel-rapl:0", "package-0", 100)
+    assert PowercapMeter().scope == "package"
+
+def test_unreadable_counters_are_reported(tmp_path, monkeypatch):
+    monkeypatch.setattr(energy_meter, "POWERCAP_DIR", str(tmp_path))
+    domain(tmp_path, "intel-rapl:0", "package-0", 100)
+
+    def root_only(self, path):
+        raise PermissionError(13, "Permission denied", path)
+    monkeypatch.setattr(PowercapMeter, "_counter", root_only)
+    meter, reason = make_meter("powercap")
+    assert meter is None and "only readable by root" in reason
+    assert make_meter("none") == (None, "ENERGY_METER=none")
+
+def test_net_energy_says_why_it_is_not_metered(monkeypatch):
+    monkeypatch.setattr(energy_meter, "account", EnergyAccount(None, "ENERGY_METER=none"))
+    summary = net_energy(None, None, {"prompt_tokens": 0, "completion_tokens": 0}, True, 10.0, 8.0)
+    assert summary["metered"] is False and summary["reason"] == "ENERGY_METER=none"
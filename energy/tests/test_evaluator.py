@@ -0,0 +1,31 @@
+import os
+import sys
+import threading
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import evaluator
+from evaluator import AsyncEvaluator, BRIEF, FULL, SKIP
+
+def info(source, energy, std=1.0):
+    return {"original": {"avg_energy": 100.0}, "current": {"source_code": source, "avg_energy": energy, "energy_std": std}}
+
+def test_choose_mode():
+    async_evaluator = AsyncEvaluator(None, None, noise_factor=2.0)
+    assert async_evaluator.choose_mode(info("a", 90.0)) == FULL
+    async_evaluator.best_energy = 90.0
+    # within the noise of the best and no feedback yet
+    assert async_evaluator.choose_mode(info("b", 91.0)) == BRIEF
+    async_evaluator.last_feedback, async_evaluator.last_source = "feedback", "a"
+    assert async_evaluator.choose_mode(info("b", 91.0)) == SKIP
+    assert async_evaluator.choose_mode(info("a", 70.0)) == SKIP
+    assert async_evaluator.choose_mode(info("c", 70.0)) == FULL
+
+def test_poll_does_not_block(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(evaluator, "evaluator_llm", lambda client, model_name, benchmark_info, mode: release.wait() and "feedback")
+    async_evaluator = AsyncEvaluator(None, None)
+    async_evaluator.submit(info("a", 90.0))
+    assert async_evaluator.poll() is None
+    release.set()
+    assert async_evaluator.wait()["feedback"] == "feedback"
+    assert async_evaluator.poll() is None
+    async_evaluator.shutdown()
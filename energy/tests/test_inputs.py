@@ -0,0 +1,54 @@
+import os
+import subprocess
+import sys
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import inputs
+import registry
+
+ENTRY = {"name": "fasta", "production_input": "small", "inputs": {"small": {"args": [], "stdin": {"generator": "fasta", "n": 10}}}}
+
+@pytest.fixture
+def staging(tmp_path, monkeypatch):
+    monkeypatch.setattr(inputs, "staging_dirs", lambda: [str(tmp_path)])
+    return tmp_path
+
+def test_stdin_path_is_a_lookup_and_prepare_inputs_generates(staging, monkeypatch):
+    monkeypatch.setattr(inputs, "_generate", lambda stdin, path: open(path, "w").write(">ONE\n"))
+    path = registry.stdin_path(ENTRY)
+    assert path == str(staging / "fasta-10.txt") and not os.path.exists(path)
+    assert registry.prepare_inputs(ENTRY) is None
+    assert os.path.isfile(path) and registry.stdin_path(ENTRY) == path
+
+def test_prepare_inputs_reports_a_failing_generator(staging, monkeypatch):
+    def fail(stdin, path):
+        raise subprocess.CalledProcessError(1, "fasta")
+    monkeypatch.setattr(inputs, "_generate", fail)
+    assert registry.prepare_inputs(ENTRY) is not None
+    assert not os.path.exists(registry.stdin_path(ENTRY))
+
+def test_a_truncated_input_is_generated_again(staging, monkeypatch):
+    monkeypatch.setattr(inputs, "_generator_binary", lambda generator, directory: ({}, "/bin/echo"))
+    path = inputs.staged_input(ENTRY["inputs"]["small"]["stdin"])
+    with open(path) as file:
+        assert file.read() == "10\n"
+    with open(path, "w") as file:
+        file.write("1")
+    assert not inputs._is_complete(path)
+    assert inputs.staged_input(ENTRY["inputs"]["small"]["stdin"]) == path
+    with open(path) as file:
+        assert file.read() == "10\n"
+
+def test_a_full_directory_falls_back_to_the_next(tmp_path, monkeypatch):
+    full, disk = tmp_path / "full", tmp_path / "disk"
+    monkeypatch.setattr(inputs, "staging_dirs", lambda: [str(full), str(disk)])
+    monkeypatch.setattr(inputs, "_generator_binary", lambda generator, directory: ({}, "/bin/echo"))
+    copy = inputs.shutil.copyfileobj
+
+    def no_space(source, target):
+        if target.name.startswith(str(full)):
+            raise OSError(28, "No space left on device")
+        copy(source, target)
+    monkeypatch.setattr(inputs.shutil, "copyfileobj", no_space)
+    assert inputs.staged_input(ENTRY["inputs"]["small"]["stdin"]) == str(disk / "fasta-10.txt")
+    assert os.listdir(full) == [".lock"]
@@ -0,0 +1,23 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import memory
+from memory import memory_profile, read_time_file
+
+TIME_RECORD = """\tCommand being timed: "./x"
+\tMaximum resident set size (kbytes): 2048
+\tMajor (requiring I/O) page faults: 1
+\tMinor (reclaiming a frame) page faults: 300
+"""
+
+def test_read_time_file(tmp_path):
+    out_file = tmp_path / "memory.1.txt"
+    assert read_time_file(str(out_file)) is None
+    out_file.write_text(TIME_RECORD)
+    assert read_time_file(str(out_file)) == {"peak_rss_kb": 2048, "major_page_faults": 1, "minor_page_faults": 300, "source": "time"}
+
+def test_memory_profile_runs_behind_the_prefix(monkeypatch):
+    monkeypatch.setattr(memory, "TIME_PATH", "/nonexistent/time")
+    assert memory.time_prefix("/tmp/unused") == ""
+    record = memory_profile(["sh", "-c", 'test "$OMP_NUM_THREADS" = 2'], prefix=["env", "OMP_NUM_THREADS=2"])
+    assert record["exit_code"] == 0 and record["source"] == "rusage"
@@ -0,0 +1,25 @@
+import os
+import sys
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+from registry import output_digest, read_result_file, record_output_digest, verified_digest
+
+def test_verified_digest_follows_the_executable(tmp_path):
+    binary_path = str(tmp_path / "x.gpp_run")
+    open(binary_path, "w").close()
+    assert verified_digest(binary_path) is None
+    record_output_digest(binary_path, b"1 2\n3\n")
+    assert verified_digest(binary_path) == output_digest("123")
+    # rebuilt after the test, the stored digest no longer applies
+    os.utime(binary_path, (os.path.getmtime(binary_path) + 10,) * 2)
+    assert verified_digest(binary_path) is None
+
+def test_read_result_file_keeps_the_notes(tmp_path):
+    path = tmp_path / "result_file_1.txt"
+    path.write_text('{"0": ["a", 10.0, 1.0], "1": ["b", 8.0, 0.9]}\nProgram catched 1 compilation_errors and 0 output_errors\n')
+    versions, notes = read_result_file(str(path))
+    assert versions == {0: ("a", 10.0, 1.0), 1: ("b", 8.0, 0.9)}
+    assert "1 compilation_errors" in notes
+    path.write_text("rate limit reached\n")
+    with pytest.raises(ValueError):
+        read_result_file(str(path))
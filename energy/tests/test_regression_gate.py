@@ -0,0 +1,58 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+from regression_gate import DRIFT, IMPROVED, PASSED, REGRESSED, compare, environment_changes, evaluate
+
+def version(energy, runtime, std=0.0, n=6):
+    return {"energy": {"mean": energy, "std": std, "n": n}, "runtime": {"mean": runtime, "std": std, "n": n}}
+
+def measurement(original, best):
+    return {"original": version(*original), "best": version(*best)}
+
+BASELINE = measurement((100.0, 1.0), (80.0, 0.8))
+
+def test_compare_uses_tolerance_or_noise():
+    assert compare(1.04, 1.0, 0.0, 0.0)["verdict"] == PASSED
+    assert compare(1.06, 1.0, 0.0, 0.0)["verdict"] == REGRESSED
+    assert compare(0.94, 1.0, 0.0, 0.0)["verdict"] == IMPROVED
+    # 3 * sqrt(0.03^2 + 0.04^2) = 0.15
+    noisy = compare(1.10, 1.0, 0.03, 0.04)
+    assert noisy["verdict"] == PASSED and noisy["threshold"] == 0.15
+
+def test_unchanged_versions_pass():
+    status, checks = evaluate(measurement((100.0, 1.0), (80.0, 0.8)), BASELINE, True, {})
+    assert status == PASSED and set(checks) == {"gain_energy", "gain_runtime", "best_energy", "original_energy", "best_runtime", "original_runtime"}
+
+def test_both_versions_slower_on_the_same_machine_is_drift():
+    status, checks = evaluate(measurement((120.0, 1.2), (96.0, 0.96)), BASELINE, True, {})
+    assert status == DRIFT
+    assert checks["best_energy"]["verdict"] == DRIFT and checks["original_energy"]["verdict"] == REGRESSED
+    assert checks["gain_energy"]["verdict"] == PASSED
+
+def test_drift_is_not_assumed_when_something_changed():
+    changes = {"compiler": ["g++ 12", "g++ 13"]}
+    status, checks = evaluate(measurement((120.0, 1.2), (96.0, 0.96)), BASELINE, True, changes)
+    assert status == REGRESSED and checks["best_energy"]["verdict"] == REGRESSED
+
+def test_a_worse_best_version_regresses_despite_a_steady_original():
+    status, checks = evaluate(measurement((100.0, 1.0), (90.0, 0.8)), BASELINE, True, {})
+    assert status == REGRESSED
+    assert checks["gain_energy"]["verdict"] == REGRESSED and checks["best_energy"]["verdict"] == REGRESSED
+    assert checks["original_energy"]["verdict"] == PASSED
+
+def test_a_slower_original_alone_does_not_fail_the_gate():
+    status, checks = evaluate(measurement((120.0, 1.0), (80.0, 0.8)), BASELINE, True, {})
+    assert checks["original_energy"]["verdict"] == REGRESSED and checks["best_energy"]["verdict"] == PASSED
+    # the best version now gains more over the original
+    assert status == IMPROVED
+
+def test_another_machine_compares_gains_only():
+    status, checks = evaluate(measurement((200.0, 2.0), (160.0, 1.6)), BASELINE, False, {})
+    assert status == PASSED and set(checks) == {"gain_energy", "gain_runtime"}
+    status, _ = evaluate(measurement((200.0, 2.0), (140.0, 1.4)), BASELINE, False, {})
+    assert status == IMPROVED
+
+def test_environment_changes():
+    baseline = {"compiler": "g++ 12", "best_source": "a", "original_source": "b", "fingerprint": {"id": "1", "kernel": "6.1", "governor": "performance"}}
+    environment = {"compiler": "g++ 12", "best_source": "c", "original_source": "b", "fingerprint": {"id": "2", "kernel": "6.8", "governor": "performance"}}
+    assert environment_changes(baseline, environment) == {"best_source": ["a", "c"], "kernel": ["6.1", "6.8"]}
@@ -0,0 +1,32 @@
+import os
+import signal
+import sys
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import sandbox
+from sandbox import CPU_TIME, FILE_SIZE, MEMORY, TIMEOUT, Limits, run_sandboxed
+
+@pytest.fixture(autouse=True)
+def no_cgroup(tmp_path, monkeypatch):
+    # without a delegated cgroup the sandbox falls back to polling the resident memory
+    monkeypatch.setattr(sandbox, "CGROUP_ROOT", str(tmp_path / "no-cgroup"))
+
+def run(script, **limits):
+    return run_sandboxed(["sh", "-c", script], Limits(wall_time=limits.pop("wall_time", 20), **limits))
+
+def test_exit_signals_and_stderr_are_classified():
+    assert run(f"exit {128 + signal.SIGXCPU}").violation == CPU_TIME
+    assert run(f"exit {128 + signal.SIGXFSZ}").violation == FILE_SIZE
+    assert run("echo 'std::bad_alloc' >&2; exit 1").violation == MEMORY
+    # EAGAIN is not only a thread limit, such a failure stays an ordinary error
+    assert run("echo 'Resource temporarily unavailable' >&2; exit 1").violation is None
+    assert run("echo 'std::bad_alloc' >&2").violation is None
+
+def test_timeout():
+    assert run("sleep 5", wall_time=0.2).violation == TIMEOUT
+
+def test_memory_of_grandchildren_counts():
+    # sh does not exec the last command of a list, so the allocation happens in a child of the sandboxed process
+    script = f"{sys.executable} -c 'import time; buffer = bytearray(200 * 1024 * 1024); time.sleep(5)'; true"
+    result = run(script, memory_bytes=100 * 1024 * 1024)
+    assert result.violation == MEMORY
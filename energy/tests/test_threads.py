@@ -0,0 +1,23 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import threads
+from threads import COMPACT, SPREAD, config_name, cpu_list, launch_prefix, sweep_configurations
+
+# two packages of two cores with two hyperthreads each
+TOPOLOGY = [(package, core, package * 4 + core * 2 + smt) for package in range(2) for core in range(2) for smt in range(2)]
+
+def test_policies_place_the_cpus():
+    assert cpu_list(COMPACT, 2, TOPOLOGY) == [0, 1]
+    assert cpu_list(SPREAD, 2, TOPOLOGY) == [0, 4]
+    assert cpu_list(SPREAD, 9, TOPOLOGY) is None
+
+def test_only_openmp_gets_a_thread_count(monkeypatch):
+    monkeypatch.setattr(threads, "cpu_topology", lambda: TOPOLOGY)
+    pthreads = sweep_configurations("pthreads", [2], [SPREAD])[0]
+    assert pthreads["threads"] is None and config_name(pthreads) == "2 CPUs, spread"
+    assert launch_prefix(pthreads, "pthreads") == "taskset -c 0,4 "
+    openmp = sweep_configurations("openmp", [2], [SPREAD])[0]
+    assert config_name(openmp) == "2 threads on 2 CPUs, spread"
+    assert "OMP_NUM_THREADS=2" in launch_prefix(openmp, "openmp")
+    assert sweep_configurations("none") == [{"threads": None, "policy": None, "cpus": None}]
@@ -0,0 +1,164 @@
+import atexit
+import gzip
+import hashlib
+import json
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+from dotenv import load_dotenv
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+load_dotenv()
+USER_PREFIX = os.getenv('USER_PREFIX')
+
+ARTIFACT_DIR = f"{USER_PREFIX}/llm/artifacts"
+# Runs kept per benchmark, older run directories are deleted when a new run starts
+MAX_RUNS = int(os.getenv("ARTIFACT_MAX_RUNS", 20))
+# Compressed bytes stored per run, later blobs are only listed in the manifest
+MAX_RUN_BYTES = int(os.getenv("ARTIFACT_MAX_RUN_MB", 256)) * 1024 * 1024
+# Characters kept on each side of the first difference of two outputs
+DIFF_WINDOW = int(os.getenv("ARTIFACT_DIFF_WINDOW", 200))
+
+_lock = threading.Lock()
+_queue = queue.Queue()
+_writer = None
+store = {
+    "run_dir": None,
+    "stored_bytes": 0,
+    "records": 0,
+    "deduplicated": 0,
+    "dropped": 0
+}
+
+def _extension():
+    return "zst" if zstandard is not None else "gz"
+
+def _compress(data):
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+def start_run(benchmark):
+    """New run directory llm/artifacts/<benchmark>/<timestamp>, pruning all but the newest MAX_RUNS."""
+    benchmark_dir = f"{ARTIFACT_DIR}/{benchmark}"
+    run_dir = f"{benchmark_dir}/{time.strftime('%Y%m%d-%H%M%S')}"
+    flush()
+    os.makedirs(f"{run_dir}/blobs", exist_ok=True)
+    runs = sorted(os.listdir(benchmark_dir))
+    for old_run in runs[:max(0, len(runs) - MAX_RUNS)]:
+        shutil.rmtree(f"{benchmark_dir}/{old_run}", ignore_errors=True)
+    with _lock:
+        store.update({"run_dir": run_dir, "stored_bytes": 0, "records": 0, "deduplicated": 0, "dropped": 0})
+    return run_dir
+
+def _run_dir():
+    with _lock:
+        if store["run_dir"] is None:
+            store["run_dir"] = f"{ARTIFACT_DIR}/unnamed/{time.strftime('%Y%m%d-%H%M%S')}"
+            os.makedirs(f"{store['run_dir']}/blobs", exist_ok=True)
+        return store["run_dir"]
+
+def _write(run_dir, kind, data, metadata):
+    record = {"time": round(time.time(), 3), "kind": kind, **metadata}
+    if data is not None:
+        digest = hashlib.sha256(data).hexdigest()
+        blob_path = f"{run_dir}/blobs/{digest[:2]}/{digest}.{_extension()}"
+        record.update({"sha256": digest, "bytes": len(data)})
+        if os.path.isfile(blob_path):
+            with _lock:
+                store["deduplicated"] += 1
+            record["blob"] = os.path.relpath(blob_path, run_dir)
+        elif store["stored_bytes"] >= MAX_RUN_BYTES:
+            with _lock:
+                store["dropped"] += 1
+            record["dropped"] = True
+        else:
+            compressed = _compress(data)
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            with open(blob_path + ".tmp", "wb") as file:
+                file.write(compressed)
+            os.replace(blob_path + ".tmp", blob_path)
+            with _lock:
+                store["stored_bytes"] += len(compressed)
+            record["blob"] = os.path.relpath(blob_path, run_dir)
+    with _lock:
+        store["records"] += 1
+    with open(f"{run_dir}/manifest.jsonl", "a") as file:
+        file.write(json.dumps(record) + "\n")
+
+def _writer_loop():
+    while True:
+        item = _queue.get()
+        try:
+            if item is not None:
+                _write(*item)
+        except OSError as e:
+            print(f"artifacts: could not write {item[1]}: {e}")
+        finally:
+            _queue.task_done()
+
+def _submit(kind, data, metadata):
+    global _writer
+    if isinstance(data, str):
+        data = data.encode(errors="replace")
+    with _lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_writer_loop, daemon=True)
+            _writer.start()
+    _queue.put((_run_dir(), kind, data, metadata or {}))
+
+def record(kind, content, metadata=None):
+    """Store a prompt, response or log in the background; identical contents are stored once."""
+    _submit(kind, content, metadata)
+
+def record_file(kind, path, metadata=None):
+    try:
+        with open(path, "rb") as file:
+            _submit(kind, file.read(), metadata)
+    except OSError:
+        pass
+
+def diff_window(expected, actual):
+    """Digests of both outputs (whitespace removed) and the text around their first difference."""
+    expected = re.sub(r'\s+', '', expected)
+    actual = re.sub(r'\s+', '', actual)
+    window = {
+        "expected_sha256": hashlib.sha256(expected.encode(errors="replace")).hexdigest(),
+        "actual_sha256": hashlib.sha256(actual.encode(errors="replace")).hexdigest(),
+        "expected_length": len(expected),
+        "actual_length": len(actual)
+    }
+    if expected == actual:
+        return window
+    position = next((i for i, (a, b) in enumerate(zip(expected, actual)) if a != b), min(len(expected), len(actual)))
+    start = max(0, position - DIFF_WINDOW)
+    window.update({
+        "first_difference": position,
+        "expected_window": expected[start:position + DIFF_WINDOW],
+        "actual_window": actual[start:position + DIFF_WINDOW]
+    })
+    return window
+
+def record_comparison(expected, actual, metadata=None):
+    """Manifest entry for an output comparison without the outputs themselves, returns the diff window."""
+    window = diff_window(expected, actual)
+    _submit("output_comparison", None, {**window, **(metadata or {})})
+    return window
+
+def flush():
+    """Wait until everything submitted so far is on disk."""
+    if _writer is not None:
+        _queue.join()
+
+def get_stats():
+    flush()
+    with _lock:
+        return dict(store)
+
+atexit.register(flush)
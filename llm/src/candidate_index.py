@@ -0,0 +1,231 @@
+from dotenv import load_dotenv
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import uuid
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from energy.src.registry import out_dir
+
+load_dotenv()
+USER_PREFIX = os.getenv('USER_PREFIX')
+
+TOKEN_RE = re.compile(r'''
+    (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<string>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')
+  | (?P<preproc>^[ \t]*\#(?:\\\n|[^\n])*)
+  | (?P<ident>[A-Za-z_]\w*)
+  | (?P<number>\.?\d(?:[eEpP][+-]|[\w.])*)
+  | (?P<space>\s+)
+  | (?P<op>.)
+''', re.S | re.M | re.X)
+
+# Results that only depend on the candidate; a failure (compile error, output difference, limit) can be
+# transient, so it only marks a duplicate within the run that saw it
+PERSISTENT_RESULTS = {1}
+
+# Added to the next optimization prompt after a duplicate
+DUPLICATE_HINT = "Your previous answer was equivalent to code that was already tried (it only differed in formatting, comments or names). Propose a substantially different optimization this time."
+
+# Builtin types and specifiers that can start a declaration (`static const int x`, `struct Node *left`)
+TYPE_KEYWORDS = {"auto", "bool", "char", "double", "float", "int", "long", "short", "signed", "unsigned", "void"}
+DECLARATION_SPECIFIERS = {
+    "class", "const", "constexpr", "enum", "extern", "inline", "mutable", "register", "static",
+    "struct", "thread_local", "typename", "union", "volatile"
+}
+DECLARATION_PREFIXES = TYPE_KEYWORDS | DECLARATION_SPECIFIERS
+# Tokens that can follow a declared name
+DECLARATION_SUFFIXES = {"=", ";", ",", "(", "[", ")", "{", ":"}
+# Tokens a declaration can start after
+STATEMENT_BOUNDARIES = {";", "{", "}"}
+
+CPP_KEYWORDS = {
+    "alignas", "alignof", "asm", "auto", "bool", "break", "case", "catch", "char", "class", "const",
+    "constexpr", "const_cast", "continue", "decltype", "default", "delete", "do", "double",
+    "dynamic_cast", "else", "enum", "explicit", "extern", "false", "float", "for", "friend", "goto",
+    "if", "inline", "int", "long", "mutable", "namespace", "new", "noexcept", "nullptr", "operator",
+    "private", "protected", "public", "register", "reinterpret_cast", "return", "short", "signed",
+    "sizeof", "static", "static_assert", "static_cast", "struct", "switch", "template", "this",
+    "thread_local", "throw", "true", "try", "typedef", "typeid", "typename", "union", "unsigned",
+    "using", "virtual", "void", "volatile", "while"
+}
+# Never renamed
+RESERVED_NAMES = CPP_KEYWORDS | {"main"}
+
+def tokenize(source_code):
+    """C++ tokens without comments and whitespace, preprocessor lines collapsed."""
+    tokens = []
+    for match in TOKEN_RE.finditer(source_code):
+        kind = match.lastgroup
+        if kind in ("comment", "space"):
+            continue
+        text = match.group()
+        if kind == "preproc":
+            text = " ".join(text.replace("\\\n", " ").split())
+        tokens.append((kind, text))
+    return tokens
+
+def _type_start(tokens, j):
+    """Index of the first token of the type ending at tokens[j] (`std::vector<int>`, `unsigned long`), None if it is not one."""
+    kind, text = tokens[j]
+    if text == ">":
+        depth = 0
+        while j >= 0:
+            text = tokens[j][1]
+            if text in STATEMENT_BOUNDARIES:
+                return None
+            depth += {">": 1, "<": -1}.get(text, 0)
+            if depth == 0:
+                break
+            j -= 1
+        j -= 1
+        if j < 0:
+            return None
+        kind, text = tokens[j]
+    if kind != "ident" or (text in CPP_KEYWORDS and text not in TYPE_KEYWORDS):
+        return None
+    if text in TYPE_KEYWORDS:
+        while j > 0 and tokens[j - 1][1] in TYPE_KEYWORDS:
+            j -= 1
+    while j > 1 and tokens[j - 1][1] == ":" and tokens[j - 2][1] == ":":
+        j -= 2
+        if j > 0 and tokens[j - 1][0] == "ident":
+            j -= 1
+    return j
+
+def _in_declaration(tokens, i):
+    """Whether tokens[i] is the name in a declarator: `T x`, `T *x`, `const T &x`, `ns::T<U> x`."""
+    j = i - 1
+    pointer = False
+    while j >= 0 and (tokens[j][1] in ("*", "&") or tokens[j][1] in ("const", "volatile")):
+        pointer = pointer or tokens[j][1] in ("*", "&")
+        j -= 1
+    if j < 0:
+        return False
+    if not pointer and tokens[j][1] != ">":
+        # two names in a row are never an expression
+        return (tokens[j][0] == "ident" and tokens[j][1] not in CPP_KEYWORDS) or tokens[j][1] in DECLARATION_PREFIXES
+    start = _type_start(tokens, j)
+    if start is None:
+        return False
+    while start > 0 and tokens[start - 1][1] in DECLARATION_SPECIFIERS:
+        start -= 1
+    if start == 0 or tokens[start - 1][1] in STATEMENT_BOUNDARIES:
+        return True
+    # `(a * b` and `, a * b` are expressions unless the type is spelled with a keyword (parameters, for loops)
+    return tokens[start - 1][1] in ("(", ",") and tokens[start][1] in DECLARATION_PREFIXES
+
+def declared_identifiers(tokens):
+    """Names the file declares; an operand after `*`, `&` or `>` is only one in a declaration context."""
+    declared = set()
+    for i in range(1, len(tokens) - 1):
+        kind, text = tokens[i]
+        if kind != "ident" or text in RESERVED_NAMES:
+            continue
+        following = tokens[i + 1][1]
+        if following == ":" and i + 2 < len(tokens) and tokens[i + 2][1] == ":":
+            continue
+        if following in DECLARATION_SUFFIXES and _in_declaration(tokens, i):
+            declared.add(text)
+    return declared
+
+def normalize(source_code):
+    """Token stream with names declared in the file renamed in order of appearance.
+
+    Library names (printf, std::vector, ...) are not declared in the file and
+    keep their spelling, so two candidates only collide when they are the same
+    program up to comments, whitespace and a consistent renaming.
+    """
+    tokens = tokenize(source_code)
+    declared = declared_identifiers(tokens)
+    renamed = {}
+    normalized = []
+    for kind, text in tokens:
+        if kind == "ident" and text in declared:
+            text = renamed.setdefault(text, f"id{len(renamed)}")
+        normalized.append(text)
+    return normalized
+
+def source_digest(source_code):
+    return hashlib.sha256("\x00".join(normalize(source_code)).encode()).hexdigest()
+
+def binary_digest(binary_path):
+    """Hash of the executable with symbol names, build id and compiler comment stripped."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        stripped_path = os.path.join(tmp_dir, "stripped")
+        result = subprocess.run(
+            ["strip", "-s", "-R", ".note.gnu.build-id", "-R", ".comment", "-o", stripped_path, binary_path],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        path = stripped_path if result.returncode == 0 else binary_path
+        with open(path, "rb") as file:
+            return hashlib.sha256(file.read()).hexdigest()
+
+class CandidateIndex():
+    """Per-benchmark index of every candidate seen, persisted across runs.
+
+    Candidates are looked up by normalized source before compiling and by the
+    stripped executable after compiling; a hit returns the index entry of the
+    earlier candidate (its regression result and energy, for the log), and the
+    caller asks for a different candidate instead of running this one. Only
+    successful candidates are matched across runs, failures only within the
+    run (index instance) that recorded them.
+    """
+    def __init__(self, filename, index_path=None):
+        self.filename = filename
+        self.index_path = index_path or f"{out_dir(filename)}/candidate_index.json"
+        self.run_id = uuid.uuid4().hex
+        self.entries = []
+        self.by_source = {}
+        self.by_binary = {}
+        self.pending_binary = None
+        # entry of the earlier candidate found by the last lookup
+        self.last_match = None
+        if os.path.isfile(self.index_path):
+            with open(self.index_path, "r") as file:
+                for entry in json.load(file):
+                    self._add(entry)
+
+    def _add(self, entry):
+        self.entries.append(entry)
+        if entry["regression_result"] not in PERSISTENT_RESULTS and entry.get("run") != self.run_id:
+            return
+        self.by_source.setdefault(entry["source_digest"], entry)
+        if entry.get("binary_digest"):
+            self.by_binary.setdefault(entry["binary_digest"], entry)
+
+    def lookup_source(self, source_code):
+        self.pending_binary = None
+        self.last_match = self.by_source.get(source_digest(source_code))
+        return self.last_match
+
+    def check_binary(self, binary_path):
+        """Second-level check once the candidate has been compiled, None when there is no executable to hash."""
+        if not os.path.isfile(binary_path):
+            print(f"check_binary: no executable at {binary_path}, skipping the binary check")
+            self.pending_binary = None
+            self.last_match = None
+            return None
+        self.pending_binary = binary_digest(binary_path)
+        self.last_match = self.by_binary.get(self.pending_binary)
+        return self.last_match
+
+    def record(self, source_code, regression_result, iteration=None, avg_energy=None, avg_runtime=None):
+        entry = {
+            "source_digest": source_digest(source_code),
+            "binary_digest": self.pending_binary,
+            "regression_result": regression_result,
+            "iteration": iteration,
+            "avg_energy": avg_energy,
+            "avg_runtime": avg_runtime,
+            "run": self.run_id
+        }
+        self.pending_binary = None
+        self._add(entry)
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        with open(self.index_path, "w") as file:
+            json.dump(self.entries, file, indent=4)
+        return entry
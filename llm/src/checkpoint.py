@@ -0,0 +1,103 @@
+from dotenv import load_dotenv
+import os
+import pickle
+import sys
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from energy.src.registry import out_dir
+
+load_dotenv()
+USER_PREFIX = os.getenv('USER_PREFIX')
+
+CHECKPOINT_DIR = f"{USER_PREFIX}/llm/checkpoints"
+EVALUATOR_FEEDBACK_FILE = f"{USER_PREFIX}/energy/src/evaluator_feedback.txt"
+
+# Stages of one master_script iteration, in execution order
+STAGES = ["optimize", "fix_compilation", "regression_test", "measure", "evaluate"]
+
+def benchmark_paths(filename):
+    name = filename.split('.')[0]
+    suffix = '.'.join(filename.split('.')[1:])
+    directory = out_dir(filename)
+    return {
+        "optimized": f"{directory}/optimized_{filename}",
+        "compiled": f"{directory}/{name}.compiled.{suffix}"
+    }
+
+def checkpoint_dir(filename):
+    return f"{CHECKPOINT_DIR}/{filename.split('.')[0]}"
+
+def _read_file(path):
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r") as file:
+        return file.read()
+
+def _write_file(path, content):
+    if content is None:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        file.write(content)
+
+def _atomic_pickle(path, data):
+    # write-then-rename so a crash mid-write never corrupts the last checkpoint
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        pickle.dump(data, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+def save_checkpoint(filename, stage, loop_state, policy_state, usage, benchmark_data, benchmark_metrics):
+    """Persist everything master_script needs to continue at `stage`."""
+    if stage not in STAGES:
+        raise ValueError(f"Unknown checkpoint stage: {stage}")
+
+    paths = benchmark_paths(filename)
+    checkpoint = {
+        "filename": filename,
+        "stage": stage,
+        "saved_at": time.time(),
+        "loop_state": dict(loop_state),
+        "policy_state": policy_state,
+        "usage": usage,
+        "benchmark_data": dict(benchmark_data),
+        "benchmark_metrics": dict(benchmark_metrics),
+        # current candidate, latest working (best-so-far) source and evaluator feedback
+        "optimized_source": _read_file(paths["optimized"]),
+        "compiled_source": _read_file(paths["compiled"]),
+        "evaluator_feedback": _read_file(EVALUATOR_FEEDBACK_FILE)
+    }
+
+    directory = checkpoint_dir(filename)
+    os.makedirs(directory, exist_ok=True)
+    _atomic_pickle(f"{directory}/checkpoint.pkl", checkpoint)
+
+    # keep one durable snapshot per successful iteration
+    if stage == "optimize":
+        _atomic_pickle(f"{directory}/iteration_{loop_state['success']}.pkl", checkpoint)
+    return checkpoint
+
+def load_checkpoint(filename):
+    path = f"{checkpoint_dir(filename)}/checkpoint.pkl"
+    if not os.path.isfile(path):
+        return None
+    with open(path, "rb") as file:
+        return pickle.load(file)
+
+def restore_files(checkpoint):
+    """Put the checkpointed sources and evaluator feedback back on disk."""
+    paths = benchmark_paths(checkpoint["filename"])
+    _write_file(paths["optimized"], checkpoint["optimized_source"])
+    _write_file(paths["compiled"], checkpoint["compiled_source"])
+    if checkpoint["evaluator_feedback"] is None:
+        if os.path.isfile(EVALUATOR_FEEDBACK_FILE):
+            os.remove(EVALUATOR_FEEDBACK_FILE)
+    else:
+        _write_file(EVALUATOR_FEEDBACK_FILE, checkpoint["evaluator_feedback"])
+
+def clear_checkpoint(filename):
+    path = f"{checkpoint_dir(filename)}/checkpoint.pkl"
+    if os.path.isfile(path):
+        os.remove(path)
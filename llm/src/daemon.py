@@ -0,0 +1,276 @@
+import itertools
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+from llm_clients import request_loop, warm_ollama_model
+from llm_usage import get_usage
+import main
+from termination import TerminationPolicy
+from utils import setup_logger
+
+load_dotenv()
+USER_PREFIX = os.getenv('USER_PREFIX')
+
+DAEMON_HOST = os.getenv("DAEMON_HOST", "127.0.0.1")
+DAEMON_PORT = int(os.getenv("DAEMON_PORT", 8765))
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# TerminationPolicy settings a job may override
+POLICY_FIELDS = ("max_iterations", "convergence_window", "noise_factor", "max_wall_time", "max_tokens", "max_cost", "max_energy")
+
+class JobQueue():
+    """Optimization jobs by priority (higher first, then submission order), run one at a time.
+
+    Runs share the process working directory, the benchmark_data pickles and
+    the benchmarks_out directories, so a single worker executes them in turn
+    while the model clients stay warm between jobs.
+    """
+    def __init__(self):
+        self.jobs = {}
+        self.queue = queue.PriorityQueue()
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def submit(self, benchmark, model_name, options=(), priority=0, policy=None):
+        if benchmark not in main.valid_benchmarks:
+            raise ValueError(f"invalid benchmark '{benchmark}'")
+        unknown = set(policy or {}) - set(POLICY_FIELDS)
+        if unknown:
+            raise ValueError(f"unknown policy settings {sorted(unknown)}")
+        with self.lock:
+            job_id = next(self.ids)
+            self.jobs[job_id] = {
+                "id": job_id,
+                "benchmark": benchmark,
+                "model": model_name,
+                "options": list(options),
+                "priority": priority,
+                "policy": policy or {},
+                "status": QUEUED,
+                "submitted": time.time(),
+                "started": None,
+                "finished": None,
+                "log": None,
+                "result": None,
+                "error": None
+            }
+        self.queue.put((-priority, job_id))
+        return self.status(job_id)
+
+    def cancel(self, job_id):
+        """Only queued jobs can be cancelled, a running job finishes its run."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] != QUEUED:
+                return False
+            job["status"] = CANCELLED
+            job["finished"] = time.time()
+            return True
+
+    def next(self):
+        while True:
+            _, job_id = self.queue.get()
+            with self.lock:
+                job = self.jobs[job_id]
+                if job["status"] == QUEUED:
+                    job["status"] = RUNNING
+                    job["started"] = time.time()
+                    return job
+
+    def finish(self, job, result=None, error=None):
+        with self.lock:
+            job["status"] = FAILED if error is not None else DONE
+            job["finished"] = time.time()
+            job["result"] = result
+            job["error"] = error
+
+    def status(self, job_id=None):
+        with self.lock:
+            jobs = [self.jobs[job_id]] if job_id is not None else list(self.jobs.values())
+            snapshots = [dict(job) for job in jobs]
+        for snapshot in snapshots:
+            if snapshot["status"] == RUNNING:
+                snapshot["progress"] = progress()
+            snapshot["position"] = self._position(snapshot)
+        return snapshots[0] if job_id is not None else snapshots
+
+    def _position(self, snapshot):
+        """Queued jobs ahead of this one, None once it started."""
+        if snapshot["status"] != QUEUED:
+            return None
+        with self.lock:
+            return sum(1 for job in self.jobs.values() if job["status"] == QUEUED and (-job["priority"], job["id"]) < (-snapshot["priority"], snapshot["id"]))
+
+def progress():
+    """Versions measured so far by the running job, as they land in benchmark_data."""
+    versions = {key: {"avg_energy": value[1], "avg_runtime": value[2]} for key, value in list(main.benchmark_data.items())}
+    usage = get_usage()
+    return {"versions": versions, "llm_calls": usage["calls"], "tokens": usage["prompt_tokens"] + usage["completion_tokens"]}
+
+def warm_client(model_name):
+    """The client a run uses, created (and for Ollama pulled and loaded) once per daemon."""
+    request_loop()
+    if model_name == "openai":
+        return model_name
+    return warm_ollama_model(model_name)
+
+def run_job(job):
+    policy = TerminationPolicy.from_env()
+    for key, value in job["policy"].items():
+        setattr(policy, key, value)
+    log_handler = logging.FileHandler(main.run_log_path(job["benchmark"]), mode='w')
+    log_handler.setFormatter(logging.Formatter('%(asctime)s : %(levelname)s : %(message)s', datefmt='%m/%d/%y %I:%M:%S %p'))
+    logging.getLogger().addHandler(log_handler)
+    job["log"] = os.path.abspath(log_handler.baseFilename)
+    cwd = os.getcwd()
+    try:
+        client = warm_client(job["model"])
+        main.logger.info(f"daemon: job {job['id']}, running benchmark: {job['benchmark']}")
+        return main.run_benchmark(job["benchmark"], client, job["model"], job["options"], policy)
+    finally:
+        # the stages change directory, the next job starts where this one did
+        os.chdir(cwd)
+        logging.getLogger().removeHandler(log_handler)
+        log_handler.close()
+
+def worker(jobs):
+    while True:
+        job = jobs.next()
+        try:
+            result = run_job(job)
+        except BaseException as e:
+            # a failing run (including sys.exit in a stage) must not take the daemon down
+            logging.getLogger().error(f"daemon: job {job['id']} failed: {e!r}")
+            jobs.finish(job, error=traceback.format_exc())
+            continue
+        jobs.finish(job, result=result)
+        logging.getLogger().info(f"daemon: job {job['id']} done, {result['termination_reason']}")
+
+def make_handler(jobs):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body):
+            data = json.dumps(body, default=str).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _job_id(self):
+            try:
+                return int(self.path.rstrip("/").split("/")[2])
+            except (IndexError, ValueError):
+                return None
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/jobs":
+                self._send(200, jobs.status())
+                return
+            job_id = self._job_id()
+            if self.path.startswith("/jobs/") and job_id in jobs.jobs:
+                self._send(200, jobs.status(job_id))
+                return
+            self._send(404, {"error": f"no such job or endpoint {self.path}"})
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/jobs":
+                self._send(404, {"error": f"unknown endpoint {self.path}"})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                job = jobs.submit(request["benchmark"], request["model"], request.get("options", []), int(request.get("priority", 0)), request.get("policy"))
+            except (KeyError, ValueError) as e:
+                self._send(400, {"error": str(e)})
+                return
+            self._send(201, job)
+
+        def do_DELETE(self):
+            job_id = self._job_id()
+            if job_id not in jobs.jobs:
+                self._send(404, {"error": f"no such job {self.path}"})
+            elif jobs.cancel(job_id):
+                self._send(200, jobs.status(job_id))
+            else:
+                self._send(409, {"error": f"job {job_id} is {jobs.status(job_id)['status']}, only queued jobs can be cancelled"})
+    return Handler
+
+def serve(models=()):
+    """Accept jobs on DAEMON_HOST:DAEMON_PORT until interrupted; models are warmed up front."""
+    setup_logger(main.run_log_path("daemon"))
+    for model_name in models:
+        warm_client(model_name)
+        logging.getLogger().info(f"daemon: {model_name} warm")
+    jobs = JobQueue()
+    threading.Thread(target=worker, args=(jobs,), daemon=True).start()
+    server = ThreadingHTTPServer((DAEMON_HOST, DAEMON_PORT), make_handler(jobs))
+    logging.getLogger().info(f"daemon: accepting jobs on http://{DAEMON_HOST}:{DAEMON_PORT}/jobs")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+def request(method, path, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    http_request = urllib.request.Request(f"http://{DAEMON_HOST}:{DAEMON_PORT}{path}", data=data, method=method, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(http_request) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        return json.load(e)
+
+def print_jobs(jobs):
+    print(f"{'id':>4} {'status':10} {'priority':>8} {'benchmark':28} {'model':16} {'versions':>8} {'termination':>16}")
+    for job in jobs:
+        versions = len(job.get("progress", {}).get("versions", {})) if job["status"] == RUNNING else ""
+        reason = (job["result"] or {}).get("termination_reason") or ""
+        print(f"{job['id']:>4} {job['status']:10} {job['priority']:>8} {job['benchmark']:28} {job['model']:16} {versions:>8} {reason:>16}")
+
+if __name__ == "__main__":
+    # python3 llm/src/daemon.py serve [model ...]
+    # python3 llm/src/daemon.py submit <benchmark> <model> [options ...] [--priority N]
+    # python3 llm/src/daemon.py status [job id] | wait <job id> | cancel <job id>
+    command = sys.argv[1] if len(sys.argv) > 1 else "status"
+    if command == "serve":
+        serve(sys.argv[2:])
+    elif command == "submit":
+        args = sys.argv[2:]
+        priority = 0
+        if "--priority" in args:
+            index = args.index("--priority")
+            priority = int(args[index + 1])
+            del args[index:index + 2]
+        print(json.dumps(request("POST", "/jobs", {"benchmark": args[0], "model": args[1], "options": args[2:], "priority": priority}), indent=4))
+    elif command == "status" and len(sys.argv) > 2:
+        print(json.dumps(request("GET", f"/jobs/{sys.argv[2]}"), indent=4))
+    elif command == "status":
+        print_jobs(request("GET", "/jobs"))
+    elif command == "wait":
+        while True:
+            job = request("GET", f"/jobs/{sys.argv[2]}")
+            if "status" not in job or job["status"] in (DONE, FAILED, CANCELLED):
+                print(json.dumps(job, indent=4))
+                break
+            time.sleep(5)
+    elif command == "cancel":
+        print(json.dumps(request("DELETE", f"/jobs/{sys.argv[2]}"), indent=4))
+    else:
+        print(f"daemon: unknown command {command}")
+        sys.exit(1)
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+load_dotenv()
+USER_PREFIX = os.getenv('USER_PREFIX')
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from energy.src.registry import output_digest, run_command, stdin_path
+from energy.src.sandbox import Limits, run_sandboxed
+import tracing
+
+REFERENCE_DIR = f"{USER_PREFIX}/llm/reference_outputs"
+# Wall-clock limit of one run on a test input, in seconds
+DIFFERENTIAL_TIMEOUT = float(os.getenv("DIFFERENTIAL_TIMEOUT", 10))
+# Parallel runs; by default one per cpu for serial benchmarks and one at a time for multithreaded ones,
+# which would otherwise start cpu_count threads each
+DIFFERENTIAL_JOBS = int(os.getenv("DIFFERENTIAL_JOBS")) if os.getenv("DIFFERENTIAL_JOBS") else None
+# Characters of each output written to the regression log on a difference
+LOG_OUTPUT_CHARS = 2000
+
+def differential_jobs(entry):
+    if DIFFERENTIAL_JOBS is not None:
+        return DIFFERENTIAL_JOBS
+    return (os.cpu_count() or 1) if entry["threading"] == "none" else 1
+
+def _file_digest(path):
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+def reference_key(entry, source_path, test_input, stdin_file):
+    """Cache key of the original's output: source, build flags, arguments and stdin contents."""
+    key = hashlib.sha256()
+    key.update(_file_digest(source_path).encode())
+    key.update(json.dumps([entry["compile_flags"], entry["link_flags"], entry["libraries"], test_input["args"]]).encode())
+    if stdin_file is not None:
+        key.update(_file_digest(stdin_file).encode())
+    return key.hexdigest()
+
+def _run(entry, exec_path, test_input, stdin_file, limits):
+    return run_sandboxed(run_command(entry, exec_path, test_input), limits, stdin_file)
+
+def reference_outputs(entry, original_exec, source_path, stdin_files):
+    """Name -> reference (returncode, digest, output file) of the original on every test input.
+
+    References are stored in llm/reference_outputs/<benchmark> by reference_key,
+    so the original only runs on inputs it has not seen. Inputs the original
+    cannot finish within the limits get no reference and are left out.
+    """
+    directory = f"{REFERENCE_DIR}/{entry['name']}"
+    os.makedirs(directory, exist_ok=True)
+    references, missing = {}, {}
+    for name, test_input in entry["test_inputs"].items():
+        key = reference_key(entry, source_path, test_input, stdin_files[name])
+        if os.path.isfile(f"{directory}/{key}.json"):
+            with open(f"{directory}/{key}.json", "r") as file:
+                references[name] = json.load(file)
+            references[name]["cached"] = True
+        else:
+            missing[name] = key
+
+    limits = Limits.from_footprint(None, DIFFERENTIAL_TIMEOUT)
+    with ThreadPoolExecutor(max_workers=differential_jobs(entry)) as pool:
+        runs = dict(zip(missing, pool.map(lambda name: _run(entry, original_exec, entry["test_inputs"][name], stdin_files[name], limits), missing)))
+    for name, result in runs.items():
+        if result.violation is not None:
+            print(f"differential_test: original exceeded the {result.violation} limit on {name}, input skipped")
+            continue
+        key = missing[name]
+        with open(f"{directory}/{key}.out", "wb") as file:
+            file.write(result.stdout)
+        references[name] = {"input": name, "returncode": result.returncode, "digest": output_digest(result.stdout), "output_file": f"{directory}/{key}.out"}
+        with open(f"{directory}/{key}.json", "w") as file:
+            json.dump(references[name], file)
+    return references
+
+def differential_test(entry, original_exec, optimized_exec, source_path, footprint=None):
+    """Run the candidate on every test input of the registry in parallel and compare with the original.
+
+    Returns the failures, each a dict with the input name, the kind
+    ("limit", "exit" or "output"), the violated limit, and both outputs.
+    Inputs the original rejects (non-zero exit) are not compared.
+    """
+    if not entry.get("test_inputs"):
+        return []
+    with tracing.span("differential_test", inputs=len(entry["test_inputs"])) as test_span:
+        failures = _differential_test(entry, original_exec, optimized_exec, source_path, footprint, test_span)
+        test_span["failures"] = len(failures)
+    return failures
+
+def _differential_test(entry, original_exec, optimized_exec, source_path, footprint, test_span):
+    # generated stdin files are written before the runs start
+    stdin_files = {name: stdin_path(entry, test_input, os.path.dirname(original_exec)) for name, test_input in entry["test_inputs"].items()}
+    references = reference_outputs(entry, original_exec, source_path, stdin_files)
+    test_span["reference_cache_hits"] = sum(1 for reference in references.values() if reference.get("cached"))
+    test_span["cache_hit"] = test_span.attributes["reference_cache_hits"] == len(entry["test_inputs"])
+
+    limits = Limits.from_footprint(footprint, DIFFERENTIAL_TIMEOUT)
+    names = [name for name, reference in references.items() if reference["returncode"] == 0]
+    with ThreadPoolExecutor(max_workers=differential_jobs(entry)) as pool:
+        results = pool.map(lambda name: _run(entry, optimized_exec, entry["test_inputs"][name], stdin_files[name], limits), names)
+
+    failures = []
+    for name, result in zip(names, results):
+        reference = references[name]
+        failure = None
+        if result.violation is not None:
+            failure = "limit"
+        elif result.returncode != 0:
+            failure = "exit"
+        elif output_digest(result.stdout) != reference["digest"]:
+            failure = "output"
+        if failure is None:
+            continue
+        with open(reference["output_file"], "rb") as file:
+            expected = file.read()
+        failures.append({
+            "input": name,
+            "args": entry["test_inputs"][name]["args"],
+            "stdin": entry["test_inputs"][name].get("stdin", {}).get("file"),
+            "kind": failure,
+            "violation": result.violation,
+            "returncode": result.returncode,
+            "expected": expected.decode(errors="replace")[:LOG_OUTPUT_CHARS],
+            "actual": (result.stdout or result.stderr).decode(errors="replace")[:LOG_OUTPUT_CHARS]
+        })
+    print(f"differential_test: {len(names) - len(failures)}/{len(names)} test inputs passed")
+    return failures
+
+def write_failures(output_log, failures):
+    for failure in failures:
+        description = f"Optimized program failed on test input {failure['input']} (args {' '.join(failure['args'])}"
+        if failure["stdin"] is not None:
+            description += f", stdin {failure['stdin']}"
+        description += ")"
+        if failure["kind"] == "limit":
+            output_log.write(f"{description}: exceeded the {failure['violation']} limit.\n")
+        elif failure["kind"] == "exit":
+            output_log.write(f"{description}: exit code {failure['returncode']}, the original exits with 0.\n")
+            output_log.write(f"Optimized program output:\n{failure['actual']}\n\n")
+        else:
+            output_log.write(f"{description}: outputs are different.\n")
+            output_log.write(f"Original program output:\n{failure['expected']}\n")
+            output_log.write(f"Optimized program output:\n{failure['actual']}\n\n")
@@ -0,0 +1,262 @@
+from collections import Counter
+import difflib
+import glob
+import hashlib
+import json
+import math
+import os
+import sys
+import threading
+import time
+from dotenv import load_dotenv
+from candidate_index import CPP_KEYWORDS, tokenize
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from energy.src.registry import get_benchmark, match_benchmark, read_result_file
+
+load_dotenv()
+USER_PREFIX = os.getenv('USER_PREFIX')
+
+KNOWLEDGE_PATH = os.getenv("KNOWLEDGE_PATH", f"{USER_PREFIX}/llm/knowledge_base.jsonl")
+# Proven transformations and past failures put into each optimization prompt
+KNOWLEDGE_EXAMPLES = int(os.getenv("KNOWLEDGE_EXAMPLES", 3))
+KNOWLEDGE_FAILURES = int(os.getenv("KNOWLEDGE_FAILURES", 2))
+# Relative energy reduction a transformation needs to count as proven
+KNOWLEDGE_MIN_GAIN = float(os.getenv("KNOWLEDGE_MIN_GAIN", 0.02))
+# Diff lines stored per transformation, and shown per example and per failure
+MAX_DIFF_LINES = 80
+EXAMPLE_DIFF_LINES = 40
+FAILURE_DIFF_LINES = 12
+# Transformations of the benchmark being optimized rank this much higher
+SAME_BENCHMARK_BOOST = 2.0
+# Identifiers inside loop bodies weigh this much more in the query
+LOOP_WEIGHT = 3
+
+# Outcomes, from the regression test result
+IMPROVED = "improved"
+NO_GAIN = "no_gain"
+UNMEASURED = "unmeasured"
+OUTCOMES = {-1: "compile_error", 0: "output_differs", 3: "limit_exceeded"}
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def terms(text):
+    """Identifiers of C++ text, keywords included; the same terms for documents and queries."""
+    return [token for kind, token in tokenize(text) if kind == "ident"]
+
+def hot_terms(source_code):
+    """Query terms of a source, identifiers inside loop bodies weighted LOOP_WEIGHT times.
+
+    Without a profile the loop nests are where the time goes.
+    """
+    weights = Counter()
+    braces = []
+    parens = 0
+    # a loop header was seen and its body has not started yet
+    loop_pending = False
+    for kind, token in tokenize(source_code):
+        if kind == "ident" and token in ("for", "while", "do"):
+            loop_pending = True
+        elif token == "(":
+            parens += 1
+        elif token == ")":
+            parens = max(0, parens - 1)
+        elif token == "{":
+            braces.append(loop_pending)
+            loop_pending = False
+        elif token == "}" and braces:
+            braces.pop()
+        elif token == ";" and parens == 0:
+            loop_pending = False
+        if kind == "ident" and token not in CPP_KEYWORDS:
+            weights[token] += LOOP_WEIGHT if loop_pending or any(braces) else 1
+    return weights
+
+def benchmark_name(benchmark):
+    """Registry name of a benchmark or pipeline file name, unknown names are kept."""
+    try:
+        return get_benchmark(benchmark)["name"]
+    except KeyError:
+        return benchmark
+
+def error_summary(output):
+    """First compiler error line of a build log, the reason stored with a compile error."""
+    for line in output.splitlines():
+        if "error" in line:
+            return line.strip()[:200]
+    return None
+
+def source_diff(base_source, source):
+    lines = list(difflib.unified_diff(base_source.splitlines(), source.splitlines(), "before", "after", n=2, lineterm=""))
+    return lines[2:]
+
+class KnowledgeBase():
+    """Transformations of earlier runs, one JSON line each, with a BM25 index over their diffs.
+
+    Every tested candidate is recorded: the diff from the version it was
+    generated from, the benchmark and model, and either the measured energy
+    and runtime deltas or why it failed. The file is reloaded when another
+    process appended to it.
+    """
+    def __init__(self, path=KNOWLEDGE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = []
+        self.keys = set()
+        self.mtime = None
+        self.postings = {}
+        self.lengths = []
+
+    def _index(self, entry):
+        if entry["key"] in self.keys:
+            return
+        self.keys.add(entry["key"])
+        document = Counter(terms("\n".join(line[1:] for line in entry["diff"])))
+        index = len(self.entries)
+        self.entries.append(entry)
+        self.lengths.append(sum(document.values()))
+        for term, count in document.items():
+            self.postings.setdefault(term, []).append((index, count))
+
+    def load(self):
+        """(Re)read the file when it changed since the last load."""
+        with self.lock:
+            if not os.path.isfile(self.path):
+                return
+            mtime = os.path.getmtime(self.path)
+            if mtime == self.mtime:
+                return
+            with open(self.path, "r") as file:
+                for line in file:
+                    if line.strip():
+                        self._index(json.loads(line))
+            self.mtime = mtime
+
+    def record(self, benchmark, model_name, base_source, source, regression_result, base=None, current=None, reason=None, origin="run"):
+        """Add a tested candidate; base and current are (avg_energy, avg_runtime) of the two versions when measured."""
+        diff = source_diff(base_source, source)
+        if not diff:
+            return None
+        benchmark = benchmark_name(benchmark)
+        entry = {
+            "key": hashlib.sha256(json.dumps([benchmark, diff]).encode()).hexdigest()[:16],
+            "time": round(time.time(), 3),
+            "benchmark": benchmark,
+            "model": model_name,
+            "origin": origin,
+            "diff": diff[:MAX_DIFF_LINES],
+            "diff_lines": len(diff),
+            "energy_delta": None,
+            "runtime_delta": None,
+            "reason": reason
+        }
+        if regression_result == 1 and base and current and base[0]:
+            entry["energy_delta"] = round(current[0] / base[0] - 1, 4)
+            entry["runtime_delta"] = round(current[1] / base[1] - 1, 4) if base[1] else None
+            entry["outcome"] = IMPROVED if entry["energy_delta"] <= -KNOWLEDGE_MIN_GAIN else NO_GAIN
+        elif regression_result == 1:
+            entry["outcome"] = UNMEASURED
+        else:
+            entry["outcome"] = OUTCOMES.get(regression_result, f"result_{regression_result}")
+        self.load()
+        with self.lock:
+            if entry["key"] in self.keys:
+                return None
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a") as file:
+                file.write(json.dumps(entry) + "\n")
+            self._index(entry)
+            self.mtime = os.path.getmtime(self.path)
+        return entry
+
+    def search(self, source_code, benchmark=None, outcomes=(IMPROVED,), limit=KNOWLEDGE_EXAMPLES):
+        """Entries with one of the outcomes, best BM25 match of the diff against the hot code first."""
+        self.load()
+        with self.lock:
+            count = len(self.entries)
+            if count == 0:
+                return []
+            average_length = sum(self.lengths) / count or 1.0
+            scores = Counter()
+            for term, weight in hot_terms(source_code).items():
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for index, frequency in postings:
+                    normalization = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[index] / average_length)
+                    scores[index] += weight * idf * frequency * (BM25_K1 + 1) / (frequency + normalization)
+            ranked = []
+            for index, score in scores.items():
+                entry = self.entries[index]
+                if entry["outcome"] not in outcomes:
+                    continue
+                if entry["benchmark"] == benchmark:
+                    score *= SAME_BENCHMARK_BOOST
+                ranked.append((score, entry))
+        ranked.sort(key=lambda item: -item[0])
+        return [entry for _, entry in ranked[:limit]]
+
+    def prompt_section(self, source_code, benchmark=None):
+        """Prompt text with the most relevant proven transformations and this benchmark's closest failures."""
+        benchmark = benchmark_name(benchmark) if benchmark else None
+        examples = self.search(source_code, benchmark, (IMPROVED,), KNOWLEDGE_EXAMPLES)
+        failures = [entry for entry in self.search(source_code, benchmark, tuple(OUTCOMES.values()), KNOWLEDGE_FAILURES * 3) if entry["benchmark"] == benchmark][:KNOWLEDGE_FAILURES]
+        if not examples and not failures:
+            return ""
+        section = ""
+        if examples:
+            section += "\nThese transformations measurably reduced energy in earlier runs, the ones most relevant to this code first. Reuse their ideas where they apply:\n"
+            for number, entry in enumerate(examples, 1):
+                runtime = f", {entry['runtime_delta']:+.1%} runtime" if entry["runtime_delta"] is not None else ""
+                section += f"{number}. {entry['benchmark']} ({entry['energy_delta']:+.1%} energy{runtime}):\n```diff\n" + "\n".join(entry["diff"][:EXAMPLE_DIFF_LINES]) + "\n```\n"
+        if failures:
+            section += "\nThese changes to this program failed before, do not repeat them:\n"
+            for entry in failures:
+                reason = entry["outcome"].replace("_", " ") + (f" ({entry['reason']})" if entry["reason"] else "")
+                section += f"- {reason}:\n```diff\n" + "\n".join(entry["diff"][:FAILURE_DIFF_LINES]) + "\n```\n"
+        return section
+
+    def stats(self):
+        self.load()
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "outcomes": dict(Counter(entry["outcome"] for entry in self.entries)),
+                "benchmarks": dict(Counter(entry["benchmark"] for entry in self.entries))
+            }
+
+knowledge_base = KnowledgeBase()
+
+def import_results(root):
+    """Record the consecutive versions of every result file under root (test_results/<benchmark>/result_file_*.txt)."""
+    imported = 0
+    for path in sorted(glob.glob(f"{root}/*/result_file_*.txt")):
+        benchmark = match_benchmark(os.path.basename(os.path.dirname(path)))
+        try:
+            versions, _ = read_result_file(path)
+        except ValueError:
+            print(f"import_results: {path} has no results, skipped")
+            continue
+        keys = sorted(versions)
+        # each version was generated from the previous successful one
+        for previous, key in zip(keys, keys[1:]):
+            base_source, base_energy, base_runtime = versions[previous]
+            source, energy, runtime = versions[key]
+            if knowledge_base.record(benchmark, None, base_source, source, 1, (base_energy, base_runtime), (energy, runtime), origin=path) is not None:
+                imported += 1
+    return imported
+
+if __name__ == "__main__":
+    # python3 llm/src/knowledge_base.py import [test_results]
+    # python3 llm/src/knowledge_base.py stats
+    # python3 llm/src/knowledge_base.py query <source file> [benchmark]
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if command == "import":
+        root = sys.argv[2] if len(sys.argv) > 2 else f"{USER_PREFIX}/test_results"
+        print(f"knowledge_base: imported {import_results(root)} transformations from {root}")
+    elif command == "query":
+        with open(sys.argv[2], "r") as file:
+            print(knowledge_base.prompt_section(file.read(), sys.argv[3] if len(sys.argv) > 3 else None))
+    else:
+        print(json.dumps(knowledge_base.stats(), indent=4))
@@ -0,0 +1,272 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from dotenv import load_dotenv
+import httpx
+import openai
+from ollama import AsyncClient, Client, ResponseError
+from openai import AsyncOpenAI
+from llm_usage import record_openai_usage, record_ollama_usage
+import tracing
+
+load_dotenv()
+openai_key = os.getenv('API_KEY')
+
+OPENAI_MODEL = "gpt-4o-2024-08-06"
+# How long Ollama keeps a model loaded after a request (duration string or seconds, -1 keeps it loaded)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+
+# Seconds one request may take before it is abandoned and retried
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 600))
+# Retries per provider, with full-jitter exponential backoff between LLM_BACKOFF_BASE and LLM_BACKOFF_MAX seconds
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 6))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", 1.0))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", 60.0))
+# Providers tried in order once the requested one keeps failing, e.g. "openai,ollama:llama3.1:latest@http://gpu-box:11434"
+LLM_FAILOVER = [target.strip() for target in os.getenv("LLM_FAILOVER", "").split(",") if target.strip()]
+# Requests and tokens per minute (0: unlimited) and requests in flight, per provider
+PROVIDER_LIMITS = {
+    "openai": {"rpm": int(os.getenv("OPENAI_RPM", 500)), "tpm": int(os.getenv("OPENAI_TPM", 30000)), "concurrency": int(os.getenv("OPENAI_CONCURRENCY", 4))},
+    "ollama": {"rpm": int(os.getenv("OLLAMA_RPM", 0)), "tpm": int(os.getenv("OLLAMA_TPM", 0)), "concurrency": int(os.getenv("OLLAMA_CONCURRENCY", 2))}
+}
+# Completion tokens reserved per request until the response reports what it used
+COMPLETION_TOKEN_ESTIMATE = int(os.getenv("COMPLETION_TOKEN_ESTIMATE", 2000))
+
+_lock = threading.Lock()
+clients = {
+    "ollama": {}
+}
+# Ollama models pulled and loaded by this process
+warm_models = set()
+
+def ollama_client(host=None):
+    host = host or OLLAMA_HOST
+    with _lock:
+        if host not in clients["ollama"]:
+            clients["ollama"][host] = Client(host=host)
+        return clients["ollama"][host]
+
+def warm_ollama_model(model_name, host=None):
+    """Pull the model and load it with OLLAMA_KEEP_ALIVE, once per process; raises when the model is unknown."""
+    host = host or OLLAMA_HOST
+    client = ollama_client(host)
+    if (host, model_name) in warm_models:
+        return client
+    client.pull(model_name)
+    # an empty prompt only loads the model
+    client.generate(model=model_name, prompt="", keep_alive=OLLAMA_KEEP_ALIVE)
+    warm_models.add((host, model_name))
+    return client
+
+def _ollama_host(client):
+    """Host of an Ollama client made by ollama_client."""
+    with _lock:
+        for host, known in clients["ollama"].items():
+            if known is client:
+                return host
+    return OLLAMA_HOST
+
+# Request layer: every optimizer and evaluator call runs on one asyncio loop in a background thread
+
+class Target():
+    """A provider and model a request can go to."""
+    def __init__(self, provider, model, host=None):
+        self.provider = provider
+        self.model = model
+        self.host = host
+
+    def __str__(self):
+        return self.provider if self.provider == "openai" else f"ollama:{self.model}@{self.host}"
+
+    @classmethod
+    def parse(cls, text):
+        """'openai' or 'ollama:<model>[@<host>]'."""
+        if text == "openai":
+            return cls("openai", OPENAI_MODEL)
+        if not text.startswith("ollama:"):
+            raise ValueError(f"Target.parse: unknown provider in '{text}'")
+        model, _, host = text[len("ollama:"):].partition("@")
+        return cls("ollama", model, host or OLLAMA_HOST)
+
+class Completion():
+    def __init__(self, text, parsed, target):
+        self.text = text
+        # the response_format object, only OpenAI structured outputs have one
+        self.parsed = parsed
+        self.target = target
+        # requests sent, over all targets tried
+        self.attempts = 0
+        self.rate_limit_wait = 0.0
+
+class TokenBucket():
+    """per_minute units that refill continuously; 0 is unlimited. Only used on the request loop."""
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    async def acquire(self, amount):
+        """Take amount (at most the capacity), returns the seconds waited for it."""
+        if not self.capacity:
+            return 0.0
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            self._refill()
+            if self.level >= amount:
+                self.level -= amount
+                return waited
+            delay = (amount - self.level) * 60 / self.capacity
+            await asyncio.sleep(delay)
+            waited += delay
+
+    def adjust(self, amount):
+        """Charge (or refund, when negative) what a reservation got wrong."""
+        if self.capacity:
+            self._refill()
+            self.level = min(self.capacity, self.level - amount)
+
+class ProviderLimiter():
+    def __init__(self, limits):
+        self.requests = TokenBucket(limits["rpm"])
+        self.tokens = TokenBucket(limits["tpm"])
+        self.in_flight = asyncio.Semaphore(max(1, limits["concurrency"]))
+        # a rate limit answer pauses every request to the provider until then
+        self.resume_at = 0.0
+
+    async def acquire(self, tokens):
+        waited = 0.0
+        while time.monotonic() < self.resume_at:
+            delay = self.resume_at - time.monotonic()
+            await asyncio.sleep(delay)
+            waited += delay
+        waited += await self.requests.acquire(1)
+        waited += await self.tokens.acquire(tokens)
+        return waited
+
+    def pause(self, seconds):
+        self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+_loop = {"loop": None, "limiters": {}, "openai": None, "ollama": {}}
+
+def request_loop():
+    """The loop all requests run on, started once per process."""
+    with _lock:
+        if _loop["loop"] is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="llm-requests", daemon=True).start()
+            _loop["loop"] = loop
+        return _loop["loop"]
+
+def _limiter(provider):
+    # created on the loop, where the semaphore is used
+    if provider not in _loop["limiters"]:
+        _loop["limiters"][provider] = ProviderLimiter(PROVIDER_LIMITS[provider])
+    return _loop["limiters"][provider]
+
+def _async_openai():
+    """One OpenAI client per process, so its HTTP connection pool is reused across calls."""
+    if _loop["openai"] is None:
+        # retries are done here; an own httpx client keeps the pool on the loop
+        _loop["openai"] = AsyncOpenAI(api_key=openai_key, max_retries=0, http_client=httpx.AsyncClient(timeout=LLM_TIMEOUT))
+    return _loop["openai"]
+
+def _async_ollama(host):
+    if host not in _loop["ollama"]:
+        _loop["ollama"][host] = AsyncClient(host=host, timeout=LLM_TIMEOUT)
+    return _loop["ollama"][host]
+
+def _estimate_tokens(messages):
+    return sum(len(message["content"]) for message in messages) // 4 + COMPLETION_TOKEN_ESTIMATE
+
+def _retryable(error):
+    if isinstance(error, (asyncio.TimeoutError, httpx.TransportError, ConnectionError, openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    return isinstance(error, ResponseError) and (error.status_code == 429 or error.status_code >= 500)
+
+def _rate_limited(error):
+    return isinstance(error, openai.RateLimitError) or (isinstance(error, ResponseError) and error.status_code == 429)
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after")) if response is not None else None
+    except (TypeError, ValueError):
+        return None
+
+async def _request(target, stage, messages, response_format):
+    if target.provider == "openai":
+        client = _async_openai()
+        if response_format is not None:
+            completion = await client.beta.chat.completions.parse(model=target.model, messages=messages, response_format=response_format)
+        else:
+            completion = await client.chat.completions.create(model=target.model, messages=messages)
+        prompt_tokens, completion_tokens = record_openai_usage(stage, target.model, completion)
+        message = completion.choices[0].message
+        return Completion(message.content or "", getattr(message, "parsed", None), target), prompt_tokens + completion_tokens
+    output = await _async_ollama(target.host).chat(model=target.model, messages=messages, keep_alive=OLLAMA_KEEP_ALIVE)
+    prompt_tokens, completion_tokens = record_ollama_usage(stage, target.model, output)
+    return Completion(output["message"]["content"], None, target), prompt_tokens + completion_tokens
+
+async def complete_async(targets, stage, messages, response_format=None):
+    """Send a chat request to the first target that answers, on the request loop.
+
+    Every provider has request and token budgets per minute and a limit on
+    requests in flight. Timeouts, connection errors, rate limits and server
+    errors are retried with jittered exponential backoff (or the provider's
+    Retry-After); when the retries run out, or the error is not transient,
+    the next target is tried. The last error is raised when none answers.
+    """
+    error = None
+    attempts = 0
+    rate_limit_wait = 0.0
+    for target in targets:
+        limiter = _limiter(target.provider)
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            attempts += 1
+            reserved = _estimate_tokens(messages)
+            rate_limit_wait += await limiter.acquire(reserved)
+            try:
+                async with limiter.in_flight:
+                    completion, used = await asyncio.wait_for(_request(target, stage, messages, response_format), LLM_TIMEOUT)
+            except Exception as e:
+                error = e
+                limiter.tokens.adjust(-reserved)
+                if not _retryable(e) or attempt == LLM_MAX_RETRIES:
+                    break
+                delay = _retry_after(e) or random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+                if _rate_limited(e):
+                    limiter.pause(delay)
+                print(f"complete_async: {stage} request to {target} failed ({type(e).__name__}: {e}), retry {attempt + 1}/{LLM_MAX_RETRIES} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            limiter.tokens.adjust((used or reserved) - reserved)
+            completion.attempts = attempts
+            completion.rate_limit_wait = round(rate_limit_wait, 3)
+            return completion
+        print(f"complete_async: {stage} gave up on {target} ({type(error).__name__}: {error})")
+    raise error
+
+def targets_for(client, model_name):
+    """The target a run asked for ("openai" or an Ollama client), then LLM_FAILOVER."""
+    primary = Target("openai", OPENAI_MODEL) if client == "openai" else Target("ollama", model_name, _ollama_host(client))
+    return [primary] + [target for target in map(Target.parse, LLM_FAILOVER) if str(target) != str(primary)]
+
+def complete(client, model_name, stage, messages, response_format=None):
+    """Blocking form of complete_async for the pipeline threads; the open trace span gets the provider and retries."""
+    future = asyncio.run_coroutine_threadsafe(complete_async(targets_for(client, model_name), stage, messages, response_format), request_loop())
+    completion = future.result()
+    span = tracing.current()
+    if span is not None:
+        span["provider"] = str(completion.target)
+        span["attempts"] = completion.attempts
+        span["rate_limit_wait"] = completion.rate_limit_wait
+    return completion
@@ -0,0 +1,65 @@
+import threading
+
+# USD per 1M tokens (input, output); local ollama models are free
+MODEL_PRICING = {
+    "gpt-4o-2024-08-06": (2.50, 10.00),
+}
+
+_lock = threading.Lock()
+usage = {
+    "calls": 0,
+    "prompt_tokens": 0,
+    "completion_tokens": 0,
+    "cost": 0.0,
+    "by_stage": {}
+}
+
+def record_usage(stage, model_name, prompt_tokens, completion_tokens):
+    prompt_tokens = prompt_tokens or 0
+    completion_tokens = completion_tokens or 0
+    input_price, output_price = MODEL_PRICING.get(model_name, (0.0, 0.0))
+    cost = (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+    with _lock:
+        usage["calls"] += 1
+        usage["prompt_tokens"] += prompt_tokens
+        usage["completion_tokens"] += completion_tokens
+        usage["cost"] += cost
+        stage_usage = usage["by_stage"].setdefault(stage, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0})
+        stage_usage["calls"] += 1
+        stage_usage["prompt_tokens"] += prompt_tokens
+        stage_usage["completion_tokens"] += completion_tokens
+        stage_usage["cost"] += cost
+    return prompt_tokens, completion_tokens
+
+def record_openai_usage(stage, model_name, completion):
+    if completion.usage is None:
+        return record_usage(stage, model_name, 0, 0)
+    return record_usage(stage, model_name, completion.usage.prompt_tokens, completion.usage.completion_tokens)
+
+def record_ollama_usage(stage, model_name, output):
+    # ollama reports prompt_eval_count/eval_count on the final chat response
+    return record_usage(stage, model_name, output.get("prompt_eval_count", 0), output.get("eval_count", 0))
+
+def total_tokens():
+    with _lock:
+        return usage["prompt_tokens"] + usage["completion_tokens"]
+
+def total_cost():
+    with _lock:
+        return usage["cost"]
+
+def get_usage():
+    with _lock:
+        snapshot = dict(usage)
+        snapshot["by_stage"] = {stage: dict(values) for stage, values in usage["by_stage"].items()}
+    snapshot["cost"] = round(snapshot["cost"], 6)
+    return snapshot
+
+def load_usage(snapshot):
+    with _lock:
+        usage.update({key: value for key, value in snapshot.items() if key != "by_stage"})
+        usage["by_stage"] = {stage: dict(values) for stage, values in snapshot["by_stage"].items()}
+
+def reset_usage():
+    load_usage({"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0, "by_stage": {}})
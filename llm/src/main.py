@@ -2,134 +2,405 @@ from colorLog import *
 from datetime import datetime
 from dotenv import load_dotenv
 import json
-import ollama
-from ollama import Client
+import logging
 import os
 import pickle
+import resource
 import shutil
-import subprocess
 import sys
+import time
+from checkpoint import clear_checkpoint, load_checkpoint, restore_files, save_checkpoint
+from llm_clients import warm_ollama_model
+from llm_usage import get_usage, load_usage, reset_usage
+import artifacts
+import tracing
+from pipeline import OptimizationPipeline
+from termination import TerminationPolicy
 from utils import setup_logger
 
 
 load_dotenv()
 USER_PREFIX = os.getenv('USER_PREFIX')
 
-from regression_test import regression_test
+from regression_test import regression_test, limit_hint, TEST_OUTPUT_FILE, DUPLICATE_CANDIDATE, LIMIT_EXCEEDED
+from candidate_index import CandidateIndex, DUPLICATE_HINT
+from knowledge_base import knowledge_base, error_summary
 from new_llm_optimize import llm_optimize, handle_compilation_error
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
-from energy.src.measure_energy import get_evaluator_feedback
+from energy.src.measure_energy import MeasureOptions, measure_benchmark, benchmark_data, benchmark_metrics, within_memory_limit
+from energy.src.energy_meter import account, local_llm, net_energy
+from energy.src.evaluator import AsyncEvaluator, SKIP
+from energy.src.registry import out_dir, source_filenames
 
 
 
 
-valid_benchmarks = [
-    "binarytrees.gpp-9.c++",
-    "chameneosredux.gpp-5.c++",
-    "fannkuchredux.gpp-5.c++",
-    "fasta.gpp-5.c++",
-    "knucleotide.gpp-3.c++",
-    "mandelbrot.gpp-6.c++",
-    "nbody.gpp-8.c++",
-    "pidigits.gpp-4.c++",
-    "regexredux.gpp-3.c++",
-    "revcomp.gpp-4.c++",
-    "spectralnorm.gpp-6.c++"
-]
+# every benchmark in benchmarks/registry.json
+valid_benchmarks = source_filenames()
 
 total_compilation_errors, compilation_errors_fixed = 0, 0
+# candidates whose output differed from the original's
+total_output_errors = 0
+# pgo, thread, frequency and massif measurements of every accepted version (`pgo`, `threads`, `freq`, `massif` arguments)
+measure_options = MeasureOptions()
 
 # attaching date and time to make names unique
-run_start_time = datetime.now()
 def attach_datetime(string):
-    return string + run_start_time.strftime(f"_%d-%m-%H-%M")
-log_dir = os.path.join("logs", sys.argv[2])
-if not os.path.exists(log_dir):
-    os.makedirs(log_dir)
-log_file_path = os.path.join(log_dir, attach_datetime('run') + '.log')
-logger = setup_logger(log_file_path)
+    return string + datetime.now().strftime(f"_%d-%m-%H-%M-%S")
+def run_log_path(benchmark):
+    log_dir = os.path.join("logs", benchmark)
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    return os.path.join(log_dir, attach_datetime('run') + '.log')
+logger = logging.getLogger()
 
-def master_script(filename, client, model_name):
+def log_evaluator_stats(stats, iteration_time):
+    share = stats["latency"] / iteration_time if iteration_time > 0 else 0.0
+    logger.info(f"Evaluator ({stats['mode']}): {stats['prompt_tokens']} prompt + {stats['completion_tokens']} completion tokens, {stats['latency']:.1f}s ({share:.0%} of iteration), loop waited {stats['waited']:.1f}s")
 
-    global total_compilation_errors, compilation_errors_fixed
+def master_script(filename, client, model_name, policy, checkpoint=None):
+
+    global total_compilation_errors, compilation_errors_fixed, total_output_errors
+
+    compiled_filename = f"{filename.split('.')[0]}.compiled.{'.'.join(filename.split('.')[1:])}"
 
-    # Keep a copy of a compiling file for re-optimization
-    # copy original code to benchmarks_out/ as filename.compiled.gpp-x.c++
-    shutil.copyfile(f"{USER_PREFIX}/llm/llm_input_files/input_code/{filename}", f"{USER_PREFIX}/llm/benchmarks_out/{filename.split('.')[0]}/{filename.split('.')[0]}.compiled.{'.'.join(filename.split('.')[1:])}")
-    logger.info(f"{USER_PREFIX}/llm/benchmarks_out/{filename.split('.')[0]}/{filename.split('.')[0]}.compiled.{'.'.join(filename.split('.')[1:])}")
-    
     # keep track of errors
-    regression_test_result = -3
+    regression_test_result, violation = -3, None
     compilation_errors, success = 0, 0
     i, occurence_of_compilation_error = 0, -2
     reoptimize_lastly_flag = 0
+    benchmark_info = None
+    resume_stage = None
+    duplicate_hint = ""
+    optimized_path = f"{out_dir(filename)}/optimized_{filename}"
 
-    while True:
-        # optimization step
-        # reoptimize latest working opimized file if logic/compile error
-        if reoptimize_lastly_flag == 0:
-            logger.info(f"Optimizing {filename}, iteration {success}")
-            llm_optimize(client, model_name, filename, success)
+    # every candidate seen for this benchmark, so duplicates are not compiled and measured again
+    candidate_index = CandidateIndex(filename)
+    with open(f"{USER_PREFIX}/llm/llm_input_files/input_code/{filename}", "r") as file:
+        original_source = file.read()
+    if candidate_index.lookup_source(original_source) is None:
+        candidate_index.record(original_source, 1, iteration=0)
+
+    def record_candidate(result, info=None, violation=None):
+        with open(optimized_path, "r") as file:
+            candidate_source = file.read()
+        if info is None:
+            candidate_index.record(candidate_source, result)
         else:
-            logger.info("re-optimizing from latest working optimization")
-            llm_optimize(client, model_name, f"{filename.split('.')[0]}.compiled.{'.'.join(filename.split('.')[1:])}", success)
-            reoptimize_lastly_flag = 0
-        
-        # regression test step
-        logger.info(f"Running regression test on optimized_{filename}")
-        regression_test_result = regression_test(f"optimized_{filename}")
-        i += 1
-        
-        # Log compilation fixed errors
-        if occurence_of_compilation_error + 1 == i and regression_test_result != -1:
-            compilation_errors_fixed += 1
-
-        # Compilation error in unoptimized file, exit script
-        if regression_test_result == -2:
-            logger.error("Error in unoptimized file, exiting script")
-            return
-
-        # Compilation error in optimized file, re-prompt
-        if regression_test_result == -1:
-            total_compilation_errors += 1
-            occurence_of_compilation_error = i
-            if compilation_errors == 3:
-                logger.error("Could not compile optimized file after 3 attempts, will re-optimize from lastest working optimized file")
-                logger.info(f"{filename.split('.')[0]}.compiled.{'.'.join(filename.split('.')[1:])}")
-                reoptimize_lastly_flag = 1
-                compilation_errors = 0
-                continue
+            candidate_index.record(candidate_source, result, success + 1, info["current"]["avg_energy"], info["current"]["avg_runtime"])
+
+        # the knowledge base stores the change against the latest working version
+        with open(f"{out_dir(filename)}/{compiled_filename}", "r") as file:
+            base_source = file.read()
+        base, current, reason = None, None, None
+        if info is not None:
+            base = next(((value[1], value[2]) for key, value in benchmark_data.items() if key != success + 1 and value[0] == base_source), None)
+            current = (info["current"]["avg_energy"], info["current"]["avg_runtime"])
+        elif result == -1:
+            with open(TEST_OUTPUT_FILE, "r") as file:
+                reason = error_summary(file.read())
+        elif result == LIMIT_EXCEEDED:
+            reason = violation
+        knowledge_base.record(filename, model_name, base_source, candidate_source, result, base, current, reason)
+
+    if checkpoint is None:
+        # Keep a copy of a compiling file for re-optimization
+        # copy original code to benchmarks_out/ as filename.compiled.gpp-x.c++
+        shutil.copyfile(f"{USER_PREFIX}/llm/llm_input_files/input_code/{filename}", f"{out_dir(filename)}/{compiled_filename}")
+        logger.info(f"{out_dir(filename)}/{compiled_filename}")
+    else:
+        # Continue at the stage that was running when the previous run died
+        restore_files(checkpoint)
+        loop_state = checkpoint["loop_state"]
+        regression_test_result = loop_state["regression_test_result"]
+        compilation_errors, success = loop_state["compilation_errors"], loop_state["success"]
+        i, occurence_of_compilation_error = loop_state["i"], loop_state["occurence_of_compilation_error"]
+        reoptimize_lastly_flag = loop_state["reoptimize_lastly_flag"]
+        benchmark_info = loop_state["benchmark_info"]
+        total_compilation_errors = loop_state["total_compilation_errors"]
+        total_output_errors = loop_state.get("total_output_errors", 0)
+        compilation_errors_fixed = loop_state["compilation_errors_fixed"]
+        benchmark_data.update(checkpoint["benchmark_data"])
+        benchmark_metrics.update(checkpoint["benchmark_metrics"])
+        policy.set_state(checkpoint["policy_state"])
+        load_usage(checkpoint["usage"])
+        resume_stage = checkpoint["stage"]
+        logger.info(f"Resuming {filename} at stage '{resume_stage}', iteration {success}")
 
+    def save(stage):
+        loop_state = {
+            "regression_test_result": regression_test_result,
+            "compilation_errors": compilation_errors,
+            "success": success,
+            "i": i,
+            "occurence_of_compilation_error": occurence_of_compilation_error,
+            "reoptimize_lastly_flag": reoptimize_lastly_flag,
+            "benchmark_info": benchmark_info,
+            "total_compilation_errors": total_compilation_errors,
+            "total_output_errors": total_output_errors,
+            "compilation_errors_fixed": compilation_errors_fixed
+        }
+        save_checkpoint(filename, stage, loop_state, policy.get_state(), get_usage(), benchmark_data, benchmark_metrics)
+
+    def run_stage(stage):
+        # while resuming, skip the stages that completed before the checkpoint
+        nonlocal resume_stage
+        if resume_stage is None:
+            save(stage)
+            return True
+        if resume_stage == stage:
+            resume_stage = None
+            return True
+        return False
+
+    # evaluator runs in the background while the loop does its bookkeeping
+    evaluator = AsyncEvaluator(client, model_name, policy.noise_factor)
+    iteration_start = time.time()
+    iteration_span = None
+
+    while True:
+        if iteration_span is not None:
+            iteration_span.end()
+        iteration_span = tracing.span("iteration", index=i, success=success)
+
+        # the next generation uses the latest finished feedback, an evaluation still running
+        # overlaps with this iteration and its feedback goes to the next prompt
+        evaluator_stats = evaluator.poll()
+        if evaluator_stats is not None:
+            log_evaluator_stats(evaluator_stats, time.time() - iteration_start)
+            iteration_start = time.time()
+
+        if run_stage("optimize"):
+            # stop before paying for another generation if a budget is used up
+            if policy.check_budget():
+                logger.info(f"Stopping optimization: {policy.reason}")
+                break
+
+            # optimization step
+            # reoptimize latest working opimized file if logic/compile error
+            with tracing.span("stage.optimize", reoptimize=reoptimize_lastly_flag == 1):
+                if reoptimize_lastly_flag == 0:
+                    logger.info(f"Optimizing {filename}, iteration {success}")
+                    llm_optimize(client, model_name, filename, success, duplicate_hint)
+                else:
+                    logger.info("re-optimizing from latest working optimization")
+                    llm_optimize(client, model_name, compiled_filename, success, duplicate_hint)
+                    reoptimize_lastly_flag = 0
+            duplicate_hint = ""
+
+        if resume_stage == "fix_compilation":
+            resume_stage = None
             logger.error("Error in optimized file, re-optimizing")
             handle_compilation_error(client, model_name, filename)
             compilation_errors += 1
-
-        # Output difference in optimized file, re-prompt
-        if regression_test_result == 0:
-            logger.error("Output difference in optimized file, will re-optimize from lastest working optimized file")
-            logger.info(f"{filename.split('.')[0]}.compiled.{'.'.join(filename.split('.')[1:])}")
-            reoptimize_lastly_flag = 1
             continue
+
+        if run_stage("regression_test"):
+            # regression test step
+            logger.info(f"Running regression test on optimized_{filename}")
+            with tracing.span("stage.regression_test") as stage_span:
+                with open(optimized_path, "r") as file:
+                    if candidate_index.lookup_source(file.read()) is not None:
+                        regression_test_result, violation = DUPLICATE_CANDIDATE, None
+                        stage_span["cache_hit"] = True
+                    else:
+                        regression_test_result, violation = regression_test(f"optimized_{filename}", candidate_index)
+                stage_span["result"] = regression_test_result
+            i += 1
+
+            # Same program as an earlier candidate, report its results and ask for something else
+            if regression_test_result == DUPLICATE_CANDIDATE:
+                duplicate = candidate_index.last_match
+                logger.error(f"Candidate duplicates an earlier one (iteration {duplicate['iteration']}, regression result {duplicate['regression_result']}, energy {duplicate['avg_energy']}), re-prompting for a different candidate")
+                duplicate_hint = DUPLICATE_HINT
+                reoptimize_lastly_flag = 1
+                continue
+        
+            # Log compilation fixed errors
+            if occurence_of_compilation_error + 1 == i and regression_test_result != -1:
+                compilation_errors_fixed += 1
+
+            # Compilation error in unoptimized file, exit script
+            if regression_test_result == -2:
+                logger.error("Error in unoptimized file, exiting script")
+                policy.reason = "unoptimized_compile_error"
+                iteration_span.end()
+                evaluator.shutdown()
+                return
+
+            # Compilation error in optimized file, re-prompt
+            if regression_test_result == -1:
+                record_candidate(-1)
+                total_compilation_errors += 1
+                occurence_of_compilation_error = i
+                if compilation_errors == 3:
+                    logger.error("Could not compile optimized file after 3 attempts, will re-optimize from lastest working optimized file")
+                    logger.info(compiled_filename)
+                    reoptimize_lastly_flag = 1
+                    compilation_errors = 0
+                    continue
+
+                save("fix_compilation")
+                logger.error("Error in optimized file, re-optimizing")
+                handle_compilation_error(client, model_name, filename)
+                compilation_errors += 1
+
+            # Candidate ran out of time, memory, output size or processes, re-prompt
+            if regression_test_result == LIMIT_EXCEEDED:
+                record_candidate(LIMIT_EXCEEDED, violation=violation)
+                logger.error(f"Optimized file exceeded the {violation} limit, will re-optimize from lastest working optimized file")
+                duplicate_hint = limit_hint(violation)
+                reoptimize_lastly_flag = 1
+                continue
+
+            # Output difference in optimized file, re-prompt
+            if regression_test_result == 0:
+                record_candidate(0)
+                total_output_errors += 1
+                logger.error("Output difference in optimized file, will re-optimize from lastest working optimized file")
+                logger.info(compiled_filename)
+                reoptimize_lastly_flag = 1
+                continue
         
         # Success
         if regression_test_result == 1:
-            logger.info("Regression test successful, getting evaluator feedback")
-            get_evaluator_feedback(client, model_name, filename, success)
-            # print_green("Got evaluator feedback")
-            logger.info("Got evaluator feedback")
-            success += 1
-
-            # Copy lastest optimized code for logic error re-optimization
-            logger.info("Saving lastest working optimized file")
-            os.makedirs(os.path.dirname(f"{USER_PREFIX}/llm/benchmarks_out/{filename.split('.')[0]}/{filename.split('.')[0]}.compiled.{'.'.join(filename.split('.')[1:])}"), exist_ok=True)
-            shutil.copyfile(f"{USER_PREFIX}/llm/benchmarks_out/{filename.split('.')[0]}/optimized_{filename}", f"{USER_PREFIX}/llm/benchmarks_out/{filename.split('.')[0]}/{filename.split('.')[0]}.compiled.{'.'.join(filename.split('.')[1:])}")
+            if run_stage("measure"):
+                logger.info("Regression test successful, measuring energy")
+                # a local evaluator would run on the package being measured
+                if local_llm(client):
+                    with tracing.span("evaluator_wait"):
+                        evaluator_stats = evaluator.wait()
+                    if evaluator_stats is not None:
+                        log_evaluator_stats(evaluator_stats, time.time() - iteration_start)
+                        iteration_start = time.time()
+                with tracing.span("stage.measure"):
+                    benchmark_info = measure_benchmark(filename, success, measure_options)
+                record_candidate(1, benchmark_info)
+
+            if run_stage("evaluate"):
+                evaluator_mode = evaluator.submit(benchmark_info)
+                iteration_span["evaluator_mode"] = evaluator_mode
+                if evaluator_mode == SKIP:
+                    logger.info("Evaluator skipped, version is not distinguishable from the best, keeping previous feedback")
+                    iteration_start = time.time()
+                else:
+                    logger.info(f"Getting evaluator feedback ({evaluator_mode}) in the background")
+                if success == 0:
+                    policy.record_original(benchmark_info["original"]["avg_energy"], benchmark_info["original"]["energy_std"])
+                policy.record_iteration(benchmark_info["current"]["avg_energy"], benchmark_info["current"]["energy_std"], benchmark_info["current"]["measurement_energy"])
+                success += 1
+
+                # Copy lastest optimized code for logic error re-optimization
+                # (unless it blew the memory limit, then re-optimization starts from the previous version)
+                if benchmark_info["current"].get("within_memory_limit", True):
+                    logger.info("Saving lastest working optimized file")
+                    os.makedirs(os.path.dirname(f"{out_dir(filename)}/{compiled_filename}"), exist_ok=True)
+                    shutil.copyfile(f"{out_dir(filename)}/optimized_{filename}", f"{out_dir(filename)}/{compiled_filename}")
+                else:
+                    logger.info(f"Optimized file uses {benchmark_info['current']['peak_rss_ratio']}x the original's peak memory, keeping the previous working file")
             
-            # Hard code to run 5 times
-            if success == 5:
-                logger.info("Optimized 5 times successfully, exiting script")
-                break
+                # Stop on max iterations, plateaued energy or exhausted budget
+                if policy.check_success(success):
+                    logger.info(f"Optimized {success} times successfully, stopping: {policy.reason}")
+                    break
+
+    iteration_span.end()
+    evaluator_stats = evaluator.wait()
+    if evaluator_stats is not None:
+        log_evaluator_stats(evaluator_stats, time.time() - iteration_start)
+    evaluator.shutdown()
         
+def run_benchmark(benchmark, client, model_name, options=(), policy=None):
+    """Optimize one benchmark and return its run summary.
+
+    options are the extra command line arguments (resume, pipeline, pgo,
+    threads, freq, massif). The daemon runs many of these in one process, so
+    nothing is carried over from a previous run.
+    """
+    global total_compilation_errors, compilation_errors_fixed, total_output_errors, measure_options
+    total_compilation_errors, compilation_errors_fixed, total_output_errors = 0, 0, 0
+    benchmark_data.clear()
+    benchmark_metrics.clear()
+    reset_usage()
+
+    #resume from the last checkpoint with --resume (or `make run <benchmark> <model> resume`)
+    checkpoint = None
+    if "--resume" in options or "resume" in options:
+        checkpoint = load_checkpoint(benchmark)
+        if checkpoint is None:
+            logger.error(f"No checkpoint found for {benchmark}, starting a new run")
+
+    #run benchmark
+    measure_options = MeasureOptions.from_args(options)
+    policy = policy or TerminationPolicy.from_env()
+    artifacts.start_run(benchmark.split('.')[0])
+    trace_path = tracing.start_trace(benchmark.split('.')[0])
+    # everything the machine spends from here on is the cost of the optimization
+    energy_start = account.snapshot()
+    if "pipeline" in options:
+        # overlap generation/evaluation with compile and measurement
+        if checkpoint is not None:
+            logger.error("Resume is not supported in pipeline mode, starting a new run")
+        shutil.copyfile(f"{USER_PREFIX}/llm/llm_input_files/input_code/{benchmark}", f"{out_dir(benchmark)}/{benchmark.split('.')[0]}.compiled.{'.'.join(benchmark.split('.')[1:])}")
+        pipeline = OptimizationPipeline(benchmark, client, model_name, policy, depth=int(os.getenv("PIPELINE_DEPTH", 2)), measure_options=measure_options)
+        pipeline.run()
+        total_compilation_errors, total_output_errors = pipeline.stats["compilation_errors"], pipeline.stats["logic_errors"]
+        compilation_errors_fixed = pipeline.stats["compilation_errors_fixed"]
+    else:
+        master_script(benchmark, client, model_name, policy, checkpoint)
+
+    # print_green(f"Total compilation errors: {total_compilation_errors}, fixed: {compilation_errors_fixed}")
+    logger.info(f"Total compilation errors: {total_compilation_errors}, fixed: {compilation_errors_fixed}")
+    logger.info("EEDC Optimization Complete, writing results to file.....")
+
+    with open(f"{USER_PREFIX}/energy/c++/benchmark_data.pkl", "rb") as file:
+        contents = pickle.load(file)
+    
+    dict_str = json.dumps(contents, indent=4)
+    with open("result_file.txt", "w+") as file:
+        file.write(str(dict_str))
+
+    # Record why and at what cost the run stopped
+    run_summary = policy.summary()
+    run_summary["benchmark"] = benchmark
+    run_summary["model"] = model_name
+    run_summary["total_compilation_errors"] = total_compilation_errors
+    run_summary["total_output_errors"] = total_output_errors
+    run_summary["compilation_errors_fixed"] = compilation_errors_fixed
+    run_summary["llm_usage"] = get_usage()
+    run_summary["artifacts"] = artifacts.get_stats()
+    run_summary["driver_peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    run_summary["trace"] = {"jsonl": trace_path, "chrome": tracing.export_chrome(trace_path) if os.path.isfile(trace_path) else None}
+    run_summary["peak_rss_kb"] = {version: metrics.get("memory", {}).get("peak_rss_kb") for version, metrics in benchmark_metrics.items()}
+    accepted = [value[1] for key, value in benchmark_data.items() if within_memory_limit(benchmark_metrics, key)]
+    run_summary["net_energy"] = net_energy(energy_start, account.snapshot(), run_summary["llm_usage"], local_llm(client),
+                                           benchmark_data[0][1] if 0 in benchmark_data else None, min(accepted) if accepted else None)
+    if run_summary["net_energy"]["metered"]:
+        logger.info(f"Optimization used {run_summary['net_energy']['optimization_joules']} J ({run_summary['net_energy']['scope']}), saves {run_summary['net_energy']['savings_joules_per_execution']} J per execution, break-even after {run_summary['net_energy']['break_even_executions']} executions")
+    else:
+        logger.warning(f"Optimization energy not metered: {run_summary['net_energy']['reason']}")
+    logger.info(f"Termination reason: {run_summary['termination_reason']}")
+    with open("run_summary.txt", "w+") as file:
+        file.write(json.dumps(run_summary, indent=4))
+
+    # The run completed, a later --resume should start fresh
+    clear_checkpoint(benchmark)
+
+    # Delete evaluator feedback
+    file_path = f"{USER_PREFIX}/energy/src/evaluator_feedback.txt"
+    try:
+        # Check if file exists
+        if os.path.isfile(file_path):
+            os.remove(file_path)
+            logger.info(f"{file_path} has been removed successfully.")
+        else:
+            logger.error(f"{file_path} does not exist.")
+    except Exception as e:
+        logger.error(f"An error occurred while trying to remove the file: {e}")
+    return run_summary
+
 if __name__ == "__main__":
+    setup_logger(run_log_path(sys.argv[2]))
     
     #Check if requested benchmark is valid
     benchmark = sys.argv[2]
@@ -148,37 +419,12 @@ if __name__ == "__main__":
     if model_name == "openai":
         client = model_name
     else:
+        # OLLAMA_HOST points at another server, e.g. the throughput suite's mock
         try:
-            subprocess.run(["ollama", "pull", model_name], check=True)
+            client = warm_ollama_model(model_name)
         except Exception as e:
             logger.error(f"Error: Invalid LLM requested: {model_name}")
             print("Please provide the name of an LLM suppported by Ollama")
             sys.exit(1)
-        else:
-            client = Client(host="http://localhost:11434")
-            
-    #run benchmark
-    master_script(benchmark, client, model_name)
-
-    # print_green(f"Total compilation errors: {total_compilation_errors}, fixed: {compilation_errors_fixed}")
-    logger.info(f"Total compilation errors: {total_compilation_errors}, fixed: {compilation_errors_fixed}")
-    logger.info("EEDC Optimization Complete, writing results to file.....")
 
-    with open(f"{USER_PREFIX}/energy/c++/benchmark_data.pkl", "rb") as file:
-        contents = pickle.load(file)
-    
-    dict_str = json.dumps(contents, indent=4)
-    with open("result_file.txt", "w+") as file:
-        file.write(str(dict_str))
-
-    # Delete evaluator feedback
-    file_path = f"{USER_PREFIX}/energy/src/evaluator_feedback.txt"
-    try:
-        # Check if file exists
-        if os.path.isfile(file_path):
-            os.remove(file_path)
-            logger.info(f"{file_path} has been removed successfully.")
-        else:
-            logger.error(f"{file_path} does not exist.")
-    except Exception as e:
-        logger.error(f"An error occurred while trying to remove the file: {e}")
\ No newline at end of file
+    run_benchmark(benchmark, client, model_name, sys.argv[4:])
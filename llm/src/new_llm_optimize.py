@@ -1,14 +1,18 @@
 from dotenv import load_dotenv
-from openai import OpenAI
 import os
 from pydantic import BaseModel
-
+from llm_clients import complete
+import artifacts
+from knowledge_base import knowledge_base
+import tracing
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from energy.src.registry import out_dir
 
 
 load_dotenv()
 
 
-openai_key = os.getenv('API_KEY')
 USER_PREFIX = os.getenv('USER_PREFIX')
 
 prompt = """You are tasked with optimizing the following C++ code to improve its energy efficiency. This involves reducing CPU cycles, minimizing memory access, and optimizing I/O operations. Please follow these steps and guidelines:
@@ -119,22 +123,7 @@ prompt = """You are tasked with optimizing the following C++ code to improve its
                 ```
 """
 
-def llm_optimize(client, model_name, filename, optim_iter):
-
-    # get original code
-    source_path = f"{USER_PREFIX}/llm/benchmarks_out/{filename.split('.')[0]}/{filename}"
-
-    # get optimized file if is not first iteration
-    if optim_iter != 0:
-        source_path = f"{USER_PREFIX}/llm/benchmarks_out/{filename.split('.')[0]}/optimized_{filename}"
-
-    # get lastly compiled code
-    if filename.split('.')[1] == "compiled":
-        source_path = f"{USER_PREFIX}/llm/benchmarks_out/{filename.split('.')[0]}/{filename}"
-        filename = filename.split('.')[0] + "." + ('.'.join(filename.split('.')[2:]))
-    
-    with open(source_path, "r") as file:
-        code_content = file.read()
+def generate_optimized_code(client, model_name, code_content, evaluator_feedback="", extra_instructions="", benchmark=None):
 
     class Strategy(BaseModel):
         Pros: str
@@ -146,27 +135,19 @@ def llm_optimize(client, model_name, filename, optim_iter):
         selected_strategy: str
         final_code: str
 
-    #checking for evaluator feedback
-    # Get the current directory of the script
-    current_dir = os.path.dirname(__file__)
-    # Construct the absolute path to evaluator_feedback.txt
-    feedback_file_path = os.path.abspath(os.path.join(current_dir, "../../energy/src/evaluator_feedback.txt"))
-
-    if os.path.isfile(feedback_file_path):
-        with open(feedback_file_path, 'r') as file:
-            evaluator_feedback = file.read()
-            evaluator_feedback = "Here's some suggestion on how you should optimize the code from the evaluator, keep these in mind when optimizing code\n" + evaluator_feedback
-            print("llm_optimize: got evaluator feedback")
-
-    else:
-        evaluator_feedback = ""
-        print("llm_optimize: First optimization, no evaluator feedback yet")
+    if evaluator_feedback:
+        evaluator_feedback = "Here's some suggestion on how you should optimize the code from the evaluator, keep these in mind when optimizing code\n" + evaluator_feedback
 
     # add code content to prompt
     optimize_prompt = prompt + f" {code_content}" + f" {evaluator_feedback}"
+    # transformations that paid off in earlier runs, and this benchmark's failures
+    optimize_prompt += knowledge_base.prompt_section(code_content, benchmark)
+    if extra_instructions:
+        optimize_prompt += f"\n{extra_instructions}"
 
     with open(f"{USER_PREFIX}/llm/src/output_logs/optimize_prompt_log.txt", "w") as f:
         f.write(optimize_prompt)
+    artifacts.record("optimize_prompt", optimize_prompt)
     
     
     print(f"llm_optimize: Generator LLM Optimizing ....")
@@ -180,86 +161,113 @@ def llm_optimize(client, model_name, filename, optim_iter):
                     "content": optimize_prompt
                 }
                 ]
-    if client == "openai":
-        client = OpenAI(api_key=openai_key)
-        completion = client.beta.chat.completions.parse(
-            model="gpt-4o-2024-08-06",
-            messages=messages,
-            response_format=OptimizationReasoning
-        )
-        final_code = completion.choices[0].message.parsed.final_code
+    with tracing.span("llm.optimize", model=model_name) as llm_span:
+        completion = complete(client, model_name, "optimize", messages, response_format=OptimizationReasoning)
+        final_code = completion.parsed.final_code if completion.parsed is not None else completion.text
+        llm_span["response_chars"] = len(final_code)
+    artifacts.record("optimize_response", final_code)
+
+    return final_code
+
+def llm_optimize(client, model_name, filename, optim_iter, extra_instructions=""):
+
+    # get original code
+    source_path = f"{out_dir(filename)}/{filename}"
+
+    # get optimized file if is not first iteration
+    if optim_iter != 0:
+        source_path = f"{out_dir(filename)}/optimized_{filename}"
+
+    # get lastly compiled code
+    if filename.split('.')[1] == "compiled":
+        source_path = f"{out_dir(filename)}/{filename}"
+        filename = filename.split('.')[0] + "." + ('.'.join(filename.split('.')[2:]))
+    
+    with open(source_path, "r") as file:
+        code_content = file.read()
+
+    #checking for evaluator feedback
+    # Get the current directory of the script
+    current_dir = os.path.dirname(__file__)
+    # Construct the absolute path to evaluator_feedback.txt
+    feedback_file_path = os.path.abspath(os.path.join(current_dir, "../../energy/src/evaluator_feedback.txt"))
+
+    if os.path.isfile(feedback_file_path):
+        with open(feedback_file_path, 'r') as file:
+            evaluator_feedback = file.read()
+            print("llm_optimize: got evaluator feedback")
+
     else:
-        output = client.chat(model=model_name, messages=messages)
-        final_code = output["message"]["content"]
+        evaluator_feedback = ""
+        print("llm_optimize: First optimization, no evaluator feedback yet")
 
+    final_code = generate_optimized_code(client, model_name, code_content, evaluator_feedback, extra_instructions, filename)
 
     if final_code == "":
         print("Error in llm completion")
         return
     
     
-    print(f"llm_optimize: : writing optimized code to llm/benchmarks_out/{filename.split('.')[0]}/optimized_{filename}")
-    destination_path = f"{USER_PREFIX}/llm/benchmarks_out/{filename.split('.')[0]}/optimized_{filename}"
+    print(f"llm_optimize: : writing optimized code to {out_dir(filename)}/optimized_{filename}")
+    destination_path = f"{out_dir(filename)}/optimized_{filename}"
     with open(destination_path, "w") as file:
         file.write(final_code)
 
     # Success code
     return 0
 
+def generate_compilation_fix(client, model_name, optimized_code, error_message):
+
+    class ErrorReasoning(BaseModel):
+        analysis: str
+        final_code: str
+    
+    compilation_error_prompt = f"""You were tasked with the task outlined in the following prompt: {prompt}. You returned the following optimized code: {optimized_code}. However, the code failed to compile with the following error message: {error_message}. Analyze the error message and explicitly identify the issue in the code that caused the compilation error. Then, consider if there's a need to use a different optimization strategy to compile successfully or if there are code changes which can fix this implementation strategy. Finally, update the code accordingly and ensure it compiles successfully. Ensure that the optimized code is both efficient and error-free and return it. """   
+    
+
+    #if regression_test_log too large, usally is because of syntax error
+    # Get the size of the error log in KB
+    error_size_kb = len(error_message.encode()) / 1024
+    if error_size_kb > 100:
+        print("Syntax Error")
+        compilation_error_prompt = f"""You were tasked with the task outlined in the following prompt: {prompt}. You returned the following optimized code: {optimized_code}. However, the code has syntax error, explicitly identify the issue in the code that caused the syntax error. Then, consider if there's a need to use a different optimization strategy to compile successfully or if there are code changes which can fix this implementation strategy. Finally, update the code accordingly and ensure it compiles successfully. Ensure that the optimized code is both efficient and error-free and return it. """   
+    
+
+    print("handle_compilation_error: promting for re-optimization")
+    messages = [
+                {
+                    "role": "system",
+                    "content": "You are a helpful assistant. Think through the code optimizations strategies possible step by step"},
+                {
+                    "role": "user",
+                    "content": compilation_error_prompt
+                }
+                ]
+    with tracing.span("llm.compilation_error", model=model_name) as llm_span:
+        completion = complete(client, model_name, "compilation_error", messages, response_format=ErrorReasoning)
+        final_code = completion.parsed.final_code if completion.parsed is not None else completion.text
+        llm_span["response_chars"] = len(final_code)
+    artifacts.record("compilation_error_prompt", compilation_error_prompt)
+    artifacts.record("compilation_error_response", final_code)
+
+    return final_code
+
 def handle_compilation_error(client, model_name, filename):
-    with open(f"{USER_PREFIX}/llm/benchmarks_out/{filename.split('.')[0]}/optimized_{filename}", "r") as file:
+    with open(f"{out_dir(filename)}/optimized_{filename}", "r") as file:
         optimized_code = file.read()
 
     with open(f"{USER_PREFIX}/llm/src/output_logs/regression_test_log.txt", "r") as file:
         error_message = file.read()
-    
-
-        class ErrorReasoning(BaseModel):
-            analysis: str
-            final_code: str
-        
-        compilation_error_prompt = f"""You were tasked with the task outlined in the following prompt: {prompt}. You returned the following optimized code: {optimized_code}. However, the code failed to compile with the following error message: {error_message}. Analyze the error message and explicitly identify the issue in the code that caused the compilation error. Then, consider if there's a need to use a different optimization strategy to compile successfully or if there are code changes which can fix this implementation strategy. Finally, update the code accordingly and ensure it compiles successfully. Ensure that the optimized code is both efficient and error-free and return it. """   
-        
 
-        #if regression_test_log too large, usally is because of syntax error
-        # Get the size of the file in bytes
-        file_size_bytes = os.path.getsize(f"{USER_PREFIX}/llm/src/output_logs/regression_test_log.txt")
-        file_size_kb = file_size_bytes / 1024
-        if file_size_kb > 100:
-            print("Syntax Error")
-            compilation_error_prompt = f"""You were tasked with the task outlined in the following prompt: {prompt}. You returned the following optimized code: {optimized_code}. However, the code has syntax error, explicitly identify the issue in the code that caused the syntax error. Then, consider if there's a need to use a different optimization strategy to compile successfully or if there are code changes which can fix this implementation strategy. Finally, update the code accordingly and ensure it compiles successfully. Ensure that the optimized code is both efficient and error-free and return it. """   
-        
+    final_code = generate_compilation_fix(client, model_name, optimized_code, error_message)
 
-        print("handle_compilation_error: promting for re-optimization")
-        messages = [
-                    {
-                        "role": "system",
-                        "content": "You are a helpful assistant. Think through the code optimizations strategies possible step by step"},
-                    {
-                        "role": "user",
-                        "content": compilation_error_prompt
-                    }
-                    ]
-        if client == "openai":
-            client = OpenAI(api_key=openai_key)
-            completion = client.beta.chat.completions.parse(
-                model="gpt-4o-2024-08-06",
-                messages=messages,
-                response_format=ErrorReasoning
-            )
-            final_code = completion.choices[0].message.parsed.final_code
-        else:
-            output = client.chat(model=model_name, messages=messages)
-            final_code = output["message"]["content"]
-
-
-        print(f"handle_compilation_error: writing re-optimized code to optimized_{filename}")
-        destination_path = f"{USER_PREFIX}/llm/benchmarks_out/{filename.split('.')[0]}"
-        with open(destination_path+"/optimized_"+filename, "w") as file:
-            file.write(final_code)
+    print(f"handle_compilation_error: writing re-optimized code to optimized_{filename}")
+    destination_path = out_dir(filename)
+    with open(destination_path+"/optimized_"+filename, "w") as file:
+        file.write(final_code)
 
 def handle_logic_error(client, model_name, filename):
-    with open(f"{USER_PREFIX}/llm/benchmarks_out/{filename.split('.')[0]}/optimized_{filename}", "r") as file:
+    with open(f"{out_dir(filename)}/optimized_{filename}", "r") as file:
         optimized_code = file.read()
 
     with open(f"{USER_PREFIX}/llm/src/output_logs/regression_test_log.txt", "r") as file:
@@ -282,20 +290,15 @@ def handle_logic_error(client, model_name, filename):
                     "content": logic_error_prompt
                 }
                 ]
-    if client == "openai":
-        client = OpenAI(api_key=openai_key)
-        completion = client.beta.chat.completions.parse(
-            model="gpt-4o-2024-08-06",
-            messages=messages,
-            response_format=ErrorReasoning
-        )
-        final_code = completion.choices[0].message.parsed.final_code
-    else:
-        output = client.chat(model=model_name, messages=messages)
-        final_code = output["message"]["content"]
+    with tracing.span("llm.logic_error", model=model_name) as llm_span:
+        completion = complete(client, model_name, "logic_error", messages, response_format=ErrorReasoning)
+        final_code = completion.parsed.final_code if completion.parsed is not None else completion.text
+        llm_span["response_chars"] = len(final_code)
+    artifacts.record("logic_error_prompt", logic_error_prompt)
+    artifacts.record("logic_error_response", final_code)
 
 
-    destination_path = f"{USER_PREFIX}/llm/benchmarks_out/{filename.split('.')[0]}"
+    destination_path = out_dir(filename)
     with open(destination_path+"/optimized_"+filename, "w") as file:
         file.write(final_code)
 
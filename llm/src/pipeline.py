@@ -0,0 +1,430 @@
+from contextlib import contextmanager
+from dotenv import load_dotenv
+import logging
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+from new_llm_optimize import generate_optimized_code, generate_compilation_fix
+from regression_test import regression_test, limit_hint, TEST_OUTPUT_FILE, DUPLICATE_CANDIDATE, LIMIT_EXCEEDED
+from candidate_index import CandidateIndex, DUPLICATE_HINT
+from knowledge_base import knowledge_base, error_summary
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from energy.src.benchmark import MEASURE_COORDINATOR, prefetch_remote
+from energy.src.measure_energy import MeasureOptions, measure_benchmark, benchmark_data
+from energy.src.evaluator import AsyncEvaluator
+from energy.src.energy_meter import local_llm
+from energy.src.registry import binary_name, out_dir
+
+load_dotenv()
+USER_PREFIX = os.getenv('USER_PREFIX')
+
+logger = logging.getLogger()
+
+# Sentinel that shuts a stage worker down
+STOP = None
+
+class Candidate():
+    """One generated source version travelling through the pipeline."""
+    def __init__(self, candidate_id, source_code, base_version, compilation_attempts=0, base_source=None):
+        self.candidate_id = candidate_id
+        self.source_code = source_code
+        # best version (iteration key) the candidate was generated from, and its source
+        self.base_version = base_version
+        self.base_source = base_source
+        self.compilation_attempts = compilation_attempts
+        # iteration key assigned when the candidate is measured
+        self.version = None
+        self.regression_result = None
+        # index entry of the earlier candidate this one duplicates
+        self.duplicate_of = None
+        self.error_message = None
+        self.benchmark_info = None
+
+class GenerationRequest():
+    def __init__(self, source_code, base_version, evaluator_feedback="", failed_candidate=None, extra_instructions=""):
+        self.source_code = source_code
+        self.base_version = base_version
+        self.evaluator_feedback = evaluator_feedback
+        self.extra_instructions = extra_instructions
+        # set when asking the LLM to fix a candidate that did not compile
+        self.failed_candidate = failed_candidate
+
+class MeasurementGate():
+    """Keeps LLM calls on this machine out of the energy measurements.
+
+    A measurement waits for the calls in flight and holds new ones back until
+    it is done. Disabled for remote LLMs, whose calls cost this machine next
+    to nothing and may overlap with measuring.
+    """
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.condition = threading.Condition()
+        self.measuring = False
+        self.calls = 0
+
+    @contextmanager
+    def llm_call(self):
+        if not self.enabled:
+            yield
+            return
+        with self.condition:
+            while self.measuring:
+                self.condition.wait()
+            self.calls += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.calls -= 1
+                self.condition.notify_all()
+
+    @contextmanager
+    def measurement(self):
+        if not self.enabled:
+            yield
+            return
+        with self.condition:
+            self.measuring = True
+            while self.calls > 0:
+                self.condition.wait()
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.measuring = False
+                self.condition.notify_all()
+
+class OptimizationPipeline():
+    """Overlaps LLM generation and evaluation with compile/regression/measurement.
+
+    Stages run in their own threads and are connected by bounded queues:
+
+        generate -> machine (screen/compile, regression test, measure) -> evaluate
+
+    The evaluate stage is an AsyncEvaluator, which skips or shortens the
+    evaluation of versions that are indistinguishable from the best.
+
+    Compiling, regression runs and RAPL trials share one worker. `depth`
+    generator threads keep up to `depth` candidates in flight, so the next
+    candidates are generated speculatively from the current best while the
+    previous one is measured. With a local LLM, generation and evaluation pause
+    while energy is measured (see MeasurementGate), so only compiling and
+    regression testing overlap with them.
+    Results of candidates generated from an outdated best are reconciled when
+    they come back: they are kept only if they beat the current best.
+    """
+    def __init__(self, filename, client, model_name, policy, depth=2, measure_options=None):
+        self.filename = filename
+        self.client = client
+        self.model_name = model_name
+        self.policy = policy
+        self.depth = depth
+        self.measure_options = measure_options or MeasureOptions()
+
+        name = filename.split('.')[0]
+        suffix = '.'.join(filename.split('.')[1:])
+        self.out_dir = out_dir(filename)
+        self.optimized_path = f"{self.out_dir}/optimized_{filename}"
+        self.optimized_binary = f"{self.out_dir}/{binary_name(f'optimized_{filename}')}"
+        self.compiled_path = f"{self.out_dir}/{name}.compiled.{suffix}"
+
+        self.generate_queue = queue.Queue(maxsize=depth)
+        self.machine_queue = queue.Queue(maxsize=depth)
+        self.events = queue.Queue()
+        # the evaluator runs on its own thread and posts "evaluated" events
+        self.gate = MeasurementGate(local_llm(client))
+        self.evaluator = AsyncEvaluator(client, model_name, policy.noise_factor, self.gate.llm_call)
+        self.id_lock = threading.Lock()
+
+        self.next_candidate_id = 0
+        self.measure_index = 0
+        self.outstanding = 0
+        self.success = 0
+        self.best_version = 0
+        self.best_energy = None
+        self.evaluator_feedback = ""
+        self.stale_results = 0
+        self.stopping = False
+        self.duplicate_hint = ""
+        self.stats = {"generated": 0, "compilation_errors": 0, "compilation_errors_fixed": 0, "logic_errors": 0, "duplicates": 0, "limit_violations": 0, "failed": 0, "measured": 0, "stale_discarded": 0}
+
+        with open(f"{USER_PREFIX}/llm/llm_input_files/input_code/{filename}", "r") as file:
+            self.best_source = file.read()
+
+        # only touched by the machine worker once the pipeline runs
+        self.candidate_index = CandidateIndex(filename)
+        if self.candidate_index.lookup_source(self.best_source) is None:
+            self.candidate_index.record(self.best_source, 1, iteration=0)
+
+    # Stage workers
+
+    def _generate_worker(self):
+        while True:
+            request = self.generate_queue.get()
+            if request is STOP:
+                return
+            try:
+                with self.gate.llm_call():
+                    if request.failed_candidate is not None:
+                        failed = request.failed_candidate
+                        code = generate_compilation_fix(self.client, self.model_name, failed.source_code, failed.error_message)
+                        attempts = failed.compilation_attempts + 1
+                        base_source = failed.base_source
+                    else:
+                        code = generate_optimized_code(self.client, self.model_name, request.source_code, request.evaluator_feedback, request.extra_instructions, self.filename)
+                        attempts = 0
+                        base_source = request.source_code
+                with self.id_lock:
+                    self.next_candidate_id += 1
+                    candidate_id = self.next_candidate_id
+                candidate = Candidate(candidate_id, code, request.base_version, attempts, base_source)
+                self.events.put(("generated", candidate))
+            except Exception as e:
+                self.events.put(("generation_failed", e))
+
+    def _machine_worker(self):
+        while True:
+            batch = [self.machine_queue.get()]
+            # with remote measurement, the candidates waiting now are tested first and measured on the workers at once
+            while MEASURE_COORDINATOR and batch[-1] is not STOP and len(batch) < self.depth:
+                try:
+                    batch.append(self.machine_queue.get_nowait())
+                except queue.Empty:
+                    break
+            passed = []
+            for candidate in batch:
+                if candidate is STOP:
+                    break
+                if self.stopping:
+                    self.events.put(("skipped", candidate))
+                elif self._test(candidate):
+                    passed.append(candidate)
+                else:
+                    self._finish(candidate)
+            for candidate in passed:
+                self._measure(candidate)
+                self._finish(candidate)
+            if batch[-1] is STOP:
+                return
+
+    def _test(self, candidate):
+        """Regression test a candidate, True when it passed and is to be measured."""
+        try:
+            candidate.duplicate_of = self.candidate_index.lookup_source(candidate.source_code)
+            if candidate.duplicate_of is not None:
+                candidate.regression_result = DUPLICATE_CANDIDATE
+                return False
+
+            # the machine stage owns optimized_<filename> and the Makefile targets
+            with open(self.optimized_path, "w") as file:
+                file.write(candidate.source_code)
+            candidate.regression_result, violation = regression_test(f"optimized_{self.filename}", self.candidate_index)
+            if candidate.regression_result == DUPLICATE_CANDIDATE:
+                candidate.duplicate_of = self.candidate_index.last_match
+            elif candidate.regression_result == -1:
+                with open(TEST_OUTPUT_FILE, "r") as file:
+                    candidate.error_message = file.read()
+                self.candidate_index.record(candidate.source_code, -1)
+            elif candidate.regression_result == 0:
+                self.candidate_index.record(candidate.source_code, 0)
+            elif candidate.regression_result == LIMIT_EXCEEDED:
+                candidate.error_message = violation
+                self.candidate_index.record(candidate.source_code, LIMIT_EXCEEDED)
+            elif candidate.regression_result == 1:
+                if MEASURE_COORDINATOR:
+                    # the next candidate's test replaces the executable, keep this one's for the local measurements
+                    for path in (self.optimized_binary, self.optimized_binary + ".digest"):
+                        if os.path.isfile(path):
+                            shutil.copy2(path, f"{path}.{candidate.candidate_id}")
+                    prefetch_remote(self.filename, candidate.source_code)
+                return True
+        except Exception as e:
+            candidate.regression_result = -3
+            candidate.error_message = str(e)
+        return False
+
+    def _measure(self, candidate):
+        try:
+            with open(self.optimized_path, "w") as file:
+                file.write(candidate.source_code)
+            for path in (self.optimized_binary, self.optimized_binary + ".digest"):
+                if os.path.isfile(f"{path}.{candidate.candidate_id}"):
+                    os.replace(f"{path}.{candidate.candidate_id}", path)
+            with self.gate.measurement():
+                candidate.benchmark_info = measure_benchmark(self.filename, self.measure_index, self.measure_options)
+            self.measure_index += 1
+            candidate.version = self.measure_index
+            current = candidate.benchmark_info["current"]
+            self.candidate_index.record(candidate.source_code, 1, candidate.version, current["avg_energy"], current["avg_runtime"])
+        except Exception as e:
+            candidate.regression_result = -3
+            candidate.error_message = str(e)
+
+    def _finish(self, candidate):
+        if candidate.regression_result != -3:
+            self._record_knowledge(candidate)
+        self.events.put(("tested", candidate))
+
+    def _record_knowledge(self, candidate):
+        if candidate.regression_result == DUPLICATE_CANDIDATE:
+            return
+        base, current, reason = None, None, None
+        if candidate.regression_result == 1:
+            base_data = benchmark_data.get(candidate.base_version)
+            base = (base_data[1], base_data[2]) if base_data else None
+            current = (candidate.benchmark_info["current"]["avg_energy"], candidate.benchmark_info["current"]["avg_runtime"])
+        elif candidate.regression_result == -1:
+            reason = error_summary(candidate.error_message)
+        elif candidate.regression_result == LIMIT_EXCEEDED:
+            reason = candidate.error_message
+        knowledge_base.record(self.filename, self.model_name, candidate.base_source, candidate.source_code, candidate.regression_result, base, current, reason)
+
+    # Controller
+
+    def _submit_generation(self, failed_candidate=None):
+        if self.stopping:
+            return False
+        if self.policy.check_budget():
+            logger.info(f"pipeline: stopping, {self.policy.reason}")
+            self.stopping = True
+            return False
+        request = GenerationRequest(self.best_source, self.best_version, self.evaluator_feedback, failed_candidate, self.duplicate_hint)
+        self.duplicate_hint = ""
+        if failed_candidate is None:
+            self.outstanding += 1
+        self.generate_queue.put(request)
+        return True
+
+    def _fill(self):
+        while not self.stopping and self.outstanding < self.depth:
+            self._submit_generation()
+
+    def _handle_tested(self, candidate):
+        if candidate.regression_result == -2:
+            logger.error("pipeline: error in unoptimized file, stopping")
+            self.policy.reason = "unoptimized_compile_error"
+            self.stopping = True
+            self.outstanding -= 1
+            return
+
+        # a fix that compiles, counted like master_script does
+        if candidate.compilation_attempts > 0 and candidate.regression_result not in (-1, -2):
+            self.stats["compilation_errors_fixed"] += 1
+
+        if candidate.regression_result == -1:
+            self.stats["compilation_errors"] += 1
+            if candidate.compilation_attempts < 3:
+                logger.error(f"pipeline: candidate {candidate.candidate_id} does not compile, asking for a fix")
+                # the fix replaces the candidate, so it stays outstanding
+                if not self._submit_generation(failed_candidate=candidate):
+                    self.outstanding -= 1
+                return
+            logger.error(f"pipeline: candidate {candidate.candidate_id} still does not compile, regenerating from best")
+            self.outstanding -= 1
+            return
+
+        self.outstanding -= 1
+        if candidate.regression_result == DUPLICATE_CANDIDATE:
+            self.stats["duplicates"] += 1
+            duplicate = candidate.duplicate_of
+            logger.info(f"pipeline: candidate {candidate.candidate_id} duplicates iteration {duplicate['iteration']} (result {duplicate['regression_result']}), asking for a different one")
+            self.duplicate_hint = DUPLICATE_HINT
+            return
+
+        if candidate.regression_result == LIMIT_EXCEEDED:
+            self.stats["limit_violations"] += 1
+            logger.error(f"pipeline: candidate {candidate.candidate_id} exceeded the {candidate.error_message} limit, asking for one that stays within it")
+            self.duplicate_hint = limit_hint(candidate.error_message)
+            return
+
+        if candidate.regression_result != 1:
+            # output differences only, as master_script's total_output_errors
+            if candidate.regression_result == 0:
+                self.stats["logic_errors"] += 1
+            else:
+                self.stats["failed"] += 1
+            logger.error(f"pipeline: candidate {candidate.candidate_id} failed the regression test ({candidate.regression_result})")
+            return
+
+        # measured candidate
+        info = candidate.benchmark_info
+        self.stats["measured"] += 1
+        if self.success == 0:
+            self.best_energy = info["original"]["avg_energy"]
+            self.policy.record_original(info["original"]["avg_energy"], info["original"]["energy_std"])
+        self.policy.record_iteration(info["current"]["avg_energy"], info["current"]["energy_std"], info["current"]["measurement_energy"])
+        self.success += 1
+        version = candidate.version
+
+        stale = candidate.base_version != self.best_version
+        energy = info["current"]["avg_energy"]
+        if energy < self.best_energy and not info["current"].get("within_memory_limit", True):
+            logger.info(f"pipeline: candidate {candidate.candidate_id} uses {info['current']['peak_rss_ratio']}x the original's peak memory, not accepted as best")
+        elif energy < self.best_energy:
+            logger.info(f"pipeline: candidate {candidate.candidate_id} is the new best ({energy} J){' although generated from an older best' if stale else ''}")
+            self.best_energy = energy
+            self.best_version = version
+            self.best_source = candidate.source_code
+            # feedback on the old best no longer applies
+            self.evaluator_feedback = ""
+            shutil.copyfile(self.optimized_path, self.compiled_path)
+        elif stale:
+            self.stats["stale_discarded"] += 1
+            logger.info(f"pipeline: stale candidate {candidate.candidate_id} (from version {candidate.base_version}) did not beat the best, discarded")
+            return
+
+        if self.evaluator.busy():
+            logger.info("pipeline: evaluator busy, skipping feedback for this version")
+        else:
+            self.evaluator.submit(info, on_done=lambda stats: self.events.put(("evaluated", (version, stats))))
+
+        if self.policy.check_success(self.success):
+            logger.info(f"pipeline: optimized {self.success} times, stopping: {self.policy.reason}")
+            self.stopping = True
+
+    def run(self):
+        generators = [threading.Thread(target=self._generate_worker, daemon=True) for _ in range(max(1, self.depth))]
+        workers = generators + [threading.Thread(target=self._machine_worker, daemon=True)]
+        for worker in workers:
+            worker.start()
+
+        start_time = time.time()
+        self._fill()
+        while self.outstanding > 0:
+            event, payload = self.events.get()
+            if event == "generated":
+                self.stats["generated"] += 1
+                if self.stopping:
+                    self.outstanding -= 1
+                    continue
+                logger.info(f"pipeline: candidate {payload.candidate_id} generated from version {payload.base_version}")
+                self.machine_queue.put(payload)
+            elif event == "skipped":
+                self.outstanding -= 1
+            elif event == "generation_failed":
+                logger.error(f"pipeline: generation failed: {payload}")
+                self.outstanding -= 1
+            elif event == "tested":
+                self._handle_tested(payload)
+            elif event == "evaluated":
+                version, stats = payload
+                logger.info(f"pipeline: evaluator ({stats['mode']}) for version {version}: {stats['prompt_tokens']} prompt + {stats['completion_tokens']} completion tokens, {stats['latency']:.1f}s")
+                if version == self.best_version and stats["feedback"]:
+                    self.evaluator_feedback = stats["feedback"]
+            self._fill()
+
+        for _ in generators:
+            self.generate_queue.put(STOP)
+        self.machine_queue.put(STOP)
+        for worker in workers:
+            worker.join()
+        self.evaluator.shutdown()
+
+        elapsed_hours = (time.time() - start_time) / 3600
+        self.stats["candidates_per_hour"] = round(self.stats["generated"] / elapsed_hours, 3) if elapsed_hours > 0 else 0.0
+        logger.info(f"pipeline: {self.stats}")
+        return self.success
@@ -1,67 +1,70 @@
-import subprocess
 import os
-import time
 import re
+import sys
 from dotenv import load_dotenv
 load_dotenv()
 USER_PREFIX = os.getenv('USER_PREFIX')
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from energy.src.registry import binary_name, compile_benchmark, expected_digest, get_benchmark, out_dir, output_digest, prepare_inputs, record_output_digest, run_command, stdin_path
+from energy.src.sandbox import Limits, run_sandboxed
+from differential_test import differential_test, write_failures
+import artifacts
+import tracing
 
 TEST_OUTPUT_FILE = f"{USER_PREFIX}/llm/src/output_logs/regression_test_log.txt"
 UNOPTIMIZED_OUTPUT = f"{USER_PREFIX}/llm/src/output_logs/unoptimized_output.txt"
 OPTIMIZED_OUTPUT = f"{USER_PREFIX}/llm/src/output_logs/optimized_output.txt"
-ITERATION_OUTPUT_DIR = f"{USER_PREFIX}/llm/src/output_logs//output_format_compare"
 
+# Returned when the compiled candidate is the same program as an earlier one
+DUPLICATE_CANDIDATE = 2
+# Returned when the candidate ran out of time, CPU time, memory, output size or processes
+LIMIT_EXCEEDED = 3
+
+# Footprint of each original (peak RSS, CPU time, output size), the candidates' limits are derived from it
+original_footprints = {}
 false_positive_counter = 0
 comparison_count = 0
 output_different_counter = 0
-def compile_program(output_log, optimized):
-    try: 
-        # Redirect stdout and stderr to the regression_test_log file
-        if not optimized:
-            subprocess.run(
-                    ["make", "compile"], 
-                    check=True,
-                    stdout=output_log, 
-                    stderr=output_log  # Redirect stderr to the same file as stdout
-            )
-        else:
-            subprocess.run(
-                    ["make", "compile_optimized"], 
-                    check=True,
-                    stdout=output_log, 
-                    stderr=output_log  # Redirect stderr to the same file as stdout
-            )
-        print("regression_test: Makefile compile successfully.\n")
+def compile_program(output_log, entry, source_path, binary_path):
+    # Redirect stdout and stderr of the compiler to the regression_test_log file
+    with tracing.span("compile", file=os.path.basename(source_path)) as compile_span:
+        compiled = compile_benchmark(entry, source_path, binary_path, output_log=output_log, cwd=os.path.dirname(source_path))
+        compile_span["success"] = compiled
+    if compiled:
+        print("regression_test: compiled successfully.\n")
         return True
-    except subprocess.CalledProcessError as e:
-        print(f"regression_test: Makefile compile failed: {e}\n")
-        return False
-
-def run_program(exec_path, output_file, optimized):
-    # Run the make command and capture the output in a variable
-    if not optimized:
-        result = subprocess.run(["make", "run"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    else:
-        result = subprocess.run(["make", "run_optimized"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    
+    print(f"regression_test: compile of {os.path.basename(source_path)} failed\n")
+    return False
+
+def run_program(entry, exec_path, output_file, limits):
+    """Run the executable in the sandbox, returns the SandboxResult."""
+    directory = os.path.dirname(exec_path)
+    with tracing.span("run", file=os.path.basename(exec_path)) as run_span:
+        result = run_sandboxed(run_command(entry, exec_path), limits, stdin_path(entry, cwd=directory))
+        run_span["output_bytes"] = len(result.stdout)
+        run_span["cpu_seconds"] = result.footprint["cpu_seconds"]
+        run_span["violation"] = result.violation
+
+    if result.violation is not None:
+        with open(output_file, 'w+') as f:
+            f.write(f"Exceeded the {result.violation} limit")
+        print(f"Runtime error on {exec_path}: exceeded the {result.violation} limit {limits.to_dict()}")
+        return result
+
     # Check for errors
     if result.returncode != 0:
         with open(output_file, 'w+') as f:
-            f.write(result.stderr)
-        print(f"Runtime error on {exec_path} with error message: {result.stderr}")
-        return False
-
-    # Filter out the unwanted lines
-    filtered_output = "\n".join(
-        line for line in result.stdout.splitlines()
-        if not (line.startswith("make[") or line.startswith("./"))
-    )
-    
-    # Write the filtered output to the file
+            f.write(result.stderr.decode(errors="replace"))
+        print(f"Runtime error on {exec_path} with error message: {result.stderr.decode(errors='replace')}")
+        return result
+
     with open(output_file, 'w+') as f:
-        f.write(filtered_output)
-    
-    return True
+        f.write(result.stdout.decode(errors="replace"))
+
+    return result
+
+def limit_hint(violation):
+    return f"Your previous answer exceeded the {violation} limit when it ran (the limits are a multiple of the original program's time, memory and output size). Keep the resource usage close to the original's."
 
 def process_output_content(content):
     """Remove all spaces, newline characters, and tabs for cleaner comparison."""
@@ -72,34 +75,16 @@ def process_output_content(content):
     return re.sub(r'\s+', '', content)
 
 def save_output(cleaned_content1, cleaned_content2, output_string):
-    global comparison_count
-    global false_positive_counter
-    global output_different_counter
-
-    filename = f"{ITERATION_OUTPUT_DIR}/output_compare.txt"
-    
-    # # Process and save the cleaned output content
-    # cleaned_content1 = process_output_content(file1_content)
-    # cleaned_content2 = process_output_content(file2_content)
-
-    # Compare the output without whitespace
-    # if cleaned_content1 == cleaned_content2:
-    #     compare = "Output correct, but format wrong"
-    #     false_positive_counter += 1
-    # else:
-    #     compare = "Output wrong"
-
-    with open(filename, 'a') as file:
-        file.write(f"{output_string}\n")
-        file.write(f"Number of comparison: {comparison_count}\n")
-        file.write(f"Number of output difference: {output_different_counter}\n")
-        file.write(f"Number of falise-positive: {false_positive_counter}\n")
-        file.write(f"Original:\n{cleaned_content1}\n")
-        file.write(f"Optimized:\n{cleaned_content2}\n\n")
-        
-    print(f"Saved output to {filename}")
+    # digests and the text around the first difference go to the run's artifact store, not the full outputs
+    window = artifacts.record_comparison(cleaned_content1, cleaned_content2, {
+        "result": output_string,
+        "comparison_count": comparison_count,
+        "output_different_count": output_different_counter,
+        "false_positive_count": false_positive_counter
+    })
     print(f"false positive count: {false_positive_counter}")
     print(f"comparison count: {comparison_count}")
+    return window
 
 def compare_outputs(file1, file2, output_log):
     global comparison_count
@@ -128,34 +113,95 @@ def compare_outputs(file1, file2, output_log):
             # call save_output to strip all whitespaces
             output_different_counter += 1
             # save_output(file1_content, file2_content)
-            save_output(cleaned_content1, cleaned_content2, "Output is Different sad :(")
-            output_log.write("Outputs are different.\n")
-            output_log.write(f"Original program output:\n{cleaned_content1}\n")
-            output_log.write(f"Optimized program output:\n{cleaned_content2}\n\n")
+            window = save_output(cleaned_content1, cleaned_content2, "Output is Different sad :(")
+            output_log.write(f"Outputs are different, first difference at character {window['first_difference']} (whitespace removed).\n")
+            output_log.write(f"Original program output:\n{window['expected_window']}\n")
+            output_log.write(f"Optimized program output:\n{window['actual_window']}\n\n")
             return False
 
-def regression_test(filename): 
-    unoptimized_file_exec = f"{USER_PREFIX}/llm/benchmarks_out/{filename.split('.')[0]}/{filename.split('.')[0]}"
-    optimized_file_exec = f"{USER_PREFIX}/llm/benchmarks_out/{filename.split('.')[0]}/optimized_{filename}"
+def regression_test(filename, candidate_index=None):
+    """Returns (result, violation): the violated limit when the result is LIMIT_EXCEEDED, else None."""
+    with tracing.span("regression_test", file=filename) as test_span:
+        result, violation = _regression_test(filename, candidate_index)
+        test_span["result"] = result
+    artifacts.record_file("regression_test_log", TEST_OUTPUT_FILE, {"file": filename, "result": result})
+    return result, violation
+
+def _regression_test(filename, candidate_index=None):
+    original_filename = filename[len("optimized_"):] if filename.startswith("optimized_") else filename
+    entry = get_benchmark(original_filename)
+    directory = out_dir(original_filename)
+    unoptimized_source = f"{directory}/{original_filename}"
+    optimized_source = f"{directory}/optimized_{original_filename}"
+    unoptimized_file_exec = f"{directory}/{binary_name(original_filename)}"
+    optimized_file_exec = f"{directory}/{binary_name(f'optimized_{original_filename}')}"
+
+    # main writes its result files to the current directory
+    os.chdir(directory)
 
-    # Needed for makefiles
-    os.chdir(f"{USER_PREFIX}/llm/benchmarks_out/{filename.split('.')[0].split('_')[-1]}")   
     with open(TEST_OUTPUT_FILE, 'w+') as output_log:
-        if not compile_program(output_log, False):
+        if not compile_program(output_log, entry, unoptimized_source, unoptimized_file_exec):
             # Return code when unoptimized file does not compile
-            return -2
-        if not compile_program(output_log, True):
+            return -2, None
+        # the original cannot run without its inputs either
+        input_error = prepare_inputs(entry)
+        if input_error is not None:
+            output_log.write(f"Inputs of {entry['name']} could not be generated: {input_error}\n")
+            return -2, None
+        if not compile_program(output_log, entry, optimized_source, optimized_file_exec):
             # Return code when optimized file does not compile
-            return -1
-
-        run_program(unoptimized_file_exec, UNOPTIMIZED_OUTPUT, False)
-        run_program(optimized_file_exec, OPTIMIZED_OUTPUT, True)
+            return -1, None
+
+        # Skip the runs when the executable matches an earlier candidate
+        if candidate_index is not None:
+            if candidate_index.check_binary(optimized_file_exec) is not None:
+                tracing.current()["cache_hit"] = True
+                output_log.write("Optimized executable is identical to an earlier candidate.\n")
+                return DUPLICATE_CANDIDATE, None
+
+        # The original runs once per benchmark to get the footprint the candidate is limited to,
+        # before any candidate run, so the first candidate is limited as well
+        original = None
+        if entry["name"] not in original_footprints:
+            original = run_program(entry, unoptimized_file_exec, UNOPTIMIZED_OUTPUT, Limits.from_footprint(None, entry["timeout"]))
+            if original.violation is None and original.returncode == 0:
+                original_footprints[entry["name"]] = original.footprint
+
+        # Many small and edge-case inputs in parallel first, most wrong candidates fail here without the production run
+        failures = differential_test(entry, unoptimized_file_exec, optimized_file_exec, unoptimized_source, original_footprints.get(entry["name"]))
+        if failures:
+            write_failures(output_log, failures)
+            violations = [failure["violation"] for failure in failures if failure["kind"] == "limit"]
+            if len(violations) == len(failures):
+                return LIMIT_EXCEEDED, violations[0]
+            return 0, None
+
+        limits = Limits.from_footprint(original_footprints.get(entry["name"]), entry["timeout"])
+        optimized = run_program(entry, optimized_file_exec, OPTIMIZED_OUTPUT, limits)
+        if optimized.violation is not None:
+            output_log.write(f"Optimized program exceeded the {optimized.violation} limit {limits.to_dict()}.\n\n")
+            return LIMIT_EXCEEDED, optimized.violation
+
+        # The original's output is known from the registry, only run it to show a difference
+        digest = expected_digest(entry)
+        # the raw bytes, as record_digests hashed them (the output file is decoded text)
+        if digest is not None and output_digest(optimized.stdout) == digest:
+            tracing.current()["cache_hit"] = True
+            output_log.write("Regression test successful. Output matches the registry digest.\n\n")
+            # a profile-guided build of the version is checked against it, without running anything again
+            record_output_digest(optimized_file_exec, optimized.stdout)
+            return 1, None
+        if original is None:
+            original = run_program(entry, unoptimized_file_exec, UNOPTIMIZED_OUTPUT, Limits.from_footprint(None, entry["timeout"]))
 
         if not compare_outputs(UNOPTIMIZED_OUTPUT, OPTIMIZED_OUTPUT, output_log):
-            return 0
+            return 0, None
         else:
             output_log.write("Regression test successful. Outputs are the same.\n\n")
-            return 1
+            record_output_digest(optimized_file_exec, optimized.stdout)
+            if original.returncode == 0:
+                record_output_digest(unoptimized_file_exec, original.stdout)
+            return 1, None
 
 if __name__ == "__main__":
-    regression_test("binarytrees.c", "optimized_binarytrees.c", "binarytrees")
\ No newline at end of file
+    regression_test("optimized_binarytrees.gpp-9.c++")
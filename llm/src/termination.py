@@ -0,0 +1,123 @@
+from dotenv import load_dotenv
+import os
+import time
+from llm_usage import total_cost, total_tokens
+
+load_dotenv()
+
+# Termination reasons recorded in the results
+MAX_ITERATIONS = "max_iterations"
+CONVERGED = "converged"
+WALL_TIME_BUDGET = "wall_time_budget"
+TOKEN_BUDGET = "token_budget"
+COST_BUDGET = "cost_budget"
+ENERGY_BUDGET = "energy_budget"
+
+def _env_number(name, default=None, cast=float):
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return cast(value)
+
+class TerminationPolicy():
+    """Decides when master_script should stop optimizing a benchmark.
+
+    The loop stops after max_iterations successful optimizations, when the best
+    energy has not improved by more than noise_factor standard deviations over
+    the last convergence_window successes, or when any budget is used up.
+    Budgets left as None are not enforced.
+    """
+    def __init__(self, max_iterations=5, convergence_window=3, noise_factor=2.0,
+                 max_wall_time=None, max_tokens=None, max_cost=None, max_energy=None):
+        self.max_iterations = max_iterations
+        self.convergence_window = convergence_window
+        self.noise_factor = noise_factor
+        self.max_wall_time = max_wall_time
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.max_energy = max_energy
+
+        self.start_time = time.time()
+        self.measurement_energy = 0.0
+        # (avg_energy, energy_std) of every successful iteration, original first
+        self.history = []
+        self.reason = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_iterations=_env_number("MAX_ITERATIONS", 5, int),
+            convergence_window=_env_number("CONVERGENCE_WINDOW", 3, int),
+            noise_factor=_env_number("CONVERGENCE_NOISE_FACTOR", 2.0),
+            max_wall_time=_env_number("MAX_WALL_TIME"),
+            max_tokens=_env_number("MAX_TOKENS", cast=int),
+            max_cost=_env_number("MAX_API_COST"),
+            max_energy=_env_number("MAX_MEASUREMENT_ENERGY")
+        )
+
+    def record_original(self, avg_energy, energy_std):
+        self.history.insert(0, (avg_energy, energy_std))
+
+    def record_iteration(self, avg_energy, energy_std, measurement_energy):
+        self.history.append((avg_energy, energy_std))
+        self.measurement_energy += measurement_energy
+
+    def elapsed(self):
+        return time.time() - self.start_time
+
+    def check_budget(self):
+        """Checked before paying for another LLM call, compile and measurement."""
+        if self.max_wall_time is not None and self.elapsed() >= self.max_wall_time:
+            return self._stop(WALL_TIME_BUDGET)
+        if self.max_tokens is not None and total_tokens() >= self.max_tokens:
+            return self._stop(TOKEN_BUDGET)
+        if self.max_cost is not None and total_cost() >= self.max_cost:
+            return self._stop(COST_BUDGET)
+        if self.max_energy is not None and self.measurement_energy >= self.max_energy:
+            return self._stop(ENERGY_BUDGET)
+        return None
+
+    def check_success(self, success):
+        """Checked after every successful (measured) iteration."""
+        if success >= self.max_iterations:
+            return self._stop(MAX_ITERATIONS)
+        if self.is_converged():
+            return self._stop(CONVERGED)
+        return self.check_budget()
+
+    def is_converged(self):
+        # Need the window plus at least one earlier version to compare against
+        window = self.convergence_window
+        if window <= 0 or len(self.history) <= window:
+            return False
+
+        best_before = min(energy for energy, _ in self.history[:-window])
+        best_in_window = min(energy for energy, _ in self.history[-window:])
+        stds = [std for _, std in self.history[-window:]]
+        noise = self.noise_factor * (sum(stds) / len(stds))
+        return best_before - best_in_window <= noise
+
+    def _stop(self, reason):
+        self.reason = reason
+        return reason
+
+    def get_state(self):
+        return {
+            "elapsed": self.elapsed(),
+            "measurement_energy": self.measurement_energy,
+            "history": list(self.history)
+        }
+
+    def set_state(self, state):
+        # time spent while the run was down does not count against the budget
+        self.start_time = time.time() - state["elapsed"]
+        self.measurement_energy = state["measurement_energy"]
+        self.history = list(state["history"])
+
+    def summary(self):
+        return {
+            "termination_reason": self.reason,
+            "elapsed_seconds": round(self.elapsed(), 3),
+            "measurement_energy": round(self.measurement_energy, 3),
+            "successful_iterations": max(len(self.history) - 1, 0)
+        }
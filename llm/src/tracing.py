@@ -0,0 +1,193 @@
+import functools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from dotenv import load_dotenv
+from llm_usage import get_usage
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from energy.src.energy_meter import account, stage_of
+
+load_dotenv()
+USER_PREFIX = os.getenv('USER_PREFIX')
+
+TRACE_DIR = f"{USER_PREFIX}/llm/traces"
+
+_lock = threading.Lock()
+_local = threading.local()
+trace = {
+    "path": None
+}
+
+def start_trace(benchmark):
+    """Spans from now on go to llm/traces/<benchmark>-<timestamp>.jsonl."""
+    os.makedirs(TRACE_DIR, exist_ok=True)
+    with _lock:
+        trace["path"] = f"{TRACE_DIR}/{benchmark}-{time.strftime('%Y%m%d-%H%M%S')}.jsonl"
+    return trace["path"]
+
+def _tokens():
+    usage = get_usage()
+    return usage["prompt_tokens"], usage["completion_tokens"]
+
+class Span():
+    """A timed stage. Attributes set on it (span["output_bytes"] = ...) are exported with it.
+
+    Every span records wall time, the CPU time of child processes that ended
+    meanwhile, the LLM tokens used meanwhile and, with an energy meter, the
+    machine's energy meanwhile. These are process- or machine-wide, so spans
+    overlapping on other threads are counted as well. Spans of pipeline
+    stages also book their energy to the stage in energy_meter.account.
+    """
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.thread = threading.get_ident()
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        self.start = time.time()
+        self.start_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self.start_tokens = _tokens()
+        self.stage = stage_of(name)
+        self.start_energy = account.enter(self.stage) if self.stage else account.read()
+        self.ended = False
+
+    def __setitem__(self, key, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.end()
+        return False
+
+    def end(self):
+        if self.ended:
+            return
+        self.ended = True
+        duration = time.time() - self.start
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        prompt_tokens, completion_tokens = _tokens()
+        end_energy = account.exit(self.stage) if self.stage else account.read()
+        stack = getattr(_local, "stack", [])
+        if self in stack:
+            stack.remove(self)
+        record = {
+            "name": self.name,
+            "parent": self.parent,
+            "start": round(self.start, 6),
+            "duration": round(duration, 6),
+            "thread": self.thread,
+            "child_cpu_seconds": round(children.ru_utime + children.ru_stime - self.start_children.ru_utime - self.start_children.ru_stime, 6),
+            "prompt_tokens": prompt_tokens - self.start_tokens[0],
+            "completion_tokens": completion_tokens - self.start_tokens[1],
+            "energy_j": round(end_energy - self.start_energy, 3) if end_energy is not None else None,
+            **self.attributes
+        }
+        with _lock:
+            if trace["path"] is None:
+                return
+            with open(trace["path"], "a") as file:
+                file.write(json.dumps(record, default=str) + "\n")
+
+def span(name, **attributes):
+    """with span("compile", file=...) as s: ... ; or s = span(...) ... s.end()"""
+    return Span(name, **attributes)
+
+def traced(name):
+    """Decorator form of span for a whole function."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with Span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def current():
+    """Innermost open span of this thread, None outside of any span."""
+    stack = getattr(_local, "stack", None)
+    return stack[-1] if stack else None
+
+def load_spans(path):
+    with open(path, "r") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+def export_chrome(path, out_path=None):
+    """Chrome trace event format (chrome://tracing, Perfetto) of a JSONL trace."""
+    out_path = out_path or path.rsplit(".", 1)[0] + ".trace.json"
+    spans = load_spans(path)
+    threads = {}
+    events = []
+    for record in spans:
+        tid = threads.setdefault(record["thread"], len(threads) + 1)
+        args = {key: value for key, value in record.items() if key not in ("name", "start", "duration", "thread")}
+        events.append({"name": record["name"], "ph": "X", "ts": int(record["start"] * 1e6), "dur": int(record["duration"] * 1e6), "pid": 1, "tid": tid, "args": args})
+    with open(out_path, "w") as file:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+    return out_path
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+def summarize(path):
+    """Per-stage count, total, share of the run and p50/p90/p99/max durations."""
+    spans = load_spans(path)
+    if not spans:
+        return {}
+    run_time = max(record["start"] + record["duration"] for record in spans) - min(record["start"] for record in spans)
+    stages = {}
+    for record in spans:
+        stages.setdefault(record["name"], []).append(record)
+    summary = {}
+    for name, records in stages.items():
+        durations = [record["duration"] for record in records]
+        summary[name] = {
+            "count": len(records),
+            "total": round(sum(durations), 3),
+            "share": round(sum(durations) / run_time, 4) if run_time > 0 else 0.0,
+            "p50": round(_percentile(durations, 0.5), 3),
+            "p90": round(_percentile(durations, 0.9), 3),
+            "p99": round(_percentile(durations, 0.99), 3),
+            "max": round(max(durations), 3),
+            "child_cpu_seconds": round(sum(record["child_cpu_seconds"] for record in records), 3),
+            "tokens": sum(record["prompt_tokens"] + record["completion_tokens"] for record in records),
+            "energy_j": round(sum(record.get("energy_j") or 0.0 for record in records), 3),
+            "cache_hits": sum(1 for record in records if record.get("cache_hit"))
+        }
+    return summary
+
+def print_summary(path):
+    summary = summarize(path)
+    print(f"{'stage':28} {'count':>6} {'total s':>10} {'share':>7} {'p50 s':>9} {'p90 s':>9} {'p99 s':>9} {'max s':>9} {'child cpu s':>12} {'tokens':>9} {'energy J':>10} {'hits':>5}")
+    for name, stage in sorted(summary.items(), key=lambda item: -item[1]["total"]):
+        print(f"{name:28} {stage['count']:>6} {stage['total']:>10} {stage['share']:>7.1%} {stage['p50']:>9} {stage['p90']:>9} {stage['p99']:>9} {stage['max']:>9} {stage['child_cpu_seconds']:>12} {stage['tokens']:>9} {stage['energy_j']:>10} {stage['cache_hits']:>5}")
+
+def latest_trace(benchmark=None):
+    traces = sorted((name for name in os.listdir(TRACE_DIR) if name.endswith(".jsonl") and (benchmark is None or name.startswith(f"{benchmark}-"))),
+                    key=lambda name: os.path.getmtime(f"{TRACE_DIR}/{name}"))
+    return f"{TRACE_DIR}/{traces[-1]}" if traces else None
+
+if __name__ == "__main__":
+    # python3 llm/src/tracing.py summary [trace.jsonl | benchmark]
+    # python3 llm/src/tracing.py chrome [trace.jsonl | benchmark] [out.json]
+    command = sys.argv[1] if len(sys.argv) > 1 else "summary"
+    target = sys.argv[2] if len(sys.argv) > 2 else None
+    path = target if target is not None and os.path.isfile(target) else latest_trace(target)
+    if path is None:
+        print(f"tracing: no trace found in {TRACE_DIR}")
+        sys.exit(1)
+    if command == "chrome":
+        print(f"tracing: wrote {export_chrome(path, sys.argv[3] if len(sys.argv) > 3 else None)}")
+    else:
+        print(f"Trace: {path}")
+        print_summary(path)
@@ -0,0 +1,44 @@
+import json
+import os
+import sys
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import artifacts
+
+@pytest.fixture
+def run_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(artifacts, "ARTIFACT_DIR", str(tmp_path))
+    return artifacts.start_run("nbody")
+
+def manifest(run_dir):
+    with open(f"{run_dir}/manifest.jsonl", "r") as file:
+        return [json.loads(line) for line in file]
+
+def test_identical_contents_are_stored_once(run_dir):
+    artifacts.record("prompt", "same prompt", {"iteration": 1})
+    artifacts.record("prompt", "same prompt", {"iteration": 2})
+    artifacts.record("response", "other")
+    stats = artifacts.get_stats()
+    assert stats["records"] == 3 and stats["deduplicated"] == 1
+    records = manifest(run_dir)
+    assert records[0]["blob"] == records[1]["blob"] and records[0]["iteration"] != records[1]["iteration"]
+    assert len([name for _, _, names in os.walk(f"{run_dir}/blobs") for name in names]) == 2
+
+def test_blobs_over_the_budget_are_only_listed(run_dir, monkeypatch):
+    monkeypatch.setattr(artifacts, "MAX_RUN_BYTES", 0)
+    artifacts.record("log", "too much")
+    assert artifacts.get_stats()["dropped"] == 1
+    assert manifest(run_dir)[0]["dropped"] and "blob" not in manifest(run_dir)[0]
+
+def test_old_runs_are_pruned(tmp_path, monkeypatch):
+    monkeypatch.setattr(artifacts, "ARTIFACT_DIR", str(tmp_path))
+    monkeypatch.setattr(artifacts, "MAX_RUNS", 2)
+    for run in ("20260101-000000", "20260102-000000", "20260103-000000"):
+        os.makedirs(tmp_path / "nbody" / run)
+    artifacts.start_run("nbody")
+    assert len(os.listdir(tmp_path / "nbody")) == 2
+
+def test_diff_window_ignores_whitespace():
+    assert "first_difference" not in artifacts.diff_window("1 2\n3", "123")
+    window = artifacts.diff_window("12345", "12x45")
+    assert window["first_difference"] == 2 and window["actual_window"] == "12x45"
@@ -0,0 +1,66 @@
+import os
+import shutil
+import subprocess
+import sys
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+from candidate_index import CandidateIndex, source_digest, declared_identifiers, tokenize
+
+def test_library_calls_after_operators_keep_their_names():
+    assert source_digest("double r = a * sqrt(b);") != source_digest("double r = a * exp(b);")
+    assert source_digest("double r = f(a & g(b));") != source_digest("double r = f(a & h(b));")
+    assert source_digest("bool r = a > sqrt(b);") != source_digest("bool r = a > exp(b);")
+
+def test_renamed_declarations_collide():
+    first = "static double scale(const Node &node, double *out) { double total = node.v * sqrt(out[0]); return total; }"
+    second = "static double factor(const Node &n, double *res) { double sum = n.v * sqrt(res[0]); return sum; }"
+    assert source_digest(first) == source_digest(second)
+
+def test_declarations():
+    tokens = tokenize("std::vector<int> values(3); Node *left = nullptr; for (auto &x : values) total += x * y;")
+    assert declared_identifiers(tokens) == {"values", "left", "x"}
+
+MAIN = '''#include <cmath>
+#include <cstdio>
+int main(int argc, char **argv) {
+    double a = argc, b = argc + 1;
+    double r = a * %s(b);
+    std::printf("%%f\\n", r);
+    return 0;
+}
+'''
+
+def compile_source(tmp_path, name, source):
+    source_path = tmp_path / f"{name}.c++"
+    source_path.write_text(source)
+    binary_path = tmp_path / f"{name}.gpp_run"
+    subprocess.run(["g++", "-O2", "-x", "c++", str(source_path), "-o", str(binary_path)], check=True)
+    return str(binary_path)
+
+def test_lookup_source_keeps_different_library_calls_apart(tmp_path):
+    index = CandidateIndex("x.c++", str(tmp_path / "index.json"))
+    index.record(MAIN % "sqrt", 1, iteration=1, avg_energy=10.0)
+    assert index.lookup_source(MAIN % "exp") is None
+    # the same program with a comment and renamed locals is a duplicate
+    renamed = (MAIN % "sqrt").replace("double r", "// result\n    double value").replace("r);", "value);")
+    assert index.lookup_source(renamed)["iteration"] == 1
+
+@pytest.mark.skipif(shutil.which("g++") is None, reason="needs g++")
+def test_check_binary(tmp_path):
+    index = CandidateIndex("x.c++", str(tmp_path / "index.json"))
+    assert index.check_binary(compile_source(tmp_path, "sqrt", MAIN % "sqrt")) is None
+    index.record(MAIN % "sqrt", 1, iteration=1)
+    assert index.check_binary(compile_source(tmp_path, "exp", MAIN % "exp")) is None
+    assert index.check_binary(compile_source(tmp_path, "commented", "// same program\n" + MAIN % "sqrt"))["iteration"] == 1
+    assert index.check_binary(str(tmp_path / "missing.gpp_run")) is None
+
+def test_failures_only_match_within_their_run(tmp_path):
+    path = str(tmp_path / "index.json")
+    index = CandidateIndex("x.c++", path)
+    index.record(MAIN % "sqrt", 3)
+    index.record(MAIN % "exp", 1, iteration=2)
+    assert index.lookup_source(MAIN % "sqrt")["regression_result"] == 3
+
+    next_run = CandidateIndex("x.c++", path)
+    assert next_run.lookup_source(MAIN % "sqrt") is None
+    assert next_run.lookup_source(MAIN % "exp")["iteration"] == 2
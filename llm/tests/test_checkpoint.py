@@ -0,0 +1,36 @@
+import os
+import sys
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import checkpoint
+
+@pytest.fixture
+def paths(tmp_path, monkeypatch):
+    files = {"optimized": str(tmp_path / "optimized_x.c++"), "compiled": str(tmp_path / "x.compiled.c++")}
+    monkeypatch.setattr(checkpoint, "CHECKPOINT_DIR", str(tmp_path / "checkpoints"))
+    monkeypatch.setattr(checkpoint, "EVALUATOR_FEEDBACK_FILE", str(tmp_path / "feedback.txt"))
+    monkeypatch.setattr(checkpoint, "benchmark_paths", lambda filename: files)
+    return files
+
+def test_round_trip_restores_sources(paths):
+    with open(paths["optimized"], "w") as file:
+        file.write("candidate")
+    checkpoint.save_checkpoint("x.c++", "measure", {"success": 2}, {"elapsed": 1.0}, {}, {0: ("src", 1.0, 1.0)}, {})
+    os.remove(paths["optimized"])
+
+    restored = checkpoint.load_checkpoint("x.c++")
+    assert restored["stage"] == "measure" and restored["benchmark_data"][0][1] == 1.0
+    checkpoint.restore_files(restored)
+    with open(paths["optimized"]) as file:
+        assert file.read() == "candidate"
+    assert not os.path.exists(paths["compiled"])
+
+def test_iteration_snapshot_and_clear(paths):
+    checkpoint.save_checkpoint("x.c++", "optimize", {"success": 3}, {}, {}, {}, {})
+    assert os.path.isfile(f"{checkpoint.checkpoint_dir('x.c++')}/iteration_3.pkl")
+    checkpoint.clear_checkpoint("x.c++")
+    assert checkpoint.load_checkpoint("x.c++") is None
+
+def test_unknown_stage(paths):
+    with pytest.raises(ValueError):
+        checkpoint.save_checkpoint("x.c++", "deploy", {"success": 0}, {}, {}, {}, {})
@@ -0,0 +1,12 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import differential_test
+from differential_test import differential_jobs
+
+def test_multithreaded_entries_run_one_at_a_time(monkeypatch):
+    monkeypatch.setattr(differential_test, "DIFFERENTIAL_JOBS", None)
+    assert differential_jobs({"threading": "none"}) == (os.cpu_count() or 1)
+    assert differential_jobs({"threading": "openmp"}) == 1
+    monkeypatch.setattr(differential_test, "DIFFERENTIAL_JOBS", 3)
+    assert differential_jobs({"threading": "pthreads"}) == 3
@@ -0,0 +1,74 @@
+import os
+import sys
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import knowledge_base
+from knowledge_base import IMPROVED, NO_GAIN, KnowledgeBase, hot_terms
+
+BASE = "int main() {\n    return 0;\n}\n"
+
+def version(body):
+    return "int main() {\n" + body + "\n    return 0;\n}\n"
+
+@pytest.fixture
+def kb(tmp_path):
+    return KnowledgeBase(str(tmp_path / "knowledge_base.jsonl"))
+
+def improved(kb, benchmark, body, energy=80.0):
+    return kb.record(benchmark, "mock", BASE, version(body), 1, (100.0, 1.0), (energy, 1.0))
+
+def test_hot_terms_weigh_loop_bodies():
+    weights = hot_terms("int n = 4;\nfor (int i = 0; i < n; i++) {\n    total += values[i];\n}\n")
+    assert weights["values"] == knowledge_base.LOOP_WEIGHT and weights["total"] == knowledge_base.LOOP_WEIGHT
+    # the loop header counts as part of the loop
+    assert weights["n"] == 1 + knowledge_base.LOOP_WEIGHT
+    assert "for" not in weights and "int" not in weights
+
+def test_outcome_of_a_record(kb):
+    assert improved(kb, "nbody", "    reserve(bodies);")["outcome"] == IMPROVED
+    assert improved(kb, "nbody", "    shrink(bodies);", energy=99.0)["outcome"] == NO_GAIN
+    assert kb.record("nbody", "mock", BASE, version("    broken("), -1)["outcome"] == "compile_error"
+    # no diff, or the same diff again, is not recorded
+    assert kb.record("nbody", "mock", BASE, BASE, 1) is None
+    assert improved(kb, "nbody", "    reserve(bodies);") is None
+    assert kb.stats()["entries"] == 3
+
+def test_search_returns_only_matching_diffs(kb):
+    improved(kb, "spectralnorm", "    matrix_times_vector(u, v);")
+    improved(kb, "spectralnorm", "    std::ios::sync_with_stdio(false);")
+    improved(kb, "spectralnorm", "    unroll(u, v, w, x);")
+    results = kb.search("for (;;) { sync_with_stdio(false); }")
+    # entries sharing no term with the query are not returned
+    assert len(results) == 1 and "+    std::ios::sync_with_stdio(false);" in results[0]["diff"]
+
+def test_rare_terms_outrank_common_ones(kb):
+    for benchmark in ("nbody", "spectralnorm", "mandelbrot"):
+        improved(kb, benchmark, f"    common(buffer_{benchmark});")
+    improved(kb, "fannkuchredux", "    common(rare);")
+    results = kb.search("common(rare); common(x);")
+    assert results[0]["benchmark"] == "fannkuchredux"
+
+def test_same_benchmark_boost_and_outcome_filter(kb):
+    improved(kb, "nbody", "    advance(bodies);")
+    improved(kb, "spectralnorm", "    advance(bodies);    ")
+    kb.record("spectralnorm", "mock", BASE, version("    advance(bodies, dt);"), 0)
+    assert kb.search("advance(bodies);", "spectralnorm")[0]["benchmark"] == "spectralnorm"
+    assert kb.search("advance(bodies);", "nbody")[0]["benchmark"] == "nbody"
+    failures = kb.search("advance(bodies);", "spectralnorm", ("output_differs",))
+    assert [entry["outcome"] for entry in failures] == ["output_differs"]
+
+def test_reload_picks_up_other_writers(kb):
+    improved(kb, "nbody", "    advance(bodies);")
+    other = KnowledgeBase(kb.path)
+    assert len(other.search("advance(bodies);")) == 1
+    improved(kb, "nbody", "    advance_fast(bodies);")
+    # another process appended, seen at the next search
+    os.utime(kb.path, (0, 0))
+    assert len(other.search("advance(bodies); advance_fast(bodies);")) == 2
+
+def test_prompt_section(kb):
+    assert kb.prompt_section("advance(bodies);", "nbody") == ""
+    improved(kb, "nbody", "    advance(bodies);")
+    kb.record("nbody", "mock", BASE, version("    advance(bodies, -1);"), 0, reason="checksum")
+    section = kb.prompt_section("advance(bodies);", "nbody")
+    assert "-20.0% energy" in section and "output differs (checksum)" in section
@@ -0,0 +1,36 @@
+import os
+import sys
+import threading
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+from pipeline import MeasurementGate
+
+def test_measurement_waits_for_calls_and_holds_new_ones():
+    gate = MeasurementGate(True)
+    events = []
+    call_started = threading.Event()
+
+    def call(name, delay):
+        with gate.llm_call():
+            events.append(f"{name} start")
+            call_started.set()
+            time.sleep(delay)
+            events.append(f"{name} end")
+
+    first = threading.Thread(target=call, args=("first", 0.2))
+    first.start()
+    call_started.wait()
+    with gate.measurement():
+        second = threading.Thread(target=call, args=("second", 0.0))
+        second.start()
+        time.sleep(0.1)
+        events.append("measured")
+    first.join()
+    second.join()
+    assert events == ["first start", "first end", "measured", "second start", "second end"]
+
+def test_disabled_gate_does_not_block():
+    gate = MeasurementGate(False)
+    with gate.measurement():
+        with gate.llm_call():
+            pass
@@ -0,0 +1,34 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+from termination import TerminationPolicy, CONVERGED, ENERGY_BUDGET, MAX_ITERATIONS
+
+def policy_with(energies, std=1.0, **kwargs):
+    policy = TerminationPolicy(**kwargs)
+    policy.record_original(energies[0], std)
+    for energy in energies[1:]:
+        policy.record_iteration(energy, std, 0.0)
+    return policy
+
+def test_converges_when_the_window_does_not_beat_the_noise():
+    policy = policy_with([100.0, 90.0, 89.5, 89.8, 90.2], convergence_window=3, noise_factor=2.0, max_iterations=10)
+    assert policy.check_success(4) == CONVERGED
+
+def test_keeps_going_while_the_window_improves():
+    policy = policy_with([100.0, 90.0, 80.0, 70.0, 60.0], convergence_window=3, noise_factor=2.0, max_iterations=10)
+    assert policy.check_success(4) is None
+
+def test_needs_a_version_before_the_window():
+    assert not policy_with([100.0, 100.0, 100.0], convergence_window=3).is_converged()
+
+def test_max_iterations_and_energy_budget():
+    assert policy_with([100.0, 50.0], max_iterations=1).check_success(1) == MAX_ITERATIONS
+    policy = TerminationPolicy(max_energy=10.0)
+    policy.record_iteration(90.0, 1.0, 12.0)
+    assert policy.check_budget() == ENERGY_BUDGET
+
+def test_state_round_trip():
+    policy = policy_with([100.0, 90.0])
+    restored = TerminationPolicy()
+    restored.set_state(policy.get_state())
+    assert restored.history == policy.history
@@ -0,0 +1,184 @@
+import argparse
+import gzip
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# The evaluator prompt starts with this, every other request asks for code
+EVALUATOR_MARKER = "code optimization and energy efficiency expert"
+SYNTHETIC_FEEDBACK = "1. Hoist loop-invariant work out of the inner loops.\n2. Reuse buffers instead of allocating per iteration.\n3. Batch output writes."
+
+def _read_blob(path):
+    with open(path, "rb") as file:
+        data = file.read()
+    if path.endswith(".zst"):
+        return zstandard.ZstdDecompressor().decompress(data).decode(errors="replace")
+    return gzip.decompress(data).decode(errors="replace")
+
+def load_recording(run_dir):
+    """Code responses and evaluator feedback of an llm/artifacts run, in the order they were recorded."""
+    code, feedback = [], []
+    with open(f"{run_dir}/manifest.jsonl", "r") as file:
+        for line in file:
+            record = json.loads(line)
+            if "blob" not in record:
+                continue
+            if record["kind"] in ("optimize_response", "compilation_error_response", "logic_error_response"):
+                code.append(_read_blob(f"{run_dir}/{record['blob']}"))
+            elif record["kind"] == "evaluator_feedback":
+                feedback.append(_read_blob(f"{run_dir}/{record['blob']}"))
+    return code, feedback
+
+def fill_schema(schema, definitions=None):
+    """Minimal JSON instance of a JSON schema, enough for the structured-output models of the prompts."""
+    definitions = definitions if definitions is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return fill_schema(definitions[schema["$ref"].split("/")[-1]], definitions)
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: fill_schema(value, definitions) for name, value in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [fill_schema(schema.get("items", {}), definitions)]
+    if kind in ("integer", "number"):
+        return 0
+    if kind == "boolean":
+        return False
+    return "mock"
+
+class MockLLM():
+    """Answers chat requests after a random delay, with recorded or synthetic responses.
+
+    Synthetic code is the benchmark's source with a distinct used global
+    appended, so every candidate compiles, passes the regression test and is
+    not a duplicate of the previous one.
+    """
+    def __init__(self, source_code, recording=None, latency=1.0, jitter=0.2, failure_rate=0.0, seed=0):
+        self.source_code = source_code
+        self.code, self.feedback = load_recording(recording) if recording else ([], [])
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {"code": 0, "evaluator": 0, "failed": 0}
+
+    def delay(self):
+        with self.lock:
+            return max(0.0, self.random.gauss(self.latency, self.jitter))
+
+    def fail(self):
+        with self.lock:
+            failed = self.random.random() < self.failure_rate
+            if failed:
+                self.counts["failed"] += 1
+            return failed
+
+    def respond(self, prompt):
+        """(kind, content) for the last user message."""
+        with self.lock:
+            if EVALUATOR_MARKER in prompt:
+                index = self.counts["evaluator"]
+                self.counts["evaluator"] += 1
+                return "evaluator", self.feedback[index % len(self.feedback)] if self.feedback else SYNTHETIC_FEEDBACK
+            index = self.counts["code"]
+            self.counts["code"] += 1
+            if self.code:
+                return "code", self.code[index % len(self.code)]
+            return "code", f"{self.source_code}\n__attribute__((used)) static volatile int mock_variant_{index} = {index};\n"
+
+def make_handler(mock):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path.rstrip("/") == "/api/pull":
+                self._send(200, {"status": "success"})
+                return
+            if self.path.rstrip("/") == "/api/generate":
+                # an empty prompt only loads the model
+                self._send(200, {"model": request.get("model"), "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "response": "", "done": True, "done_reason": "load"})
+                return
+            if self.path.rstrip("/") not in ("/v1/chat/completions", "/api/chat"):
+                self._send(404, {"error": f"unknown endpoint {self.path}"})
+                return
+
+            time.sleep(mock.delay())
+            if mock.fail():
+                self._send(503, {"error": {"message": "mock failure", "type": "server_error"}})
+                return
+
+            prompt = request["messages"][-1]["content"]
+            kind, content = mock.respond(prompt)
+            prompt_tokens = sum(len(message["content"]) for message in request["messages"]) // 4
+            completion_tokens = len(content) // 4
+
+            if self.path.startswith("/api/"):
+                # Ollama returns the raw text, the pipeline takes it as the code
+                self._send(200, {
+                    "model": request.get("model"),
+                    "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                    "message": {"role": "assistant", "content": content},
+                    "done": True,
+                    "done_reason": "stop",
+                    "prompt_eval_count": prompt_tokens,
+                    "eval_count": completion_tokens
+                })
+                return
+
+            response_format = request.get("response_format") or {}
+            if kind == "code" and response_format.get("type") == "json_schema":
+                structured = fill_schema(response_format["json_schema"]["schema"])
+                structured["final_code"] = content
+                content = json.dumps(structured)
+            self._send(200, {
+                "id": f"chatcmpl-mock-{mock.counts['code'] + mock.counts['evaluator']}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model"),
+                "choices": [{"index": 0, "finish_reason": "stop", "logprobs": None,
+                             "message": {"role": "assistant", "content": content, "refusal": None}}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+            })
+    return Handler
+
+def start_server(mock, port=0):
+    """Serve in a background thread, returns the server (server.server_address has the port)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(mock))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    # python3 llm/throughput/mock_llm_server.py <source file> [--recording llm/artifacts/<benchmark>/<run>] [--port 11435]
+    parser = argparse.ArgumentParser(description="OpenAI and Ollama compatible stand-in for the pipeline's LLM calls")
+    parser.add_argument("source", help="C++ source the synthetic code responses are based on")
+    parser.add_argument("--recording", help="llm/artifacts run directory whose responses are replayed")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=float(os.getenv("MOCK_LLM_LATENCY", 1.0)))
+    parser.add_argument("--jitter", type=float, default=float(os.getenv("MOCK_LLM_JITTER", 0.2)))
+    parser.add_argument("--failure-rate", type=float, default=float(os.getenv("MOCK_LLM_FAILURE_RATE", 0.0)))
+    args = parser.parse_args()
+    with open(args.source, "r") as file:
+        source_code = file.read()
+    server = start_server(MockLLM(source_code, args.recording, args.latency, args.jitter, args.failure_rate), args.port)
+    print(f"mock_llm_server: listening on http://127.0.0.1:{server.server_address[1]} (OPENAI_BASE_URL=http://127.0.0.1:{server.server_address[1]}/v1, OLLAMA_HOST=http://127.0.0.1:{server.server_address[1]})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
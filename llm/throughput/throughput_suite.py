@@ -0,0 +1,150 @@
+import argparse
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from dotenv import load_dotenv
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from mock_llm_server import MockLLM, start_server
+from energy.src.registry import benchmark_names, get_benchmark
+
+load_dotenv()
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../..'))
+RESULTS_DIR = f"{REPO_DIR}/llm/throughput/results"
+# Main-thread spans that are waiting on the LLM or a child process; the rest of a run is driver time
+LEAF_SPANS = ("llm.optimize", "llm.compilation_error", "llm.logic_error", "llm.evaluator", "compile", "run", "differential_test", "rapl_measure", "remote_measure")
+IGNORED_DIRS = (".git", "__pycache__", "artifacts", "traces", "reference_outputs", "results")
+
+def _main_thread_spans(spans):
+    """Spans on the thread that ran the first iteration, the one driving the run."""
+    iterations = [record for record in spans if record["name"] == "iteration"]
+    if not iterations:
+        return spans
+    return [record for record in spans if record["thread"] == iterations[0]["thread"]]
+
+def _leaf_time(spans):
+    """Wall time covered by leaf spans, overlapping intervals counted once."""
+    intervals = sorted((record["start"], record["start"] + record["duration"]) for record in spans if record["name"] in LEAF_SPANS)
+    total, end = 0.0, None
+    for start, stop in intervals:
+        if end is None or start > end:
+            total += stop - start
+            end = stop
+        elif stop > end:
+            total += stop - end
+            end = stop
+    return total
+
+def run_benchmark(benchmark, model, mode, iterations, timeout, mock):
+    """One optimization run of a copy of the repository against the mock server, returns its metrics."""
+    import tracing
+
+    entry = get_benchmark(benchmark)
+    work_dir = tempfile.mkdtemp(prefix="eedc-throughput-")
+    try:
+        shutil.copytree(REPO_DIR, f"{work_dir}/repo", ignore=shutil.ignore_patterns(*IGNORED_DIRS))
+        prefix = f"{work_dir}/repo"
+        server = start_server(mock)
+        port = server.server_address[1]
+        env = dict(os.environ,
+                   USER_PREFIX=prefix,
+                   OPENAI_BASE_URL=f"http://127.0.0.1:{port}/v1",
+                   OLLAMA_HOST=f"http://127.0.0.1:{port}",
+                   API_KEY="mock",
+                   ENERGY_BACKEND=os.getenv("ENERGY_BACKEND", "simulated"),
+                   PRODUCTION_INPUT=os.getenv("PRODUCTION_INPUT", "small"),
+                   MAX_ITERATIONS=str(iterations),
+                   MAX_WALL_TIME=str(timeout))
+        command = [sys.executable, "llm/src/main.py", "run", entry["source"], model] + ([mode] if mode else [])
+        print(f"run_benchmark: {benchmark} ({model}{', ' + mode if mode else ''}), {iterations} iterations")
+        start = time.time()
+        try:
+            process = subprocess.run(command, cwd=prefix, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout * 2)
+            returncode = process.returncode
+            output = process.stdout.decode(errors="replace")
+        except subprocess.TimeoutExpired as e:
+            returncode = None
+            output = (e.stdout or b"").decode(errors="replace")
+        wall_time = time.time() - start
+        server.shutdown()
+
+        result = {"benchmark": benchmark, "model": model, "mode": mode or "serial", "returncode": returncode, "wall_seconds": round(wall_time, 3), "mock_requests": dict(mock.counts)}
+        # main.py writes it to whatever directory the last stage changed into
+        summaries = glob.glob(f"{prefix}/**/run_summary.txt", recursive=True)
+        if not summaries:
+            result["error"] = output[-2000:]
+            return result
+        with open(max(summaries, key=os.path.getmtime), "r") as file:
+            summary = json.load(file)
+        trace_path = summary["trace"]["jsonl"]
+        spans = tracing.load_spans(trace_path) if os.path.isfile(trace_path) else []
+        stages = tracing.summarize(trace_path) if spans else {}
+        main_spans = _main_thread_spans(spans)
+        driver_time = max(0.0, wall_time - _leaf_time(main_spans))
+        candidates = stages.get("stage.regression_test", stages.get("regression_test", {})).get("count", 0)
+        result.update({
+            "termination_reason": summary.get("termination_reason"),
+            "successes": summary.get("successful_iterations"),
+            "candidates": candidates,
+            "successes_per_hour": round(3600 * (summary.get("successful_iterations") or 0) / wall_time, 2),
+            "candidates_per_hour": round(3600 * candidates / wall_time, 2),
+            "driver_seconds": round(driver_time, 3),
+            "driver_share": round(driver_time / wall_time, 4),
+            "driver_peak_rss_kb": summary.get("driver_peak_rss_kb"),
+            "tokens": summary.get("llm_usage", {}).get("total_tokens"),
+            "optimization_joules": summary.get("net_energy", {}).get("optimization_joules"),
+            "break_even_executions": summary.get("net_energy", {}).get("break_even_executions"),
+            "stages": {name: {key: stage[key] for key in ("count", "total", "share", "p50", "p90")} for name, stage in stages.items()}
+        })
+        return result
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def print_results(results):
+    print(f"{'benchmark':16} {'mode':9} {'wall s':>8} {'cand/h':>8} {'succ/h':>8} {'driver s':>9} {'driver':>7} {'rss kb':>9} {'opt J':>9} {'break-even':>10} {'stop':>16}")
+    for result in results:
+        if "error" in result:
+            print(f"{result['benchmark']:16} {result['mode']:9} {result['wall_seconds']:>8} failed (exit {result['returncode']})")
+            continue
+        print(f"{result['benchmark']:16} {result['mode']:9} {result['wall_seconds']:>8} {result['candidates_per_hour']:>8} {result['successes_per_hour']:>8} "
+              f"{result['driver_seconds']:>9} {result['driver_share']:>7.1%} {result['driver_peak_rss_kb'] or '-':>9} {result['optimization_joules'] or '-':>9} {result['break_even_executions'] or '-':>10} {result['termination_reason'] or '-':>16}")
+    for result in results:
+        if "stages" not in result:
+            continue
+        print(f"\n{result['benchmark']} ({result['mode']}) stages:")
+        for name, stage in sorted(result["stages"].items(), key=lambda item: -item[1]["total"]):
+            print(f"  {name:28} {stage['count']:>5} {stage['total']:>9} s {stage['share']:>7.1%}  p50 {stage['p50']} s  p90 {stage['p90']} s")
+
+if __name__ == "__main__":
+    # python3 llm/throughput/throughput_suite.py [benchmark ...] [--mode pipeline] [--iterations 3] [--latency 1.0]
+    parser = argparse.ArgumentParser(description="Iterations per hour and driver overhead of the pipeline, with a mock LLM and simulated energy")
+    parser.add_argument("benchmarks", nargs="*", default=benchmark_names(), help="default: every benchmark in the registry")
+    parser.add_argument("--model", default="openai", help="openai, or any name to use the Ollama client")
+    parser.add_argument("--mode", default=None, help="extra main.py argument, e.g. pipeline")
+    parser.add_argument("--iterations", type=int, default=int(os.getenv("THROUGHPUT_ITERATIONS", 3)))
+    parser.add_argument("--timeout", type=float, default=float(os.getenv("THROUGHPUT_TIMEOUT", 900)), help="wall-time budget of one run in seconds")
+    parser.add_argument("--latency", type=float, default=float(os.getenv("MOCK_LLM_LATENCY", 1.0)))
+    parser.add_argument("--jitter", type=float, default=float(os.getenv("MOCK_LLM_JITTER", 0.2)))
+    parser.add_argument("--failure-rate", type=float, default=float(os.getenv("MOCK_LLM_FAILURE_RATE", 0.0)))
+    parser.add_argument("--recording", default=None, help="llm/artifacts run directory whose responses are replayed")
+    args = parser.parse_args()
+
+    results = []
+    for benchmark in args.benchmarks:
+        entry = get_benchmark(benchmark)
+        with open(f"{REPO_DIR}/llm/llm_input_files/input_code/{entry['source']}", "r") as file:
+            mock = MockLLM(file.read(), args.recording, args.latency, args.jitter, args.failure_rate)
+        results.append(run_benchmark(benchmark, args.model, args.mode, args.iterations, args.timeout, mock))
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    results_path = f"{RESULTS_DIR}/throughput-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(results_path, "w") as file:
+        json.dump({"settings": vars(args), "results": results}, file, indent=4)
+    print_results(results)
+    print(f"\nthroughput_suite: results written to {results_path}")